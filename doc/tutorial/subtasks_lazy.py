@@ -0,0 +1,9 @@
+from doit.loader import lazy_subtasks
+
+@lazy_subtasks
+def task_create_file():
+    for i in range(100000):
+        filename = "file%d.txt" % i
+        yield {'name': filename,
+               'actions': ["touch %s" % filename],
+               'targets': [filename]}
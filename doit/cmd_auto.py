@@ -54,7 +54,10 @@ class Auto(DoitCmdBase):
             def handle_event(self, event):
                 this_list = [t.clone() for t in auto_cmd.task_list]
                 cmd_run = Run(dep_file=auto_cmd.dep_file, task_list=this_list,
-                              sel_tasks=watch_tasks)
+                              sel_tasks=watch_tasks,
+                              backend=auto_cmd.backend,
+                              checksum=auto_cmd.checksum,
+                              checksum_threads=auto_cmd.checksum_threads)
                 cmd_run._execute(sys.stdout, verbosity=verbosity,
                                  reporter=reporter)
 
@@ -1,7 +1,10 @@
 import inspect
 import sys
 
+from .exceptions import InvalidCommand
 from .cmdparse import CmdOption, CmdParse
+from .dependency import BACKENDS, DEFAULT_BACKEND
+from .dependency import CHECKSUMS, DEFAULT_CHECKSUM
 from . import loader
 
 
@@ -125,6 +128,40 @@ opt_depfile = {'name': 'dep_file',
                'help': "file used to save successful runs"
                }
 
+# choose internal dependency file format/backend
+opt_backend = {'name': 'backend',
+               'short': '',
+               'long': 'backend',
+               'type': str,
+               'default': DEFAULT_BACKEND,
+               'help': ("select dependency file backend. Available: %s " %
+                        ", ".join(sorted(BACKENDS)) +
+                        "[default: %(default)s]")
+               }
+
+# algorithm used to calculate checksum of file_dep content
+opt_checksum = {'name': 'checksum',
+                'short': '',
+                'long': 'checksum',
+                'type': str,
+                'default': DEFAULT_CHECKSUM,
+                'help': ("algorithm used to calculate checksum of file " +
+                         "dependencies. Available: %s " %
+                         ", ".join(sorted(CHECKSUMS)) +
+                         "[default: %(default)s]")
+                }
+
+# number of threads used to calculate file checksums
+opt_checksum_threads = {'name': 'checksum_threads',
+                        'short': '',
+                        'long': 'checksum-threads',
+                        'type': int,
+                        'default': 0,
+                        'help': ("number of threads used to calculate " +
+                                 "checksum of file dependencies " +
+                                 "[default: %(default)s]")
+                        }
+
 
 #### options related to dodo.py
 # select dodo file containing tasks
@@ -164,8 +201,12 @@ class TaskLoader(object):
 
     :cvar cmd_options:
           (list of dict) see cmdparse.CmdOption for dict format
+    :ivar source_file:
+          (str) path of file where tasks are defined, set by `load_tasks`
+          (None if unknown)
     """
     cmd_options = ()
+    source_file = None
 
     def load_tasks(self, cmd, opt_values, pos_args): # pragma: no cover
         """load tasks and DOIT_CONFIG
@@ -199,6 +240,10 @@ class ModuleTaskLoader(TaskLoader):
         self.mod_dict = mod_dict
 
     def load_tasks(self, cmd, params, args):
+        if inspect.ismodule(self.mod_dict):
+            self.source_file = getattr(self.mod_dict, '__file__', None)
+        else:
+            self.source_file = self.mod_dict.get('__file__')
         return self._load_from_module(self.mod_dict, cmd.CMD_LIST)
 
 
@@ -209,6 +254,7 @@ class DodoTaskLoader(TaskLoader):
     def load_tasks(self, cmd, params, args):
         dodo_module = loader.get_module(params['dodoFile'], params['cwdPath'],
                                         params['seek_file'])
+        self.source_file = dodo_module.__file__
         return self._load_from_module(dodo_module, cmd.CMD_LIST)
 
 
@@ -219,14 +265,24 @@ class DoitCmdBase(Command):
     cmd_options => list of option dictionary (see CmdOption)
     _execute => method, argument names must be option names
     """
-    base_options = (opt_depfile,)
+    base_options = (opt_depfile, opt_backend, opt_checksum,
+                    opt_checksum_threads)
+
+    # (bool) command handles sub-tasks from lazy task generators,
+    # otherwise they are all created before calling _execute
+    lazy_subtasks = False
 
     def __init__(self, task_loader=None, dep_file=None, config=None,
-                 task_list=None, sel_tasks=None, outstream=None):
+                 task_list=None, sel_tasks=None, outstream=None,
+                 backend=DEFAULT_BACKEND, checksum=DEFAULT_CHECKSUM,
+                 checksum_threads=0):
         """this initializer is usually just used on tests"""
         self._loader = task_loader or TaskLoader()
         Command.__init__(self)
         self.dep_file = dep_file   # (str) filename usually '.doit.db'
+        self.backend = backend     # (str) name of dep_file backend
+        self.checksum = checksum   # (str) file checksum algorithm name
+        self.checksum_threads = checksum_threads # (int)
         self.config = config or {} # config from dodo.py & cmdline
         self.task_list = task_list # list of tasks
         self.sel_tasks = sel_tasks # from command line or default_tasks
@@ -243,14 +299,32 @@ class DoitCmdBase(Command):
         """to be subclassed - actual command implementation"""
         raise NotImplementedError
 
+    def get_dep_manager(self):
+        """create dependency manager for dep_file using command options"""
+        if self.backend not in BACKENDS:
+            msg = ("No backend named '%s'. Available: %s")
+            raise InvalidCommand(msg % (self.backend,
+                                        ", ".join(sorted(BACKENDS))))
+        if self.checksum not in CHECKSUMS:
+            msg = ("No checksum algorithm named '%s'. Available: %s")
+            raise InvalidCommand(msg % (self.checksum,
+                                        ", ".join(sorted(CHECKSUMS))))
+        return BACKENDS[self.backend](self.dep_file, checksum=self.checksum,
+                                      checksum_threads=self.checksum_threads)
+
     def execute(self, params, args):
         """load dodo.py, set attributes and call self._execute"""
         self.task_list, self.config = self._loader.load_tasks(self, params,
                                                               args)
+        if not self.lazy_subtasks:
+            self.task_list = loader.expand_lazy_tasks(self.task_list)
 
         # merge config values into params
         params.update_defaults(self.config)
         self.dep_file = params['dep_file']
+        self.backend = params['backend']
+        self.checksum = params['checksum']
+        self.checksum_threads = params['checksum_threads']
         params['pos_args'] = args # hack
         params['continue_'] = params.get('continue') # hack
         self.sel_tasks = args or self.config.get('default_tasks')
@@ -1,4 +1,3 @@
-from . import dependency
 from .exceptions import InvalidCommand
 from .cmd_base import DoitCmdBase
 
@@ -13,7 +12,7 @@ class Forget(DoitCmdBase):
     def _execute(self):
         """remove saved data successful runs from DB
         """
-        dependency_manager = dependency.Dependency(self.dep_file)
+        dependency_manager = self.get_dep_manager()
         # no task specified. forget all
         if not self.sel_tasks:
             dependency_manager.remove_all()
@@ -0,0 +1,19 @@
+from .cmd_base import DoitCmdBase
+
+
+class GarbageCollect(DoitCmdBase):
+    doc_purpose = "remove data from tasks not defined anymore from internal DB"
+    doc_usage = ""
+    doc_description = None
+
+    name = 'gc'
+    cmd_options = ()
+
+    def _execute(self):
+        """remove saved data from tasks not in task_list and compact DB
+        """
+        dependency_manager = self.get_dep_manager()
+        task_names = [t.name for t in self.task_list]
+        for task_id in dependency_manager.gc(task_names):
+            self.outstream.write("removing %s\n" % task_id)
+        dependency_manager.close()
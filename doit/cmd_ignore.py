@@ -1,4 +1,3 @@
-from . import dependency
 from .exceptions import InvalidCommand
 from .cmd_base import DoitCmdBase
 
@@ -21,7 +20,7 @@ class Ignore(DoitCmdBase):
             self.outstream.write(msg)
             return
 
-        dependency_manager = dependency.Dependency(self.dep_file)
+        dependency_manager = self.get_dep_manager()
         tasks = dict([(t.name, t) for t in self.task_list])
         for task_name in ignore_tasks:
             # check task exist
@@ -1,5 +1,4 @@
 from .exceptions import InvalidCommand
-from .dependency import Dependency
 from .cmd_base import DoitCmdBase
 
 opt_listall = {'name': 'subtasks',
@@ -103,7 +102,9 @@ class List(DoitCmdBase):
 
 
         if status:
-            dependency_manager = Dependency(self.dep_file)
+            dependency_manager = self.get_dep_manager()
+            # no task is executed, files are stat'ed only once
+            dependency_manager.file_cache.cache_stat = True
 
         print_list = []
         for task in base_list:
@@ -0,0 +1,34 @@
+import time
+
+from .control import TaskControl
+from .runner import DryRunner
+from .reporter import ExecutedOnlyReporter
+from .cmd_base import DoitCmdBase
+from .cmd_run import opt_prefetch
+
+
+class Plan(DoitCmdBase):
+    doc_purpose = "list tasks that would be executed by `run` (dry-run)"
+    doc_usage = "[TASK/TARGET...]"
+    doc_description = None
+
+    cmd_options = (opt_prefetch,)
+
+    def _execute(self, prefetch=0):
+        """print name of tasks that would be executed, in execution order
+        """
+        start = time.time()
+        task_control = TaskControl(self.task_list)
+        task_control.process(self.sel_tasks)
+        dep_manager = self.get_dep_manager()
+        reporter = ExecutedOnlyReporter(self.outstream, {'show_out': False,
+                                                         'show_err': False})
+        runner = DryRunner(self.dep_file, reporter, dep_manager=dep_manager,
+                           prefetch=prefetch)
+        result = runner.run_all(task_control.task_dispatcher())
+        for task in runner.plan:
+            self.outstream.write("%s\n" % task.name)
+        msg = "# %d tasks to execute, %d up-to-date (planned in %.3fs)\n"
+        self.outstream.write(msg % (len(runner.plan), len(runner.uptodate),
+                                    time.time() - start))
+        return result
@@ -3,10 +3,11 @@ import codecs
 
 from .exceptions import InvalidCommand
 from .task import Task
-from .control import TaskControl
-from .runner import Runner, MRunner
+from .control import TaskControl, GraphCache
+from .runner import Runner, MRunner, MThreadRunner
 from .reporter import REPORTERS
 from .cmd_base import DoitCmdBase
+from . import loader
 
 
 # verbosity
@@ -64,6 +65,136 @@ opt_num_process = {'name': 'num_process',
                    "[default: %(default)s]"
                    }
 
+# parallel runners
+PARALLEL_TYPES = {'process': MRunner,
+                  'thread': MThreadRunner,
+                  }
+
+opt_parallel_type = {'name': 'par_type',
+                     'short': 'P',
+                     'long': 'parallel-type',
+                     'type': str,
+                     'default': 'process',
+                     'help':
+"""Tasks can be executed in parallel in different ways:
+'process': uses python multiprocessing module
+'thread': uses threads (tasks are not pickled)
+[default: %(default)s]
+"""
+                     }
+
+# limit parallel execution by resources used by tasks
+opt_resources = {'name': 'resources',
+                 'short': '',
+                 'long': 'resources',
+                 'type': str,
+                 'default': {},
+                 'help': "capacity of resources used by tasks executed in "
+                 "parallel, as a comma separated list of <name>:<amount> "
+                 "(e.g. 'mem:8,gpu:1'). Resources not listed are unlimited."
+                 }
+
+
+def parse_resources(value):
+    """get capacity of resources from command line/DOIT_CONFIG value
+
+    @param value: (str) 'name1:amount1,name2:amount2'
+                  (dict) name: amount - only from DOIT_CONFIG
+    @return (dict) name: amount
+    @raise InvalidCommand if amounts are not non-negative integers
+    """
+    if value is None:
+        return {}
+    if isinstance(value, basestring):
+        resources = {}
+        for item in value.split(','):
+            item = item.strip()
+            if not item:
+                continue
+            name, _, amount = item.partition(':')
+            try:
+                resources[name.strip()] = int(amount)
+            except ValueError:
+                msg = ("Invalid resources value '%s'. "
+                       "Must be a comma separated list of <name>:<amount>")
+                raise InvalidCommand(msg % value)
+    elif isinstance(value, dict):
+        resources = value
+    else:
+        msg = "Invalid resources value %r. Must be a dict or string."
+        raise InvalidCommand(msg % (value,))
+
+    for name, amount in resources.iteritems():
+        if (not name or isinstance(amount, bool) or
+            not isinstance(amount, (int, long)) or amount < 0):
+            msg = ("Invalid capacity for resource '%s': %r. "
+                   "Must be a non-negative integer.")
+            raise InvalidCommand(msg % (name, amount))
+    return resources
+
+
+# dispatch tasks in critical path first
+opt_priority = {'name': 'priority',
+                'short': '',
+                'long': 'priority',
+                'type': bool,
+                'default': False,
+                'help': "execute first tasks with the longest chain of "
+                "tasks depending on it (critical path) [default: %(default)s]"
+                }
+
+# check file_dep's ahead of task selection
+opt_prefetch = {'name': 'prefetch',
+                'short': '',
+                'long': 'prefetch',
+                'type': int,
+                'default': 0,
+                'help': "number of threads used to calculate the checksum "
+                "of file_dep's from tasks about to be executed, "
+                "ahead of their up-to-date check [default: %(default)s]"
+                }
+
+# save resolved task graph for next executions
+opt_graph_cache = {'name': 'graph_cache',
+                   'short': '',
+                   'long': 'graph-cache',
+                   'type': bool,
+                   'default': False,
+                   'help': "save the graph of task dependencies on a file "
+                   "(<db-file>.graph) and re-use it while the dodo file "
+                   "does not change [default: %(default)s]"
+                   }
+
+# dependent tasks are not executed if targets did not change
+opt_early_cutoff = {'name': 'early_cutoff',
+                    'short': '',
+                    'long': 'early-cutoff',
+                    'type': bool,
+                    'default': False,
+                    'help': "calculate the checksum of targets from executed "
+                    "tasks, tasks that depend on them are up-to-date if "
+                    "their content did not change [default: %(default)s]"
+                    }
+
+# save dependency file during execution
+opt_checkpoint = {'name': 'checkpoint',
+                  'short': '',
+                  'long': 'checkpoint',
+                  'type': int,
+                  'default': 0,
+                  'help': "save dependency file after every N successful "
+                  "tasks, 0 saves only at the end [default: %(default)s]"
+                  }
+
+opt_checkpoint_time = {'name': 'checkpoint_time',
+                       'short': '',
+                       'long': 'checkpoint-time',
+                       'type': int,
+                       'default': 0,
+                       'help': "save dependency file if more than N seconds "
+                       "elapsed since it was last saved, 0 disables "
+                       "[default: %(default)s]"
+                       }
 
 # reporter
 opt_reporter = {'name':'reporter',
@@ -89,19 +220,50 @@ class Run(DoitCmdBase):
     doc_description = None
 
     cmd_options = (opt_always, opt_continue, opt_verbosity,
-                   opt_reporter, opt_outfile, opt_num_process)
+                   opt_reporter, opt_outfile, opt_num_process,
+                   opt_parallel_type, opt_resources,
+                   opt_checkpoint, opt_checkpoint_time, opt_priority,
+                   opt_graph_cache, opt_prefetch, opt_early_cutoff)
+
+    lazy_subtasks = True
 
     def _execute(self, outfile,
                  verbosity=None, always=False, continue_=False,
-                 reporter='default', num_process=0):
+                 reporter='default', num_process=0, par_type='process',
+                 resources=None,
+                 checkpoint=0, checkpoint_time=0, priority=False,
+                 graph_cache=False, prefetch=0, early_cutoff=False):
         """
         @param reporter: (str) one of provided reporters or ...
                          (class) user defined reporter class (can only be specified
                from DOIT_CONFIG - never from command line)
                          (reporter instance) - only used in unittests
         """
+        if par_type not in PARALLEL_TYPES:
+            msg = ("No parallel type named '%s'. Available: %s")
+            raise InvalidCommand(msg % (par_type,
+                                        ", ".join(sorted(PARALLEL_TYPES))))
+        resources = parse_resources(resources)
+        if par_type == 'process' and num_process and not MRunner.available():
+            num_process = 0
+            sys.stderr.write("WARNING: multiprocessing module not available, " +
+                             "running on single process.")
+
+        # sub-processes get tasks by name, so they must be created beforehand
+        if num_process and par_type == 'process':
+            self.task_list = loader.expand_lazy_tasks(self.task_list)
+
         # get tasks to be executed
-        task_control = TaskControl(self.task_list)
+        graph = None
+        if graph_cache:
+            source_file = getattr(self._loader, 'source_file', None)
+            if source_file is None:
+                sys.stderr.write("WARNING: file where tasks are defined is "
+                                 "unknown, graph cache not used.\n")
+            else:
+                graph = GraphCache(self.dep_file + '.graph', source_file,
+                                   self.config)
+        task_control = TaskControl(self.task_list, graph)
         task_control.process(self.sel_tasks)
 
         # reporter
@@ -139,19 +301,26 @@ class Run(DoitCmdBase):
                 reporter_obj = reporter_cls
 
 
-            if not MRunner.available():
-                num_process = 0
-                sys.stderr.write("WARNING: multiprocessing module not available, " +
-                                 "running on single process.")
-
+            dep_manager = self.get_dep_manager()
             if num_process == 0:
                 runner = Runner(self.dep_file, reporter_obj, continue_,
-                                always, verbosity)
+                                always, verbosity, dep_manager,
+                                checkpoint, checkpoint_time, prefetch,
+                                early_cutoff)
             else:
-                runner = MRunner(self.dep_file, reporter_obj, continue_,
-                                 always, verbosity, num_process)
+                runner_cls = PARALLEL_TYPES[par_type]
+                runner = runner_cls(self.dep_file, reporter_obj, continue_,
+                                    always, verbosity, num_process,
+                                    dep_manager, checkpoint, checkpoint_time,
+                                    prefetch, early_cutoff,
+                                    resources)
 
-            return runner.run_all(task_control.task_dispatcher())
+            durations = None
+            if priority:
+                # estimated from previous executions
+                durations = dep_manager.get_durations(task_control.tasks)
+            return runner.run_all(task_control.task_dispatcher(
+                    durations=durations))
         finally:
             if isinstance(outfile, str):
                 outstream.close()
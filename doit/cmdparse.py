@@ -71,7 +71,7 @@ class CmdOption(object):
         self.name = opt_dict.pop('name')
         self.default = opt_dict.pop('default')
         self.type = opt_dict.pop('type', str)
-        self.short = opt_dict.pop('short', '')
+        self.short = opt_dict.pop('short', '') or '' # None means no short
         self.long = opt_dict.pop('long', '')
         self.inverse = opt_dict.pop('inverse', '')
         self.help = opt_dict.pop('help', '')
@@ -1,9 +1,84 @@
 """Control tasks execution order"""
+import os
+import re
 import fnmatch
+import marshal
+import hashlib
+import heapq
+import bisect
+import itertools
 from collections import deque
 
 from .exceptions import InvalidTask, InvalidCommand, InvalidDodoFile
 from .task import Task
+from .tools import result_dep
+
+
+
+class GraphCache(object):
+    """save the resolved task graph (targets and task_dep) to a file
+
+    The graph is keyed on the file where tasks are defined (path,
+    modification time and size), DOIT_CONFIG and the number of tasks.
+    The key is cheap to calculate but changes on tasks that are not caused
+    by a change on the source file (i.e. tasks created from a list of files)
+    are not detected.
+
+    @ivar name: (str) file name
+    @ivar source: (tuple) path, mtime and size of source file and config
+    """
+    # change it whenever the format of saved data changes
+    VERSION = 2
+
+    def __init__(self, name, source_file, config=None):
+        """
+        @param source_file: (str) path of file where tasks are defined
+        @param config: (dict) DOIT_CONFIG
+        """
+        self.name = name
+        # python2 modules loaded from compiled file
+        if source_file.endswith(('.pyc', '.pyo')):
+            if os.path.exists(source_file[:-1]):
+                source_file = source_file[:-1]
+        stat = os.stat(source_file)
+        self.source = (os.path.abspath(source_file), stat.st_mtime,
+                       stat.st_size, repr(sorted((config or {}).items())))
+
+    def digest(self, num_tasks):
+        """digest of source file, config and number of tasks"""
+        return hashlib.md5(repr((self.source, num_tasks))).hexdigest()
+
+    def load(self, digest):
+        """@return (tuple) targets, task_dep of each task
+                   or None if there is no valid graph for digest
+        """
+        if not os.path.exists(self.name):
+            return None
+        try:
+            graph_file = open(self.name, 'rb')
+            try:
+                version, saved_digest, targets, task_deps = \
+                    marshal.load(graph_file)
+            finally:
+                graph_file.close()
+        except (IOError, EOFError, ValueError, TypeError):
+            return None
+        if version != self.VERSION or saved_digest != digest:
+            return None
+        return targets, task_deps
+
+    def save(self, digest, targets, task_deps):
+        """save graph to file (replace old file only after written)"""
+        tmp_name = self.name + '.tmp'
+        graph_file = open(tmp_name, 'wb')
+        try:
+            marshal.dump((self.VERSION, digest, targets, task_deps),
+                         graph_file)
+        finally:
+            graph_file.close()
+        if os.path.exists(self.name):
+            os.remove(self.name)
+        os.rename(tmp_name, self.name)
 
 
 
@@ -25,7 +100,11 @@ class TaskControl(object):
                           Value: task_name
     """
 
-    def __init__(self, task_list):
+    def __init__(self, task_list, graph_cache=None):
+        """
+        @param graph_cache: (L{GraphCache}) used to skip the creation of
+                            dependencies graph if tasks did not change
+        """
         self.tasks = {}
         self.targets = {}
 
@@ -35,6 +114,9 @@ class TaskControl(object):
         self._def_order = []
         # list of tasks selected to be executed
         self.selected_tasks = None
+        # index used to match wildcard patterns, see _get_wild_tasks
+        self._wild_index = None
+        self._wild_cache = {}
 
         # sanity check and create tasks dict
         for task in task_list:
@@ -50,6 +132,29 @@ class TaskControl(object):
             self.tasks[task.name] = task
             self._def_order.append(task.name)
 
+        if graph_cache is None:
+            self._init_graph()
+            return
+
+        # graph was saved by a previous execution (and already checked)
+        digest = graph_cache.digest(len(self._def_order))
+        graph = graph_cache.load(digest)
+        if graph is not None:
+            targets, task_deps = graph
+            # same number of tasks, make sure they also have same names
+            if all(name in self.tasks for name in task_deps):
+                self.targets = targets
+                for name, task_dep in task_deps.iteritems():
+                    self.tasks[name].task_dep = task_dep
+                return
+        self._init_graph()
+        task_deps = dict((task.name, task.task_dep)
+                         for task in self.tasks.itervalues())
+        graph_cache.save(digest, self.targets, task_deps)
+
+
+    def _init_graph(self):
+        """add task_dep from wild-cards and targets, check dep names"""
         # expand wild-card task-dependencies
         for task in self.tasks.itervalues():
             for pattern in task.wild_dep:
@@ -95,18 +200,41 @@ class TaskControl(object):
     @staticmethod
     def add_implicit_task_dep(targets, task, deps_list):
         """add tasks which created targets are file_dep for this task"""
+        task_dep = set(task.task_dep)
         for dep in deps_list:
-            if (dep in targets and targets[dep] not in task.task_dep):
-                task.task_dep.append(targets[dep])
+            dep_task = targets.get(dep)
+            if dep_task is not None and dep_task not in task_dep:
+                task.task_dep.append(dep_task)
+                task_dep.add(dep_task)
 
 
     def _get_wild_tasks(self, pattern):
-        """get list of tasks that match pattern"""
-        wild_list = []
-        for t_name in self._def_order:
-            if fnmatch.fnmatch(t_name, pattern):
-                wild_list.append(t_name)
-        return wild_list
+        """get list of tasks that match pattern (in definition order)
+
+        Same matching rules as fnmatch.fnmatch. Task names are kept sorted
+        so only names starting with the pattern's literal prefix (the
+        part before the first special char) are checked.
+        """
+        if pattern in self._wild_cache:
+            return self._wild_cache[pattern][:]
+        if self._wild_index is None:
+            # sorted list of (normalized name, definition position)
+            self._wild_index = sorted((os.path.normcase(name), pos) for
+                                      pos, name in enumerate(self._def_order))
+        norm_pattern = os.path.normcase(pattern)
+        prefix = re.match(r'[^*?[]*', norm_pattern).group()
+        match = re.compile(fnmatch.translate(norm_pattern)).match
+        positions = []
+        start = bisect.bisect_left(self._wild_index, (prefix,))
+        for norm_name, pos in self._wild_index[start:]:
+            if not norm_name.startswith(prefix):
+                break
+            if match(norm_name):
+                positions.append(pos)
+        positions.sort()
+        wild_list = [self._def_order[pos] for pos in positions]
+        self._wild_cache[pattern] = wild_list
+        return wild_list[:]
 
 
     def _process_filter(self, task_selection):
@@ -173,16 +301,107 @@ class TaskControl(object):
             self.selected_tasks = self._def_order
 
 
-    def task_dispatcher(self, include_setup=False):
+    def check_cycles(self):
+        """check there are no cyclic dependencies on selected tasks
+
+        @raise InvalidDodoFile: listing all cycles found
+        """
+        cycles = find_cycles(self.tasks, self.selected_tasks)
+        if cycles:
+            raise InvalidDodoFile("\n".join(cycle_message(cycle)
+                                             for cycle in cycles))
+
+
+    def task_dispatcher(self, include_setup=False, durations=None):
         """return a TaskDispatcher generator
         """
         assert self.selected_tasks is not None, \
             "must call 'process' before this"
 
+        self.check_cycles()
         return TaskDispatcher(self.tasks, self.targets, self.selected_tasks,
-                              include_setup)
+                              include_setup, durations)
+
 
 
+def _task_deps(task):
+    """@return (list - str) name of all tasks a task depends on"""
+    return sorted(task.calc_dep) + task.task_dep + task.setup_tasks
+
+
+def find_cycles(tasks, start_names):
+    """find cyclic dependencies between tasks reachable from start_names
+
+    Uses a depth-first search (not recursive) that visits every task only
+    once. A cycle is found whenever a dependency is a task in the current
+    path from the start task.
+
+    @param tasks: (dict) task name: Task
+    @param start_names: (list - str) name of tasks to start search
+    @return (list - list - str) path of every cycle found, the path
+            starts and ends on the same task
+    """
+    cycles = []
+    # task name: True while on current path, False when done
+    in_path = {}
+    for start in start_names:
+        if start in in_path:
+            continue
+        path = [start]
+        in_path[start] = True
+        stack = [iter(_task_deps(tasks[start]))]
+        while stack:
+            for dep in stack[-1]:
+                if dep not in tasks: # reported by dispatcher
+                    continue
+                dep_in_path = in_path.get(dep)
+                if dep_in_path is None:
+                    path.append(dep)
+                    in_path[dep] = True
+                    stack.append(iter(_task_deps(tasks[dep])))
+                    break
+                if dep_in_path:
+                    cycles.append(path[path.index(dep):] + [dep])
+            else:
+                stack.pop()
+                in_path[path.pop()] = False
+    return cycles
+
+
+def find_dep_path(tasks, source, target):
+    """find a chain of dependencies from task source to task target
+
+    @return (list - str) task names from source to target,
+            None if target is not a dependency of source
+    """
+    if source not in tasks:
+        return None
+    parents = {source: None}
+    to_visit = [source]
+    while to_visit:
+        name = to_visit.pop()
+        for dep in _task_deps(tasks[name]):
+            if dep in parents or dep not in tasks:
+                continue
+            parents[dep] = name
+            if dep == target:
+                path = [dep]
+                while parents[path[-1]] is not None:
+                    path.append(parents[path[-1]])
+                path.reverse()
+                return path
+            to_visit.append(dep)
+    return None
+
+
+def cycle_message(cycle):
+    """@return (str) error message for a cycle (list of task names)"""
+    msg = "Cyclic/recursive dependencies for task %s: [%s]"
+    return msg % (cycle[-1], " -> ".join(cycle))
+
+
+# shared by ExecNode instances
+EMPTY_SET = frozenset()
 
 class ExecNode(object):
     """Each task will have an instace of this
@@ -196,43 +415,46 @@ class ExecNode(object):
            - ignore: task wont be executed (user forced deselect)
            - up-to-date: task wont be executed (no need)
            - done: task finished its execution
+
+    Empty containers are shared by all nodes (immutable), the attribute
+    is replaced by a new container when an element needs to be added.
     """
-    def __init__(self, task, parent):
+    __slots__ = ('task', 'task_dep', 'calc_dep', 'wait_select', 'wait_run',
+                 'wait_run_calc', 'waiting_me', 'run_status', 'bad_deps',
+                 'ignored_deps', 'generator')
+
+    def __init__(self, task):
         self.task = task
         # list of dependencies not processed by _add_task yet
-        self.task_dep = task.task_dep[:]
-        self.calc_dep = task.calc_dep.copy()
-
-        # ancestors are used to detect cyclic references.
-        # it does not contain a list of tasks that depends on this node
-        # for that check the attribute waiting_me
-        self.ancestors = []
-        if parent:
-            self.ancestors.extend(parent.ancestors)
-        self.ancestors.append(task.name)
+        self.task_dep = task.task_dep[:] if task.task_dep else ()
+        self.calc_dep = task.calc_dep.copy() if task.calc_dep else EMPTY_SET
 
         # Wait for a task to be selected to its execution
         # checking if it is up-to-date
         self.wait_select = False
 
         # Wait for a task to finish its execution
-        self.wait_run = set() # task names
-        self.wait_run_calc = set() # task names
+        self.wait_run = EMPTY_SET # task names
+        self.wait_run_calc = EMPTY_SET # task names
 
-        self.waiting_me = set() # ExecNode
+        self.waiting_me = EMPTY_SET # ExecNode
 
         self.run_status = None
         # all ancestors that failed
-        self.bad_deps = []
-        self.ignored_deps = []
+        self.bad_deps = ()
+        self.ignored_deps = ()
 
         # generator from TaskDispatcher._add_task
         self.generator = None
 
     def parent_status(self, parent_node):
         if parent_node.run_status == 'failure':
+            if not self.bad_deps:
+                self.bad_deps = []
             self.bad_deps.append(parent_node)
         elif parent_node.run_status == 'ignore':
+            if not self.ignored_deps:
+                self.ignored_deps = []
             self.ignored_deps.append(parent_node)
 
     def __repr__(self):
@@ -257,6 +479,91 @@ def no_none(decorated):
 
 
 
+def critical_path_weights(tasks, durations):
+    """calculate the weight of every task to be used as its priority
+
+    The weight of a task is its own (estimated) duration plus the weight
+    of heaviest task that depends on it, i.e. the length of the longest
+    chain of tasks that can only start after this task is done.
+
+    @param tasks: (dict) task name: Task
+    @param durations: (dict) task name: duration. tasks not included
+                      take the average of given durations (or 1) if it
+                      has actions, 0 otherwise (group tasks)
+    @return (dict) task name: weight
+    """
+    if durations:
+        unknown = sum(durations.values()) / float(len(durations))
+    else:
+        unknown = 1
+    dependents = dict((name, []) for name in tasks)
+    for task in tasks.itervalues():
+        for dep in task.task_dep + task.setup_tasks:
+            if dep in dependents:
+                dependents[dep].append(task.name)
+
+    # depth-first on dependents, not recursive as chains might be long
+    weights = {}
+    for start in tasks:
+        if start in weights:
+            continue
+        visiting = set([start])
+        stack = [(start, iter(dependents[start]))]
+        while stack:
+            name, children = stack[-1]
+            for child in children:
+                # ignore cycles here, they are reported by TaskDispatcher
+                if child not in weights and child not in visiting:
+                    visiting.add(child)
+                    stack.append((child, iter(dependents[child])))
+                    break
+            else:
+                stack.pop()
+                visiting.discard(name)
+                longest = max([weights.get(child, 0)
+                               for child in dependents[name]] or [0])
+                default = tasks[name].actions and unknown or 0
+                weights[name] = durations.get(name, default) + longest
+    return weights
+
+
+class PriorityQueue(object):
+    """queue of ExecNode where nodes with higher priority come first
+
+    nodes with same priority are kept in FIFO order.
+    It supports the subset of deque interface used by TaskDispatcher.
+
+    @ivar priority: (dict) task name: priority value
+    """
+    def __init__(self, priority):
+        self.priority = priority
+        self._heap = []
+        self._count = itertools.count()
+
+    def append(self, node):
+        """add node to queue"""
+        value = self.priority.get(node.task.name, 0)
+        heapq.heappush(self._heap, (-value, self._count.next(), node))
+
+    def popleft(self):
+        """remove and return node with highest priority"""
+        return heapq.heappop(self._heap)[2]
+
+    def __len__(self):
+        return len(self._heap)
+
+    def __iter__(self):
+        return iter([entry[2] for entry in sorted(self._heap)])
+
+    def head(self, num):
+        """return (up to) num nodes close to the top of the queue
+
+        nodes are not ordered and might not be exactly the num first
+        ones, but it does not need to sort the queue.
+        """
+        return [entry[2] for entry in self._heap[:num]]
+
+
 class TaskDispatcher(object):
     """Dispatch another task to be selected/executed, mostly handle with MP
 
@@ -264,8 +571,29 @@ class TaskDispatcher(object):
 
     @ivar include_setup: (bool) when True tasks wont be execute so
                          do not wait for task deps.
+    @ivar weights: (dict) task name: priority given by its critical path.
+                   None if tasks are dispatched in definition order.
+
+    Sub-tasks from lazy task generators (Task.subtask_iter) are created
+    on demand as their group task is processed, so that at most
+    LAZY_BATCH of them are waiting to be processed. More sub-tasks are
+    created as soon as any of them is processed.
+    They are removed from `tasks` and `nodes` once successfully
+    processed, so the number of Task and ExecNode instances in memory
+    is bounded. Names (and targets) of processed sub-tasks are still
+    kept (group's task_dep, `targets`) to check dependencies of
+    sub-tasks created later. Sub-tasks can not get values (getargs,
+    result_dep) from other lazy sub-tasks.
     """
-    def __init__(self, tasks, targets, selected_tasks, include_setup=False):
+    LAZY_BATCH = 100
+
+    def __init__(self, tasks, targets, selected_tasks, include_setup=False,
+                 durations=None):
+        """
+        @param durations: (dict) task name: estimated duration. if given
+                          tasks with longest critical path are dispatched
+                          first, otherwise in the order they are defined.
+        """
         self.tasks = tasks
         self.targets = targets
         self.include_setup = include_setup
@@ -273,28 +601,37 @@ class TaskDispatcher(object):
         self.nodes = {} # key task-name, value: ExecNode
         # queues
         self.waiting = set() # of ExecNode
-        self.ready = deque() # of ExecNode
-
+        if durations is None:
+            self.weights = None
+            self.ready = deque() # of ExecNode
+        else:
+            self.weights = critical_path_weights(tasks, durations)
+            self.ready = PriorityQueue(self.weights) # of ExecNode
+
+        # list of task names (reverse order) not dispatched yet
+        self._tasks_to_run = None
+        # name of lazy sub-tasks in memory / already released
+        self._lazy = set()
+        self._released = set()
+        # task names known to not depend on a lazy group task
+        self._lazy_safe_deps = set()
         self.generator = self._dispatcher_generator(selected_tasks)
 
 
-    def _gen_node(self, parent, task_name):
-        """return ExecNode for task_name if not created yet"""
+    def _gen_node(self, task_name):
+        """return ExecNode for task_name if not created yet
+
+        cyclic dependencies must be checked before (TaskControl.check_cycles)
+        """
         node = self.nodes.get(task_name, None)
 
         # first time, create node
-        if node is None:
-            node = ExecNode(self.tasks[task_name], parent)
+        if node is None and task_name not in self._released:
+            node = ExecNode(self.tasks[task_name])
             node.generator = self._add_task(node)
             self.nodes[task_name] = node
             return node
 
-        # detect cyclic/recursive dependencies
-        if parent and task_name in parent.ancestors:
-            msg = "Cyclic/recursive dependencies for task %s: [%s]"
-            cycle = " -> ".join(parent.ancestors + [task_name])
-            raise InvalidDodoFile(msg % (task_name, cycle))
-
 
     def _node_add_wait_run(self, node, task_list, calc=False):
         """updates node.wait_run
@@ -305,6 +642,8 @@ class TaskDispatcher(object):
         # remove tasks that were already executed from task_list
         wait_for = set()
         for name in task_list:
+            if name in self._released: # successfully processed
+                continue
             dep_node = self.nodes[name]
             if (not dep_node) or dep_node.run_status in (None, 'run'):
                 wait_for.add(name)
@@ -313,11 +652,16 @@ class TaskDispatcher(object):
 
         # update ExecNode setting parent/dependent relationship
         for name in wait_for:
-            self.nodes[name].waiting_me.add(node)
+            dep_node = self.nodes[name]
+            if not dep_node.waiting_me:
+                dep_node.waiting_me = set()
+            dep_node.waiting_me.add(node)
+        if not wait_for:
+            return
         if calc:
-            node.wait_run_calc.update(wait_for)
+            node.wait_run_calc = wait_for.union(node.wait_run_calc)
         else:
-            node.wait_run.update(wait_for)
+            node.wait_run = wait_for.union(node.wait_run)
 
 
     @no_none
@@ -337,21 +681,30 @@ class TaskDispatcher(object):
 
         # add calc_dep & task_dep until all processed
         # calc_dep may add more deps so need to loop until nothing left
+        # lazy sub-tasks are added whenever less than LAZY_BATCH are
+        # waiting to be processed, until iterator is exhausted
         while True:
+            if this_task.subtask_iter is not None:
+                if self.include_setup:
+                    num = self.LAZY_BATCH
+                else:
+                    num = self.LAZY_BATCH - len(node.wait_run)
+                node.task_dep = (self._create_lazy_tasks(this_task, num) +
+                                 list(node.task_dep))
             for calc_dep in node.calc_dep:
-                yield self._gen_node(node, calc_dep)
+                yield self._gen_node(calc_dep)
             self._node_add_wait_run(node, node.calc_dep, calc=True)
-            node.calc_dep.clear()
+            node.calc_dep = EMPTY_SET
 
             # add task_dep
             for task_dep in node.task_dep:
-                yield self._gen_node(node, task_dep)
+                yield self._gen_node(task_dep)
             self._node_add_wait_run(node, node.task_dep)
-            node.task_dep = []
+            node.task_dep = ()
 
             if (node.wait_run or node.wait_run_calc) and not self.include_setup:
                 yield 'wait'
-            else:
+            elif this_task.subtask_iter is None:
                 break
 
         # add itself
@@ -369,7 +722,7 @@ class TaskDispatcher(object):
             # if this task should run, so schedule setup-tasks before itself
             if node.run_status == 'run' or self.include_setup:
                 for setup_task in this_task.setup_tasks:
-                    yield self._gen_node(node, setup_task)
+                    yield self._gen_node(setup_task)
                 self._node_add_wait_run(node, this_task.setup_tasks)
                 if node.wait_run:
                     yield 'wait'
@@ -378,6 +731,94 @@ class TaskDispatcher(object):
                 yield this_task
 
 
+    def _create_lazy_tasks(self, group, num):
+        """create next sub-tasks from a lazy task generator
+
+        @param group: (Task) task with a subtask_iter
+        @param num: (int) max number of sub-tasks to be created
+        @return (list - str) name of created sub-tasks
+        @raise InvalidTask, InvalidDodoFile
+        """
+        num = max(num, 0)
+        created = []
+        for task in itertools.islice(group.subtask_iter, num):
+            name = task.name
+            if name in self.tasks or name in self._released:
+                msg = "Task generation '%s' has duplicated definition of '%s'"
+                raise InvalidTask(msg % (group.name, name))
+            if task.wild_dep:
+                msg = "Task '%s': lazy sub-tasks can not use wildcard task_dep."
+                raise InvalidTask(msg % name)
+            for dep in task.task_dep:
+                if dep not in self.tasks and dep not in self._released:
+                    msg = "%s. Task dependency '%s' does not exist."
+                    raise InvalidTask(msg % (name, dep))
+            for setup_task in task.setup_tasks:
+                if setup_task in self._lazy or setup_task in self._released:
+                    msg = ("Task '%s': lazy sub-tasks can not use another " +
+                           "lazy sub-task '%s' as setup or getargs.")
+                    raise InvalidTask(msg % (name, setup_task))
+                if setup_task not in self.tasks:
+                    msg = "Task '%s': invalid setup task '%s'."
+                    raise InvalidTask(msg % (name, setup_task))
+            for uptodate, _, _ in task.uptodate:
+                if (isinstance(uptodate, result_dep) and
+                    (uptodate.dep_name in self._lazy or
+                     uptodate.dep_name in self._released)):
+                    msg = ("Task '%s': lazy sub-tasks can not use result_dep" +
+                           " on another lazy sub-task '%s'.")
+                    raise InvalidTask(msg % (name, uptodate.dep_name))
+            self._check_lazy_deps(group.name, task)
+
+            for target in task.targets:
+                if target in self.targets:
+                    msg = ("Two different tasks can't have a common target." +
+                           "'%s' is a target for %s and %s.")
+                    raise InvalidTask(msg % (target, name,
+                                             self.targets[target]))
+                self.targets[target] = name
+            TaskControl.add_implicit_task_dep(self.targets, task,
+                                              task.file_dep)
+            self.tasks[name] = task
+            self._lazy.add(name)
+            group.task_dep.append(name)
+            created.append(name)
+
+        if len(created) < num:
+            group.subtask_iter = None
+        return created
+
+
+    def _check_lazy_deps(self, group_name, task):
+        """check dependencies of a lazy sub-task do not create a cycle
+
+        A new sub-task can only be reached from its group task,
+        so there is a cycle if a dependency depends on the group task.
+        @raise InvalidDodoFile
+        """
+        for dep in task.task_dep + task.setup_tasks:
+            if (dep in self._lazy_safe_deps or dep in self._lazy or
+                dep in self._released):
+                continue
+            if dep == group_name:
+                path = [dep]
+            else:
+                path = find_dep_path(self.tasks, dep, group_name)
+            if path is not None:
+                raise InvalidDodoFile(cycle_message([task.name] + path +
+                                                    [task.name]))
+            self._lazy_safe_deps.add(dep)
+
+
+    def _release_lazy_task(self, node):
+        """remove a successfully processed lazy sub-task from memory"""
+        name = node.task.name
+        self._lazy.remove(name)
+        self._released.add(name)
+        del self.tasks[name]
+        del self.nodes[name]
+
+
     def _get_next_node(self, ready, tasks_to_run):
         """get ExecNode from (in order):
             .1 ready
@@ -388,11 +829,41 @@ class TaskDispatcher(object):
         # get task group from tasks_to_run
         while tasks_to_run:
             task_name = tasks_to_run.pop()
-            node = self._gen_node(None, task_name)
+            node = self._gen_node(task_name)
             if node:
                 return node
 
 
+    def settled_tasks(self, limit):
+        """tasks about to be dispatched whose dependencies were processed
+
+        Used to check the status of tasks in advance. It is just a hint,
+        tasks might be dispatched in a different order.
+        @return (list - Task) at most `limit` tasks
+        """
+        settled = []
+        if self.weights is None:
+            nodes = itertools.islice(self.ready, limit)
+        else:
+            nodes = self.ready.head(limit)
+        for node in nodes:
+            if (node.run_status is None and not
+                (node.task_dep or node.calc_dep or
+                 node.wait_run or node.wait_run_calc)):
+                settled.append(node.task)
+
+        # tasks not created yet, only the ones without dependencies
+        if self._tasks_to_run:
+            for name in itertools.islice(reversed(self._tasks_to_run), limit):
+                if len(settled) >= limit:
+                    break
+                task = self.tasks[name]
+                if (name not in self.nodes and
+                    not (task.task_dep or task.calc_dep)):
+                    settled.append(task)
+        return settled[:limit]
+
+
     def _update_waiting(self, processed):
         """updates 'ready' and 'waiting' queues after processed
         @param processed (ExecNode) or None
@@ -424,6 +895,10 @@ class TaskDispatcher(object):
                 waiting_node.wait_run.remove(task_name)
                 is_ready = not (waiting_node.wait_run or
                                 waiting_node.wait_run_calc)
+                # lazy group task can create more sub-tasks
+                if (waiting_node.task.subtask_iter is not None and
+                    len(waiting_node.wait_run) < self.LAZY_BATCH):
+                    is_ready = True
             # node wait_run_calc
             else:
                 assert task_name in waiting_node.wait_run_calc
@@ -443,21 +918,51 @@ class TaskDispatcher(object):
 
                 # update node's list of non-processed dependencies
                 new_task_dep = waiting_node.task.task_dep[len_task_deps:]
-                waiting_node.task_dep.extend(new_task_dep)
+                if new_task_dep:
+                    waiting_node.task_dep = (list(waiting_node.task_dep) +
+                                             new_task_dep)
                 new_calc_dep = waiting_node.task.calc_dep - old_calc_dep
-                waiting_node.calc_dep.update(new_calc_dep)
+                if new_calc_dep:
+                    waiting_node.calc_dep = new_calc_dep.union(
+                        waiting_node.calc_dep)
+                self._check_new_deps(waiting_node.task.name,
+                                     list(new_calc_dep) + new_task_dep)
 
             # this node can be further processed
             if is_ready and (waiting_node in self.waiting):
                 self.ready.append(waiting_node)
                 self.waiting.remove(waiting_node)
 
+        if (node.task.name in self._lazy and
+            node.run_status in ('successful', 'up-to-date')):
+            self._release_lazy_task(node)
+
+
+    def _check_new_deps(self, task_name, new_deps):
+        """check new dependencies (from calc_dep) do not create a cycle
+
+        @raise InvalidDodoFile
+        """
+        for dep in new_deps:
+            if dep == task_name:
+                cycle = [task_name, task_name]
+            else:
+                path = find_dep_path(self.tasks, dep, task_name)
+                if path is None:
+                    continue
+                cycle = [task_name] + path
+            raise InvalidDodoFile(cycle_message(cycle))
+
 
     def _dispatcher_generator(self, selected_tasks):
         """return generator dispatching tasks"""
         # each selected task will create a tree (from dependencies) of
         # tasks to be processed
         tasks_to_run = list(reversed(selected_tasks))
+        if self.weights is not None:
+            # heaviest at the end, the list is consumed with pop()
+            tasks_to_run.sort(key=lambda name: self.weights.get(name, 0))
+        self._tasks_to_run = tasks_to_run
         node = None  # current active ExecNode
 
         while True:
@@ -1,7 +1,14 @@
 """Manage (save/check) task dependency-on-files data."""
 
 import os
+import sys
+import stat
 import hashlib
+import zlib
+import marshal
+import threading
+import Queue
+import sqlite3
 import dumbdbm
 import anydbm as ddbm
 
@@ -16,9 +23,18 @@ import anydbm as ddbm
 
 from .compat import json
 
+try:
+    import xxhash
+except ImportError: # pragma: no cover
+    xxhash = None
+
 
 USE_FILE_TIMESTAMP = True
 
+# size in bytes of each chunk read from a file to compute its checksum.
+# files are never loaded whole into memory.
+CHECKSUM_CHUNK_SIZE = 64 * 1024
+
 
 def get_md5(input_data):
     """return md5 from string or unicode"""
@@ -28,81 +44,440 @@ def get_md5(input_data):
         byte_data = input_data
     return hashlib.md5(byte_data).hexdigest()
 
-def md5sum(path):
+class Crc32(object):
+    """zlib.crc32 with the same interface as hashlib objects"""
+    def __init__(self):
+        self._value = 0
+
+    def update(self, data):
+        """add data to checksum"""
+        self._value = zlib.crc32(data, self._value)
+
+    def hexdigest(self):
+        """@return (str) checksum value as an hex string"""
+        return '%08x' % (self._value & 0xffffffff)
+
+
+# algorithms available to calculate the checksum of file content.
+# Key: algorithm name
+# Value: callable that creates an object with hashlib interface
+CHECKSUMS = {'md5': hashlib.md5,
+             'sha1': hashlib.sha1,
+             'crc32': Crc32,
+             }
+if hasattr(hashlib, 'blake2b'): # pragma: no cover
+    CHECKSUMS['blake2b'] = hashlib.blake2b
+if xxhash is not None: # pragma: no cover
+    CHECKSUMS['xxhash'] = xxhash.xxh64
+
+# algorithm used by default / for values saved without algorithm
+DEFAULT_CHECKSUM = 'md5'
+
+
+def file_checksum(path, algorithm=DEFAULT_CHECKSUM, chunk_size=None):
+    """Calculate the checksum from file content.
+
+    File content is read and fed into the digest in chunks, so memory usage
+    does not depend on the file size.
+
+    @param path: (string) file path
+    @param algorithm: (string) name of a checksum algorithm from CHECKSUMS
+    @param chunk_size: (int) number of bytes read at a time
+                       [default: CHECKSUM_CHUNK_SIZE]
+    @return: (string) checksum as hex string
+    """
+    chunk_size = chunk_size or CHECKSUM_CHUNK_SIZE
+    digest = CHECKSUMS[algorithm]()
+    file_data = open(path,'rb')
+    try:
+        while True:
+            chunk = file_data.read(chunk_size)
+            if not chunk:
+                break
+            digest.update(chunk)
+    finally:
+        file_data.close()
+    return digest.hexdigest()
+
+def md5sum(path, chunk_size=None):
     """Calculate the md5 sum from file content.
 
     @param path: (string) file path
+    @param chunk_size: (int) number of bytes read at a time
     @return: (string) md5
     """
-    file_data = open(path,'rb')
-    result = get_md5(file_data.read())
-    file_data.close()
-    return result
+    return file_checksum(path, 'md5', chunk_size)
 
 
-def check_modified(file_path, file_stat, state):
-    """check if file in file_path is modified from previous "state"
-    @param file_path (string): file path
+# number of executions considered on the rolling average of task durations
+DURATION_WINDOW = 10
+
+def update_duration_stats(stats, duration):
+    """update statistics of a task execution time with a new execution
+
+    @param stats: (dict) previous statistics or None
+    @param duration: (tuple - float) wall and CPU time of execution
+    @return (dict) new statistics:
+       - runs: number of executions
+       - wall, cpu: rolling average of last DURATION_WINDOW executions
+       - last_wall, last_cpu: values from this execution
+       CPU time might be None (not measured), it is not included on
+       the average.
+    """
+    wall, cpu = duration
+    if not stats:
+        return {'runs': 1, 'wall': wall, 'cpu': cpu,
+                'last_wall': wall, 'last_cpu': cpu}
+    runs = stats['runs'] + 1
+    window = float(min(runs, DURATION_WINDOW))
+    avg_cpu = stats['cpu']
+    if avg_cpu is None:
+        avg_cpu = cpu
+    elif cpu is not None:
+        avg_cpu += (cpu - avg_cpu) / window
+    return {'runs': runs,
+            'wall': stats['wall'] + (wall - stats['wall']) / window,
+            'cpu': avg_cpu,
+            'last_wall': wall, 'last_cpu': cpu}
+
+
+def _saved_algorithm(state):
+    """@return (str) name of checksum algorithm used to save state"""
+    return state[3] if len(state) > 3 else DEFAULT_CHECKSUM
+
+def check_modified_stat(file_stat, state):
+    """check if file is modified from previous "state" using only its stat
     @param file_stat: the value returned from os.stat(file_path)
-    @param state (tuple), timestamp, size, md5
-    @returns (bool):
+    @param state (tuple), timestamp, size, checksum, [algorithm]
+    @returns (bool) or None if file checksum must be compared to decide.
     """
     if state is None:
         return True
 
-    timestamp, size, file_md5 = state
+    timestamp, size = state[:2]
     # 1 - if timestamp is not modified file is the same
     if USE_FILE_TIMESTAMP and file_stat.st_mtime == timestamp:
         return False
     # 2 - if size is different file is modified
     if file_stat.st_size != size:
         return True
-    # 3 - check md5
-    return file_md5 != md5sum(file_path)
+    # 3 - checksum must be checked, using same algorithm used to save state.
+    # if algorithm is not available (i.e. optional module not installed
+    # anymore) it can not be checked
+    if _saved_algorithm(state) not in CHECKSUMS:
+        return True
+    return None
+
+def check_modified_checksum(file_path, state):
+    """check if file content checksum is different from the one on "state"
+    @returns (bool):
+    """
+    return state[2] != file_checksum(file_path, _saved_algorithm(state))
+
+def check_modified(file_path, file_stat, state):
+    """check if file in file_path is modified from previous "state"
+    @param file_path (string): file path
+    @param file_stat: the value returned from os.stat(file_path)
+    @param state (tuple), timestamp, size, checksum, [algorithm]
+                 if algorithm is not present checksum is a md5
+    @returns (bool):
+    """
+    modified = check_modified_stat(file_stat, state)
+    if modified is None:
+        return check_modified_checksum(file_path, state)
+    return modified
+
+
+def thread_map(func, items, num_threads):
+    """same as `map` but func calls are executed on a pool of threads
+
+    Used for I/O bound functions (file checksum - hashlib releases the GIL).
+    If any call raises an exception, it is re-raised after all threads finish.
+
+    @param items: (list) each item is passed as argument to func
+    @param num_threads: (int) maximum number of threads, if less than 2
+                        func is executed on the current thread.
+    @return (list) results in the same order as items
+    """
+    if num_threads < 2 or len(items) < 2:
+        return map(func, items)
+
+    results = [None] * len(items)
+    errors = [] # sys.exc_info of failed calls
+    indexes = iter(xrange(len(items)))
+    lock = threading.Lock()
+    def worker():
+        """execute func for items until there is nothing left"""
+        while not errors:
+            lock.acquire()
+            try:
+                index = indexes.next()
+            except StopIteration:
+                return
+            finally:
+                lock.release()
+            try:
+                results[index] = func(items[index])
+            except Exception:
+                errors.append(sys.exc_info())
+
+    threads = []
+    for _ in xrange(min(num_threads, len(items))):
+        thread = threading.Thread(target=worker)
+        thread.daemon = True
+        thread.start()
+        threads.append(thread)
+    for thread in threads:
+        thread.join()
+    if errors:
+        raise errors[0][0], errors[0][1], errors[0][2]
+    return results
+
+
+class FileSignatureCache(object):
+    """cache of file stat and checksum values shared by all tasks of a run
+
+    A checksum is valid while the file's stat (mtime, size, inode) does not
+    change. So it is saved together with these values and never needs to be
+    invalidated.
+
+    Stat values are valid until a task is executed, as its execution
+    might modify any file. The owner must call `clear_stat` after that.
+    Stat values are cached only if `cache_stat` is set, since files might
+    also be modified by other processes.
+
+    @ivar cache_stat: (bool) enable caching of os.stat values
+    @ivar _stat: (dict) path: os.stat result
+    @ivar _checksum: (dict) (path, mtime, size, inode, algorithm): checksum
+    """
+    def __init__(self, cache_stat=False):
+        self.cache_stat = cache_stat
+        self._stat = {}
+        self._checksum = {}
+
+    def stat(self, path):
+        """@return os.stat(path), raises OSError if path does not exist"""
+        if not self.cache_stat:
+            return os.stat(path)
+        try:
+            return self._stat[path]
+        except KeyError:
+            file_stat = self._stat[path] = os.stat(path)
+            return file_stat
+
+    def clear_stat(self):
+        """discard all cached stat values"""
+        self._stat = {}
+
+    def checksum(self, path, file_stat, algorithm):
+        """@return checksum of file content
+        @param file_stat: current os.stat of file in path
+        """
+        key = (path, file_stat.st_mtime, file_stat.st_size, file_stat.st_ino,
+               algorithm)
+        try:
+            return self._checksum[key]
+        except KeyError:
+            checksum = self._checksum[key] = file_checksum(path, algorithm)
+            return checksum
+
+
+class StatusPrefetch(object):
+    """calculate checksum of file_dep's on threads ahead of `get_status`
+
+    Checksums are saved on the `file_cache` of a dependency manager, so
+    when the status of a task is checked the (slow) checksum of its
+    file_dep's is already available.
+    Files are only read, the status of tasks is still computed by the
+    caller of `get_status`. Saved values from tasks are read by `add`
+    because the DB is not thread-safe.
+
+    @ivar ahead: (int) suggested number of tasks to add in advance
+    @ivar _added: (set - str) name of tasks already added
+    """
+    def __init__(self, dep_manager, num_threads):
+        self.dep_manager = dep_manager
+        self.ahead = num_threads * 4
+        self._added = set()
+        self._queue = Queue.Queue()
+        self._threads = []
+        for _ in xrange(num_threads):
+            thread = threading.Thread(target=self._worker)
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+    def add(self, task):
+        """schedule checksum of task's file_dep"""
+        if task.name in self._added:
+            return
+        self._added.add(task.name)
+        for dep in task.file_dep:
+            state = self.dep_manager._get(task.name, dep)
+            # no saved state, file is considered modified without checksum
+            if state is not None:
+                self._queue.put((dep, state))
+
+    def _worker(self):
+        """get checksum of files until None is received"""
+        file_cache = self.dep_manager.file_cache
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            dep, state = item
+            try:
+                # stat is not saved on file_cache as it might be out-dated
+                # by the time the task status is checked
+                file_stat = os.stat(dep)
+                if check_modified_stat(file_stat, state) is None:
+                    file_cache.checksum(dep, file_stat,
+                                        _saved_algorithm(state))
+            except Exception: # pragma: no cover
+                # errors are reported when the status is checked
+                pass
+            finally:
+                self._queue.task_done()
+
+    def close(self):
+        """discard pending files and wait for threads to finish"""
+        try:
+            while True:
+                self._queue.get_nowait()
+        except Queue.Empty:
+            pass
+        for _ in self._threads:
+            self._queue.put(None)
+        for thread in self._threads:
+            thread.join()
+
 
 
 class JsonDB(object):
-    """Backend using a single text file with JSON content"""
+    """Backend using a single text file with JSON content
+
+    The file is written with one task per line. When loaded only the task ids
+    are decoded, values of a task are decoded only when it is accessed.
+    Files not following this layout are loaded (decoded) at once.
+
+    @ivar _db: (dict) task_id: (dict) decoded task values
+    @ivar _raw: (dict) task_id: (str) JSON encoded task values not decoded yet
+    """
 
     def __init__(self, name):
         """Open/create a DB file"""
         self.name = name
-        if not os.path.exists(self.name):
-            self._db = {}
-        else:
-            self._db = self._load()
+        self._db = {}
+        self._raw = {}
+        if os.path.exists(self.name):
+            self._load()
+
+    def _json_error(self, error):
+        """add info on how to fix corrupted file to ValueError"""
+        msg = (error.args[0] +
+               "\nInvalid JSON data in %s\n" %
+               os.path.abspath(self.name) +
+               "To fix this problem, you can just remove the " +
+               "corrupted file, a new one will be generated.\n")
+        error.args = (msg,)
 
     def _load(self):
         """load db content from file"""
         db_file = open(self.name, 'r')
         try:
+            content = db_file.read()
+        finally:
+            db_file.close()
+        try:
+            raw = self._index(content)
+            if raw is None:
+                self._db = json.loads(content)
+            else:
+                self._raw = raw
+        except ValueError, error:
+            # file contains corrupted json data
+            self._json_error(error)
+            raise
+
+    @staticmethod
+    def _index(content):
+        """get (not decoded) values of each task from file content
+
+        @return: (dict) task_id: (str) JSON values,
+                 (None) if content is not written one task per line
+        """
+        lines = content.splitlines()
+        if len(lines) < 2 or lines[0] != '{' or lines[-1] != '}':
+            return None
+        decoder = json.JSONDecoder()
+        raw = {}
+        entries = lines[1:-1]
+        last = len(entries) - 1
+        for num, line in enumerate(entries):
+            try:
+                task_id, pos = decoder.raw_decode(line)
+            except ValueError:
+                return None
+            if line[pos:pos+2] != ': ':
+                return None
+            if num == last:
+                value = line[pos+2:]
+            elif line.endswith(','):
+                value = line[pos+2:-1]
+            else:
+                return None
+            raw[task_id] = value
+        return raw
+
+    def _task(self, task_id):
+        """@return: (dict) values of task, (None) if not in DB"""
+        if task_id in self._raw:
             try:
-                return json.load(db_file)
+                self._db[task_id] = json.loads(self._raw.pop(task_id))
             except ValueError, error:
-                # file contains corrupted json data
-                msg = (error.args[0] +
-                       "\nInvalid JSON data in %s\n" %
-                       os.path.abspath(self.name) +
-                       "To fix this problem, you can just remove the " +
-                       "corrupted file, a new one will be generated.\n")
-                error.args = (msg,)
+                self._json_error(error)
                 raise
-        finally:
-            db_file.close()
+        return self._db.get(task_id)
 
     def dump(self):
         """save DB content in file"""
+        # write a new file and replace the old one,
+        # so the DB is not lost if interrupted
+        tmp_name = self.name + '.tmp'
+        db_file = open(tmp_name, 'w')
         try:
-            db_file = open(self.name, 'w')
-            json.dump(self._db, db_file)
+            self._write(db_file)
         finally:
             db_file.close()
+        if os.path.exists(self.name): # rename wont replace file on windows
+            os.remove(self.name)
+        os.rename(tmp_name, self.name)
+
+    def close(self):
+        """close DB without saving, file is not kept open"""
+        pass
+
+    def sync(self):
+        """save DB content in file, DB can still be used"""
+        self.dump()
+
+    def _write(self, db_file):
+        """write DB content into an open file, one task per line"""
+        entries = ['%s: %s' % (json.dumps(task_id), json.dumps(values))
+                   for task_id, values in self._db.iteritems()]
+        entries.extend('%s: %s' % (json.dumps(task_id), values)
+                       for task_id, values in self._raw.iteritems())
+        if entries:
+            db_file.write('{\n%s\n}\n' % ',\n'.join(entries))
+        else:
+            db_file.write('{\n}\n')
 
     def set(self, task_id, dependency, value):
         """Store value in the DB."""
-        if task_id not in self._db:
-            self._db[task_id] = {}
-        self._db[task_id][dependency] = value
+        values = self._task(task_id)
+        if values is None:
+            values = self._db[task_id] = {}
+        values[dependency] = value
 
 
     def get(self, task_id, dependency):
@@ -110,23 +485,129 @@ class JsonDB(object):
 
         @return: (string) or (None) if entry not found
         """
-        if task_id in self._db:
-            return self._db[task_id].get(dependency, None)
+        values = self._task(task_id)
+        if values is not None:
+            return values.get(dependency, None)
 
 
     def in_(self, task_id):
         """@return bool if task_id is in DB"""
-        return task_id in self._db
+        return task_id in self._db or task_id in self._raw
 
 
     def remove(self, task_id):
         """remove saved dependecies from DB for taskId"""
-        if task_id in self._db:
-            del self._db[task_id]
+        self._db.pop(task_id, None)
+        self._raw.pop(task_id, None)
 
     def remove_all(self):
         """remove saved dependecies from DB for all tasks"""
         self._db = {}
+        self._raw = {}
+
+    def task_ids(self):
+        """@return (list - str) id of all tasks in the DB"""
+        return list(self._db) + list(self._raw)
+
+    def compact(self):
+        """nothing to do, whole DB content is always written on dump"""
+        pass
+
+
+class JsonJournalDB(JsonDB):
+    """Backend using a JSON file plus an append-only journal file
+
+    On 'dump' only the tasks modified since the DB was opened are saved.
+    They are appended to the journal (file <name>.journal) one JSON line
+    per task, containing all the task values (or null if task was removed).
+    The journal is replayed when the DB is loaded.
+
+    When the number of entries in the journal gets bigger than the number
+    of tasks the DB is compacted: whole content is written into the JSON
+    file (same format as JsonDB) and the journal is removed.
+
+    @ivar journal_name: (str) file name/path of journal
+    @ivar dirty: (set) id of tasks modified/removed since last dump
+    @ivar _journal_len: (int) number of entries in the journal file
+    @ivar _compact: (bool) force compaction on next dump
+    """
+    # journal is never compacted while it has less entries than this
+    MIN_COMPACT = 100
+
+    def __init__(self, name):
+        """Open/create a DB file"""
+        self.journal_name = name + '.journal'
+        self.dirty = set()
+        self._journal_len = 0
+        self._compact = False
+        JsonDB.__init__(self, name)
+        if os.path.exists(self.journal_name):
+            self._replay()
+
+    def _replay(self):
+        """apply changes from journal file into loaded DB content"""
+        journal = open(self.journal_name, 'r')
+        try:
+            for line in journal:
+                try:
+                    task_id, values = json.loads(line)
+                except ValueError:
+                    # incomplete entry, doit was killed while writing it.
+                    # journal can not be appended anymore.
+                    self._compact = True
+                    break
+                self._raw.pop(task_id, None)
+                if values is None:
+                    self._db.pop(task_id, None)
+                else:
+                    self._db[task_id] = values
+                self._journal_len += 1
+        finally:
+            journal.close()
+
+    def dump(self):
+        """append modified tasks to journal or compact DB"""
+        journal_len = self._journal_len + len(self.dirty)
+        num_tasks = len(self._db) + len(self._raw)
+        if self._compact or journal_len > max(self.MIN_COMPACT, num_tasks):
+            self.compact()
+            return
+        if self.dirty:
+            journal = open(self.journal_name, 'a')
+            try:
+                for task_id in self.dirty:
+                    entry = [task_id, self._db.get(task_id)]
+                    journal.write(json.dumps(entry) + '\n')
+            finally:
+                journal.close()
+            self._journal_len = journal_len
+        self.dirty = set()
+
+    def compact(self):
+        """write whole DB content into JSON file and remove journal"""
+        JsonDB.dump(self)
+        if os.path.exists(self.journal_name):
+            os.remove(self.journal_name)
+        self.dirty = set()
+        self._journal_len = 0
+        self._compact = False
+
+    def set(self, task_id, dependency, value):
+        """Store value in the DB."""
+        JsonDB.set(self, task_id, dependency, value)
+        self.dirty.add(task_id)
+
+    def remove(self, task_id):
+        """remove saved dependecies from DB for taskId"""
+        if self.in_(task_id):
+            JsonDB.remove(self, task_id)
+            self.dirty.add(task_id)
+
+    def remove_all(self):
+        """remove saved dependecies from DB for all tasks"""
+        JsonDB.remove_all(self)
+        self.dirty = set()
+        self._compact = True
 
 
 class DbmDB(object):
@@ -138,16 +619,37 @@ class DbmDB(object):
     to the 'dirty' set. Only on 'dump' all dirty items values are encoded
     in json into _dbm and the DBM file is saved.
 
+    Values can also be encoded with python's marshal (binary) format,
+    that is smaller and faster to encode/decode. Marshal encoded items
+    start with MARSHAL_PREFIX, items in both formats can always be read.
+    On marshal items the dependency names (usually file paths) are replaced
+    by an integer id, the list of names is saved on the item KEYS_ITEM.
+
     @ivar name: (str) file name/path
+    @ivar binary: (bool) encode modified items with marshal
     @ivar _dbm: (dbm) items with json encoded values
     @ivar _db: (dict) items with python-dict as value
     @ivar dirty: (set) id of modified tasks
+    @ivar _keys: (list) dependency names used by marshal items
+                 (None if not loaded yet)
+    @ivar _key_ids: (dict) dependency name: position in _keys
+    @ivar _keys_saved: (int) number of _keys saved in the DBM file
     """
     DBM_CONTENT_ERROR_MSG = 'db type could not be determined'
-
-    def __init__(self, name):
+    # JSON encoded items always start with '{'
+    MARSHAL_PREFIX = '\x00'.encode('ascii')
+    # not a valid task name
+    KEYS_ITEM = '\x00keys'
+    # file extensions used by different DBM modules
+    DBM_EXTENSIONS = ('', '.db', '.dat', '.dir', '.pag', '.bak')
+
+    def __init__(self, name, binary=False):
         """Open/create a DB file"""
         self.name = name
+        self.binary = binary
+        self._keys = None
+        self._key_ids = None
+        self._keys_saved = 0
         try:
             self._dbm = ddbm.open(self.name, 'c')
         except ddbm.error, exception:
@@ -171,10 +673,62 @@ class DbmDB(object):
 
     def dump(self):
         """save/close DBM file"""
-        for task_id in self.dirty:
-            self._dbm[task_id] = json.dumps(self._db[task_id])
+        self.sync()
+        self.close()
+
+    def close(self):
+        """close DBM file without saving modified items"""
         self._dbm.close()
 
+    def sync(self):
+        """save modified items in DBM file, DB can still be used"""
+        items = [(task_id, self._encode(self._db[task_id]))
+                 for task_id in self.dirty]
+        # new keys must be saved before items using them
+        if self._keys is not None and self._keys_saved != len(self._keys):
+            self._dbm[self.KEYS_ITEM] = marshal.dumps(self._keys)
+            self._keys_saved = len(self._keys)
+        for task_id, data in items:
+            self._dbm[task_id] = data
+        self.dirty = set()
+        # not all dbm modules support sync
+        if hasattr(self._dbm, 'sync'):
+            self._dbm.sync()
+
+    def _load_keys(self):
+        """load list of dependency names used by marshal items"""
+        if self._keys is None:
+            try:
+                self._keys = marshal.loads(self._dbm[self.KEYS_ITEM])
+            except KeyError:
+                self._keys = []
+            self._keys_saved = len(self._keys)
+            self._key_ids = dict((key, key_id) for key_id, key
+                                 in enumerate(self._keys))
+
+    def _encode(self, values):
+        """@return: (str) encoded values of a task"""
+        if not self.binary:
+            return json.dumps(values)
+        self._load_keys()
+        record = {}
+        for key, value in values.iteritems():
+            key_id = self._key_ids.get(key)
+            if key_id is None:
+                key_id = self._key_ids[key] = len(self._keys)
+                self._keys.append(key)
+            record[key_id] = value
+        return self.MARSHAL_PREFIX + marshal.dumps(record)
+
+    def _decode(self, data):
+        """@return: (dict) values of a task from encoded data"""
+        if data[:1] != self.MARSHAL_PREFIX:
+            return json.loads(data.decode('utf-8'))
+        self._load_keys()
+        keys = self._keys
+        return dict((keys[key_id], value) for key_id, value
+                    in marshal.loads(data[1:]).iteritems())
+
     def set(self, task_id, dependency, value):
         """Store value in the DB."""
         if task_id not in self._db:
@@ -206,7 +760,7 @@ class DbmDB(object):
                 task_data = self._dbm[task_id]
             except KeyError:
                 return
-            self._db[task_id] = json.loads(task_data.decode('utf-8'))
+            self._db[task_id] = self._decode(task_data)
             return self._db[task_id].get(dependency, None)
 
 
@@ -227,35 +781,211 @@ class DbmDB(object):
     def remove_all(self):
         """remove saved dependecies from DB for all tasks"""
         self._db = {}
-        # dumb dbm always opens file in update mode
+        self._new_dbm()
+        self.dirty = set()
+        self._keys = None
+
+    def _new_dbm(self):
+        """close DBM file and replace it by a new empty one"""
+        # dumb dbm always opens file in update mode, so remove its files
         if isinstance(self._dbm, dumbdbm._Database): # pragma: no cover
-            self._dbm._index = {}
             self._dbm.close()
+            for ext in ('.dat', '.dir', '.bak'):
+                if os.path.exists(self.name + ext):
+                    os.remove(self.name + ext)
         # gdbm can not be running on 2 instances on same thread
         # see https://bitbucket.org/schettino72/doit/issue/16/
         del self._dbm
         self._dbm = ddbm.open(self.name, 'n')
+
+    def task_ids(self):
+        """@return (list - str) id of all tasks in the DB"""
+        ids = set(self.dirty)
+        for key in self._dbm.keys():
+            task_id = key.decode('utf-8')
+            if task_id != self.KEYS_ITEM:
+                ids.add(task_id)
+        return list(ids)
+
+    def compact(self):
+        """rebuild DBM file with its current items, reclaiming unused space
+
+        Items are copied into a new DBM file that replaces the original
+        one only after complete, so the DB is not lost if interrupted.
+        """
+        self.sync()
+        tmp_name = self.name + '.tmp'
+        self._remove_files(tmp_name)
+        new_dbm = ddbm.open(tmp_name, 'n')
+        try:
+            for key in self._dbm.keys():
+                new_dbm[key] = self._dbm[key]
+        finally:
+            new_dbm.close()
+        self._dbm.close()
+        for ext in self.DBM_EXTENSIONS:
+            if os.path.exists(tmp_name + ext):
+                # rename wont replace file on windows
+                if os.name == 'nt' and os.path.exists(self.name + ext):
+                    os.remove(self.name + ext) # pragma: no cover
+                os.rename(tmp_name + ext, self.name + ext)
+        self._dbm = ddbm.open(self.name, 'c')
+
+    def _remove_files(self, name):
+        """remove all files used by a DBM file"""
+        for ext in self.DBM_EXTENSIONS:
+            if os.path.exists(name + ext):
+                os.remove(name + ext)
+
+
+
+class SqliteDB(object):
+    """Backend using a SQLite database with one row per (task, dependency)
+
+    Values are encoded in JSON. Values from a task are read with a single
+    query on its first access and cached on _db.
+    Modified values are written on 'dump' using a single transaction, so the
+    database file is always in a consistent state even if doit is killed.
+
+    @ivar name: (str) file name/path
+    @ivar _conn: (sqlite3.Connection)
+    @ivar _db: (dict) task_id: dict with all values from a task
+    @ivar dirty: (set) (task_id, dependency) of modified values
+    """
+    # older SQLite versions say 'file is encrypted or is not a database'
+    DB_CONTENT_ERROR_MSG = 'not a database'
+
+    def __init__(self, name):
+        """Open/create a DB file"""
+        self.name = name
+        self._conn = sqlite3.connect(self.name)
+        try:
+            self._conn.execute(
+                'CREATE TABLE IF NOT EXISTS doit ('
+                ' task_id TEXT NOT NULL,'
+                ' dependency TEXT NOT NULL,'
+                ' value TEXT,'
+                ' PRIMARY KEY (task_id, dependency))')
+        except sqlite3.DatabaseError, exception:
+            self._conn.close()
+            if self.DB_CONTENT_ERROR_MSG in str(exception):
+                new_message = (
+                    'Dependencies file in %(filename)s seems to use '
+                    'an old format or is corrupted.\n'
+                    'To fix the issue you can just remove the database file '
+                    'and a new one will be generated.'
+                    % {'filename': repr(self.name)})
+                raise exception.__class__, new_message
+            raise
+        self._db = {}
         self.dirty = set()
 
+    def dump(self):
+        """save modified values and close DB file"""
+        self.sync()
+        self.close()
+
+    def close(self):
+        """close DB file, modified values not commited are discarded"""
+        self._conn.close()
+
+    def sync(self):
+        """commit modified values, DB can still be used"""
+        rows = []
+        for task_id, dependency in self.dirty:
+            value = self._db[task_id][dependency]
+            rows.append((task_id, dependency, json.dumps(value)))
+        self._conn.executemany(
+            'INSERT OR REPLACE INTO doit (task_id, dependency, value) '
+            'VALUES (?, ?, ?)', rows)
+        self._conn.commit()
+        self.dirty = set()
+
+    def _task_values(self, task_id):
+        """@return (dict) all values from a task (loaded from DB on demand)"""
+        try:
+            return self._db[task_id]
+        except KeyError:
+            cursor = self._conn.execute(
+                'SELECT dependency, value FROM doit WHERE task_id = ?',
+                (task_id,))
+            values = dict((dep, json.loads(value)) for dep, value in cursor)
+            self._db[task_id] = values
+            return values
+
+    def set(self, task_id, dependency, value):
+        """Store value in the DB."""
+        self._task_values(task_id)[dependency] = value
+        self.dirty.add((task_id, dependency))
+
+    def get(self, task_id, dependency):
+        """Get value stored in the DB.
+
+        @return: (string) or (None) if entry not found
+        """
+        return self._task_values(task_id).get(dependency, None)
+
+    def in_(self, task_id):
+        """@return bool if task_id is in DB"""
+        if task_id in self._db:
+            return bool(self._db[task_id])
+        cursor = self._conn.execute(
+            'SELECT 1 FROM doit WHERE task_id = ? LIMIT 1', (task_id,))
+        return cursor.fetchone() is not None
+
+    def remove(self, task_id):
+        """remove saved dependecies from DB for taskId"""
+        self._conn.execute('DELETE FROM doit WHERE task_id = ?', (task_id,))
+        self._db[task_id] = {}
+        self.dirty = set(key for key in self.dirty if key[0] != task_id)
+
+    def remove_all(self):
+        """remove saved dependecies from DB for all tasks"""
+        self._conn.execute('DELETE FROM doit')
+        self._db = {}
+        self.dirty = set()
+
+    def task_ids(self):
+        """@return (list - str) id of all tasks in the DB"""
+        ids = set(task_id for task_id, _ in self.dirty)
+        cursor = self._conn.execute('SELECT DISTINCT task_id FROM doit')
+        ids.update(row[0] for row in cursor)
+        return list(ids)
+
+    def compact(self):
+        """commit changes and rebuild the database file (VACUUM)"""
+        self.sync()
+        self._conn.execute('VACUUM')
 
 
 class DependencyBase(object):
     """Manage tasks dependencies (abstract class)
 
-    Each dependency is a saved in "db". the "db" can have json or dbm
+    Each dependency is a saved in "db". the "db" can have json, dbm or sqlite
     format where there is a dictionary for every task. each task has a
     dictionary where key is a dependency (abs file path), and the value is the
     dependency signature.
     Apart from dependencies onther values are also saved on the task dictionary
      * 'result:', 'task:<task-name>', 'ignore:'
      * user(task) defined values are defined in '_values_:' sub-dict
+     * execution time statistics are saved in '_duration_:'
 
     @ivar name: (string) filepath of the DB file
+    @ivar checksum: (string) name of algorithm used to calculate file checksum
+    @ivar checksum_threads: (int) number of threads used to calculate
+                            checksum of file_dep's from a task concurrently
+    @ivar file_cache: (FileSignatureCache) stat/checksum of file_dep's
+    @ivar target_sigs: (dict) path: signature of targets from tasks
+                       executed on this run (see `save_targets`)
     @ivar _closed: (bool) DB was flushed to file
     """
 
-    def __init__(self, backend):
+    def __init__(self, backend, checksum=DEFAULT_CHECKSUM, checksum_threads=0):
         self._closed = False
+        self.checksum = checksum
+        self.checksum_threads = checksum_threads
+        self.file_cache = FileSignatureCache()
+        self.target_sigs = {}
         self.backend = backend
         self._set = self.backend.set
         self._get = self.backend.get
@@ -264,20 +994,57 @@ class DependencyBase(object):
         self._in = self.backend.in_
         self.name = self.backend.name
 
-    def close(self):
-        """Write DB in file"""
+    def close(self, save=True):
+        """Write DB in file
+
+        @param save: (bool) if False modified values are not written,
+                     the DB file is just closed
+        """
         if not self._closed:
-            self.backend.dump()
+            if save:
+                self.backend.dump()
+            else:
+                self.backend.close()
             self._closed = True
 
+    def checkpoint(self):
+        """Write modified values in file, keeping DB open"""
+        if not self._closed:
+            self.backend.sync()
+
+    def gc(self, task_names):
+        """remove saved data from tasks that do not exist anymore
+
+        The DB file is also rebuilt to reclaim unused space.
+
+        @param task_names: (iterable - str) name of all existing tasks
+        @return: (list - str) name of removed tasks
+        """
+        existing = set(task_names)
+        removed = sorted(task_id for task_id in self.backend.task_ids()
+                         if task_id not in existing)
+        for task_id in removed:
+            self.remove(task_id)
+        self.backend.compact()
+        return removed
+
 
     ####### task specific
 
     def save_success(self, task):
         """save info after a task is successfuly executed"""
+        # task execution might have modified any file
+        self.file_cache.clear_stat()
+
         # save task values
         self._set(task.name, "_values_:", task.values)
 
+        # save execution time
+        if task.duration is not None:
+            stats = update_duration_stats(self._get(task.name, "_duration_:"),
+                                          task.duration)
+            self._set(task.name, "_duration_:", stats)
+
         # save task result md5
         if task.result:
             if isinstance(task.result, dict):
@@ -286,15 +1053,58 @@ class DependencyBase(object):
                 self._set(task.name, "result:", get_md5(task.result))
 
         # file-dep
+        modified = []
         for dep in task.file_dep:
             timestamp = os.path.getmtime(dep)
             # time optimization. if dep is already saved with current timestamp
-            # skip calculating md5
+            # skip calculating checksum
             current = self._get(task.name, dep)
             if current and current[0] == timestamp:
                 continue
-            size = os.path.getsize(dep)
-            self._set(task.name, dep, (timestamp, size, md5sum(dep)))
+            modified.append(dep)
+
+        # file checksum might be calculated concurrently
+        signatures = thread_map(self._file_signature, modified,
+                                self.checksum_threads)
+        for dep, signature in zip(modified, signatures):
+            self._set(task.name, dep, signature)
+
+    def _file_signature(self, path):
+        """@return (tuple) timestamp, size, checksum, algorithm"""
+        signature = self.target_sigs.get(path)
+        if signature is not None and signature[3] == self.checksum:
+            return signature
+        file_stat = self.file_cache.stat(path)
+        checksum = self.file_cache.checksum(path, file_stat, self.checksum)
+        return (file_stat.st_mtime, file_stat.st_size, checksum, self.checksum)
+
+    def save_targets(self, task):
+        """record signature of targets after a task is successfuly executed
+
+        Tasks with a file_dep on these targets compare the recorded
+        signature to their saved state, without checking the file again.
+        So if a target is re-created with the same content its dependent
+        tasks are up-to-date (early cutoff).
+        Must be called after `save_success`.
+        """
+        signatures = thread_map(self._target_signature, task.targets,
+                                self.checksum_threads)
+        for target, signature in zip(task.targets, signatures):
+            if signature is None:
+                self.target_sigs.pop(target, None)
+            else:
+                self.target_sigs[target] = signature
+
+    def _target_signature(self, path):
+        """@return (tuple) signature, None if path is not a regular file"""
+        try:
+            file_stat = self.file_cache.stat(path)
+        except os.error:
+            return None
+        if not stat.S_ISREG(file_stat.st_mode):
+            return None
+        checksum = self.file_cache.checksum(path, file_stat, self.checksum)
+        return (file_stat.st_mtime, file_stat.st_size, checksum, self.checksum)
 
 
     def get_values(self, task_name):
@@ -304,6 +1114,23 @@ class DependencyBase(object):
         values = self._get(task_name, '_values_:')
         return values or {}
 
+    def get_duration(self, task_name):
+        """get execution time statistics from a task
+        @return (dict) see update_duration_stats, None if never executed
+        """
+        return self._get(task_name, '_duration_:')
+
+    def get_durations(self, task_names):
+        """get average wall time of tasks that were executed before
+        @return (dict) task name: seconds
+        """
+        durations = {}
+        for name in task_names:
+            stats = self.get_duration(name)
+            if stats:
+                durations[name] = stats['wall']
+        return durations
+
     def get_value(self, task_id, key_name):
         """get saved value from task
         @param task_id (str)
@@ -320,6 +1147,10 @@ class DependencyBase(object):
 
     def remove_success(self, task):
         """remove saved info from task"""
+        # task execution might have modified any file
+        self.file_cache.clear_stat()
+        for target in task.targets:
+            self.target_sigs.pop(target, None)
         self.remove(task.name)
 
     def ignore(self, task):
@@ -382,30 +1213,92 @@ class DependencyBase(object):
                 return 'run'
 
         # check for modified file_dep
-        changed = []
-        status = 'up-to-date' # initial assumption
-        for dep in tuple(task.file_dep):
+        file_deps = tuple(task.file_dep)
+        changed = set()
+        # (dep, stat, state) check can not be decided by stat only
+        to_checksum = []
+        # (dep, signature) same content but saved with another timestamp
+        cutoff = []
+        for dep in file_deps:
+            state = self._get(task.name, dep)
+            # target re-created on this run, compare its recorded signature
+            signature = self.target_sigs.get(dep)
+            if (signature is not None and state is not None and
+                _saved_algorithm(state) == signature[3]):
+                if state[2] != signature[2]:
+                    changed.add(dep)
+                elif state[0] != signature[0]:
+                    cutoff.append((dep, signature))
+                continue
             try:
-                file_stat = os.stat(dep)
+                file_stat = self.file_cache.stat(dep)
             except os.error:
                 raise Exception("Dependent file '%s' does not exist." % dep)
-            if check_modified(dep, file_stat, self._get(task.name, dep)):
-                changed.append(dep)
-                status = 'run'
-
-        task.dep_changed = changed #FIXME create a separate function for this
-        return status
+            modified = check_modified_stat(file_stat, state)
+            if modified is None:
+                to_checksum.append((dep, file_stat, state))
+            elif modified:
+                changed.add(dep)
+
+        # file checksum might be calculated concurrently
+        modified = thread_map(self._check_modified_checksum, to_checksum,
+                              self.checksum_threads)
+        for (dep, _, _), dep_modified in zip(to_checksum, modified):
+            if dep_modified:
+                changed.add(dep)
+
+        #FIXME create a separate function for this
+        task.dep_changed = [dep for dep in file_deps if dep in changed]
+        if changed:
+            return 'run'
+        # save new timestamp, so next time it is checked by stat only
+        for dep, signature in cutoff:
+            self._set(task.name, dep, signature)
+        return 'up-to-date'
+
+    def _check_modified_checksum(self, dep_stat_state):
+        """check_modified_checksum using checksum from file_cache
+        @param dep_stat_state: (tuple) path, os.stat, saved state
+        """
+        dep, file_stat, state = dep_stat_state
+        checksum = self.file_cache.checksum(dep, file_stat,
+                                            _saved_algorithm(state))
+        return state[2] != checksum
 
 
 class JsonDependency(DependencyBase):
     """Task dependency manager with JSON backend"""
-    def __init__(self, name):
-        DependencyBase.__init__(self, JsonDB(name))
+    def __init__(self, name, **kwargs):
+        DependencyBase.__init__(self, JsonDB(name), **kwargs)
+
+class JsonJournalDependency(DependencyBase):
+    """Task dependency manager with JSON + journal backend"""
+    def __init__(self, name, **kwargs):
+        DependencyBase.__init__(self, JsonJournalDB(name), **kwargs)
 
 class DbmDependency(DependencyBase):
     """Task dependency manager with DBM backend"""
-    def __init__(self, name):
-        DependencyBase.__init__(self, DbmDB(name))
+    def __init__(self, name, **kwargs):
+        DependencyBase.__init__(self, DbmDB(name), **kwargs)
+
+class DbmMarshalDependency(DependencyBase):
+    """Task dependency manager with DBM backend, items encoded by marshal"""
+    def __init__(self, name, **kwargs):
+        DependencyBase.__init__(self, DbmDB(name, binary=True), **kwargs)
+
+class SqliteDependency(DependencyBase):
+    """Task dependency manager with SQLite backend"""
+    def __init__(self, name, **kwargs):
+        DependencyBase.__init__(self, SqliteDB(name), **kwargs)
+
+
+# name of backends available to be selected on cmd line
+BACKENDS = {'dbm': DbmDependency,
+            'dbm-marshal': DbmMarshalDependency,
+            'json': JsonDependency,
+            'json-journal': JsonJournalDependency,
+            'sqlite3': SqliteDependency,
+            }
 
 
 class UptodateCalculator(object):
@@ -427,7 +1320,8 @@ import platform
 python_version = platform.python_version().split('.')
 if python_version[0] == '2' and python_version[1] == '5': # pragma: no cover
     # use json by default on python2.5 because gdbm in python2.5 is broken
-    Dependency = JsonDependency
+    DEFAULT_BACKEND = 'json'
 else:
-    Dependency = DbmDependency
+    DEFAULT_BACKEND = 'dbm'
+Dependency = BACKENDS[DEFAULT_BACKEND]
 
@@ -15,6 +15,8 @@ from .cmd_list import List
 from .cmd_forget import Forget
 from .cmd_ignore import Ignore
 from .cmd_auto import Auto
+from .cmd_gc import GarbageCollect
+from .cmd_plan import Plan
 
 
 
@@ -128,7 +130,8 @@ class Help(Command):
 
 
 class DoitMain(object):
-    DOIT_CMDS = Run, List, Clean, Forget, Ignore, Auto
+    DOIT_CMDS = (Run, List, Clean, Forget, Ignore, Auto, GarbageCollect,
+                 Plan)
     TASK_LOADER = DodoTaskLoader
 
     def __init__(self, task_loader=None):
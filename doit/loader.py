@@ -31,6 +31,18 @@ def flat_generator(gen, gen_doc=''):
             yield item, gen_doc
 
 
+def lazy_subtasks(task_generator):
+    """decorator for task generators yielding a huge number of sub-tasks
+
+    Sub-tasks are created only when the group task is dispatched for
+    execution (by the `run` command), see L{expand_lazy_tasks}.
+    Restrictions: it can only yield sub-tasks and other tasks can not
+    refer to its sub-tasks (by name, wildcard or its targets).
+    """
+    task_generator.lazy_subtasks = True
+    return task_generator
+
+
 def get_module(dodo_file, cwd=None, seek_parent=False):
     """
     The python file defining tasks is called "dodo" file.
@@ -130,10 +142,27 @@ def load_tasks(dodo_module, command_names=()):
 
     task_list = []
     for name, ref, line in funcs:
-        task_list.extend(generate_tasks(name, ref(), ref.__doc__))
+        lazy = getattr(ref, 'lazy_subtasks', False)
+        task_list.extend(generate_tasks(name, ref(), ref.__doc__, lazy))
     return task_list
 
 
+def expand_lazy_tasks(task_list):
+    """create all sub-tasks from lazy task generators
+
+    @return (list - Task) task_list including the created sub-tasks
+    """
+    expanded = []
+    for task in task_list:
+        expanded.append(task)
+        if task.subtask_iter is not None:
+            for sub_task in task.subtask_iter:
+                task.task_dep.append(sub_task.name)
+                expanded.append(sub_task)
+            task.subtask_iter = None
+    return expanded
+
+
 def load_doit_config(dodo_module):
     """
     @param dodo_module (dict) dict with module members
@@ -206,19 +235,44 @@ def _generate_task_from_yield(tasks, func_name, task_dict, gen_doc):
         tasks[basename] = dict_to_task(task_dict)
 
 
-def generate_tasks(func_name, gen_result, gen_doc=None):
+def _generate_lazy_subtasks(func_name, gen_result, gen_doc):
+    """generate sub-tasks from a lazy task generator (one at a time)"""
+    for task_dict, _ in flat_generator(gen_result, gen_doc):
+        if not isinstance(task_dict, dict):
+            raise InvalidTask("Task '%s' must yield dictionaries" %
+                              func_name)
+        if 'name' not in task_dict or 'basename' in task_dict:
+            msg = ("Task '%s'. Lazy task generators can only yield " +
+                   "sub-tasks (field 'name' without 'basename'). %s")
+            raise InvalidTask(msg % (func_name, task_dict))
+        task_dict['name'] = "%s:%s"% (func_name, task_dict['name'])
+        sub_task = dict_to_task(task_dict)
+        sub_task.is_subtask = True
+        yield sub_task
+
+
+def generate_tasks(func_name, gen_result, gen_doc=None, lazy=False):
     """Create tasks from a task generator result.
 
     @param func_name: (string) name of taskgen function
     @param gen_result: value returned by a task generator function
                        it can be a dict or generator (generating dicts)
     @param gen_doc: (string/None) docstring from the task generator function
+    @param lazy: (bool) sub-tasks from a generator are not created, the
+                 group task gets an iterator that creates them
     @return: (tuple) task, list of subtasks
     """
     # task described as a dictionary
     if isinstance(gen_result, dict):
         return [_generate_task_from_return(func_name, gen_result, gen_doc)]
 
+    # a generator, sub-tasks created later
+    if lazy and isgenerator(gen_result):
+        group_task = Task(func_name, None, doc=gen_doc, has_subtask=True)
+        group_task.subtask_iter = _generate_lazy_subtasks(func_name,
+                                                          gen_result, gen_doc)
+        return [group_task]
+
     # a generator
     if isgenerator(gen_result):
         tasks = {} # task_name: task
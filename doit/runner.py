@@ -1,12 +1,17 @@
 """Task runner"""
 
 import sys
-from multiprocessing import Process, Queue
+import time
+import threading
+from multiprocessing import Process, Queue, Event
+from Queue import Queue as ThreadQueue, Empty
 
 from .exceptions import InvalidTask, CatchedException
 from .exceptions import TaskFailed, SetupError, DependencyError, UnmetDependency
-from .dependency import Dependency
+from .dependency import Dependency, StatusPrefetch
+from .action import PythonAction
 from .control import ExecNode
+from .tools import result_dep
 
 # execution result.
 SUCCESS = 0
@@ -27,18 +32,43 @@ class Runner(object):
 
     """
     def __init__(self, dependency_file, reporter, continue_=False,
-                 always_execute=False, verbosity=0):
+                 always_execute=False, verbosity=0, dep_manager=None,
+                 checkpoint=0, checkpoint_time=0, prefetch=0,
+                 early_cutoff=False):
         """@param dependency_file: (string) file path of the db file
         @param reporter: reporter to be used. It can be a class or an object
         @param continue_: (bool) execute all tasks even after a task failure
         @param always_execute: (bool) execute even if up-to-date or ignored
         @param verbosity: (int) 0,1,2 see Task.execute
+        @param dep_manager: (DependencyBase) if not given a default
+                            Dependency using dependency_file is created
+        @param checkpoint: (int) save DB after this number of successful
+                           tasks (0 save only when finished)
+        @param checkpoint_time: (int) save DB if more than this number of
+                                seconds elapsed since last save (0 disabled)
+        @param prefetch: (int) number of threads used to calculate checksum
+                         of file_dep's from tasks ahead of their selection
+                         (0 disabled)
+        @param early_cutoff: (bool) record signature of targets from executed
+                             tasks, so dependent tasks are not executed if
+                             targets content did not change
         """
-        self.dep_manager = Dependency(dependency_file)
+        if dep_manager is None:
+            dep_manager = Dependency(dependency_file)
+        self.dep_manager = dep_manager
+        # files are stat'ed only once between task executions
+        self.dep_manager.file_cache.cache_stat = True
         self.reporter = reporter
         self.continue_ = continue_
         self.always_execute = always_execute
         self.verbosity = verbosity
+        self.checkpoint = checkpoint
+        self.checkpoint_time = checkpoint_time
+        self._checkpoint_count = 0 # successful tasks since last checkpoint
+        self._checkpoint_last = time.time()
+        self.prefetch = prefetch
+        self._prefetch = None # StatusPrefetch while running
+        self.early_cutoff = early_cutoff
 
         self.teardown_list = [] # list of tasks to be teardown
         self.final_result = SUCCESS # until something fails
@@ -149,6 +179,14 @@ class Runner(object):
         return True
 
 
+    def _prefetch_status(self, task_dispatcher):
+        """start checking file_dep of tasks that will be selected next"""
+        if self._prefetch is None:
+            return
+        for task in task_dispatcher.settled_tasks(self._prefetch.ahead):
+            self._prefetch.add(task)
+
+
     def execute_task(self, task):
         """execute task's actions"""
         # register cleanup/teardown
@@ -157,7 +195,21 @@ class Runner(object):
 
         # finally execute it!
         self.reporter.execute_task(task)
-        return task.execute(sys.stdout, sys.stderr, self.verbosity)
+        t_result = task.execute(sys.stdout, sys.stderr, self.verbosity)
+        if self._prefetch is not None:
+            # CPU time used by prefetch threads can not be told apart
+            self._drop_cpu_time(task)
+        return t_result
+
+    @staticmethod
+    def _drop_cpu_time(task):
+        """remove CPU time from task duration
+
+        CPU time is taken from the whole process, it is not valid if other
+        threads were running while the task was executed.
+        """
+        if task.duration is not None:
+            task.duration = (task.duration[0], None)
 
 
     def process_task_result(self, node, catched_excp):
@@ -168,12 +220,27 @@ class Runner(object):
             node.run_status = "successful"
             task.save_extra_values()
             self.dep_manager.save_success(task)
+            if self.early_cutoff:
+                self.dep_manager.save_targets(task)
             self.reporter.add_success(task)
+            self._checkpoint()
         # task error
         else:
             self._handle_task_error(node, catched_excp)
 
 
+    def _checkpoint(self):
+        """save DB content if checkpoint interval was reached"""
+        self._checkpoint_count += 1
+        now = time.time()
+        if ((self.checkpoint and self._checkpoint_count >= self.checkpoint) or
+            (self.checkpoint_time and
+             now - self._checkpoint_last >= self.checkpoint_time)):
+            self.dep_manager.checkpoint()
+            self._checkpoint_count = 0
+            self._checkpoint_last = now
+
+
     def run_tasks(self, task_dispatcher):
         """This will actually run/execute the tasks.
         It will check file dependencies to decide if task should be executed
@@ -192,6 +259,7 @@ class Runner(object):
             except StopIteration:
                 break
 
+            self._prefetch_status(task_dispatcher)
             if not self.select_task(node, task_dispatcher.tasks):
                 continue
 
@@ -213,6 +281,9 @@ class Runner(object):
 
     def finish(self):
         """finish running tasks"""
+        if self._prefetch is not None:
+            self._prefetch.close()
+            self._prefetch = None
         # flush update dependencies
         self.dep_manager.close()
         self.teardown()
@@ -227,6 +298,9 @@ class Runner(object):
         @ivar task_dispatcher (TaskDispatcher)
         """
         try:
+            if self.prefetch:
+                self._prefetch = StatusPrefetch(self.dep_manager,
+                                                self.prefetch)
             self.run_tasks(task_dispatcher)
         except InvalidTask, exception:
             self.reporter.runtime_error(str(exception))
@@ -235,6 +309,123 @@ class Runner(object):
         return self.final_result
 
 
+class DryRunner(Runner):
+    """Find out which tasks would be executed, without executing them
+
+    Tasks are processed in the same order as Runner. A task is selected
+    to be executed if it is not up-to-date or if a selected task would
+    modify its dependencies: a target from a selected task is one of its
+    file_dep's, a calc_dep is selected, or the task of a result_dep is
+    selected. A plain task_dep does not make a task out of date.
+    Group tasks are selected only if any of its dependencies is selected.
+    Nothing is saved (or removed) from the dependency file.
+
+    @ivar plan: (list - Task) tasks with actions that would be executed,
+                in execution order
+    @ivar uptodate: (list - Task) tasks with actions that are up-to-date
+    """
+    def __init__(self, dependency_file, reporter, always_execute=False,
+                 dep_manager=None, prefetch=0):
+        Runner.__init__(self, dependency_file, reporter, True,
+                        always_execute, 0, dep_manager, prefetch=prefetch)
+        self.plan = []
+        self.uptodate = []
+        self._selected = set() # name of all tasks selected (include groups)
+        self._selected_targets = set() # targets from selected tasks
+
+
+    def _handle_task_error(self, node, catched_excp):
+        """report error, saved data from the task is not removed"""
+        node.run_status = "failure"
+        self.reporter.add_failure(node.task, catched_excp)
+        self.final_result = ERROR
+
+
+    def _get_status(self, task, tasks_dict):
+        """@return (str) one of up-to-date, run"""
+        if not task.actions:
+            for dep in task.task_dep:
+                if dep in self._selected:
+                    return 'run'
+            return 'up-to-date'
+        # values computed by calc_dep are unknown
+        for dep in task.calc_dep:
+            if dep in self._selected:
+                return 'run'
+        if not self._selected_targets.isdisjoint(task.file_dep):
+            return 'run'
+        for utd, _, _ in task.uptodate:
+            if isinstance(utd, result_dep) and utd.dep_name in self._selected:
+                return 'run'
+        return self.dep_manager.get_status(task, tasks_dict)
+
+
+    def select_task(self, node, tasks_dict):
+        """Returns bool, task would be executed"""
+        task = node.task
+
+        # if run_status is not None, it was already calculated
+        if node.run_status is None:
+            self.reporter.get_status(task)
+
+            # check if task should be ignored (user controlled)
+            if node.ignored_deps or self.dep_manager.status_is_ignore(task):
+                node.run_status = 'ignore'
+                self.reporter.skip_ignore(task)
+                return False
+
+            # check task_deps
+            if node.bad_deps:
+                bad_str = " ".join(n.task.name for n in node.bad_deps)
+                self._handle_task_error(node, UnmetDependency(bad_str))
+                return False
+
+            try:
+                node.run_status = self._get_status(task, tasks_dict)
+            except Exception, exception:
+                msg = "ERROR: Task '%s' checking dependencies" % task.name
+                dep_error = DependencyError(msg, exception)
+                self._handle_task_error(node, dep_error)
+                return False
+
+            if not self.always_execute:
+                if node.run_status == 'up-to-date':
+                    if task.actions:
+                        self.uptodate.append(task)
+                    self.reporter.skip_uptodate(task)
+                    task.values = self.dep_manager.get_values(task.name)
+                    return False
+
+            if task.setup_tasks:
+                # dont execute now, execute setup first...
+                return False
+        return True
+
+
+    def execute_task(self, task):
+        """just add task to plan"""
+        self._selected.add(task.name)
+        self._selected_targets.update(task.targets)
+        if task.actions:
+            self.plan.append(task)
+
+
+    def process_task_result(self, node, catched_excp):
+        """the task is considered to be successfully executed"""
+        node.run_status = "successful"
+
+
+    def finish(self):
+        """finish, dependency file is not modified"""
+        if self._prefetch is not None:
+            self._prefetch.close()
+            self._prefetch = None
+        self.dep_manager.close(save=False)
+        self.reporter.complete_run()
+        return self.final_result
+
+
+
 class Hold(object):
     """Sentinel class: No task ready to be executed"""
     pass
@@ -244,30 +435,115 @@ class Hold(object):
 class MReporter(object):
     """send reported messages to master process
 
-    puts a dictionary {'name': <task-name>,
-                       'reporter': <reporter-method-name>}
-    on runner's 'result_q'
+    messages are dictionaries {'name': <task-name>,
+                               'reporter': <reporter-method-name>}
+    They are buffered and put on runner's 'result_q' in batches (a list of
+    messages) together with the next task result (see `send`).
+    Messages are never kept on the buffer for more than FLUSH_TIME seconds,
+    a background thread sends them. So the master reports the start of
+    long running tasks while they are executed.
+
+    @cvar FLUSH_TIME: (float) seconds before buffered messages are sent
     """
+    FLUSH_TIME = 0.05
+
     def __init__(self, runner, original_reporter):
         self.runner = runner
         self.original_reporter = original_reporter
+        self._buffer = []
+        self._lock = threading.Lock()
+        self._pending = threading.Event() # buffer has messages
+        self._flusher = None # Thread started on first reported message
+        self._closed = False
 
     def __getattr__(self, method_name):
         """substitute any reporter method with a dispatching method"""
         if not hasattr(self.original_reporter, method_name):
             raise AttributeError(method_name)
         def rep_method(task):
-            self.runner.result_q.put({'name':task.name,
-                                      'reporter':method_name})
+            self._lock.acquire()
+            try:
+                self._buffer.append({'name':task.name,
+                                     'reporter':method_name})
+            finally:
+                self._lock.release()
+            if self._flusher is None:
+                self._flusher = threading.Thread(target=self._flush_loop)
+                self._flusher.daemon = True
+                self._flusher.start()
+            self._pending.set()
         return rep_method
 
     def complete_run(self):
         """ignore this on MReporter"""
         pass
 
+    def send(self, message):
+        """send message (task result) together with buffered messages"""
+        self._lock.acquire()
+        try:
+            self._buffer.append(message)
+        finally:
+            self._lock.release()
+        self.flush()
+
+    def flush(self):
+        """send all buffered messages"""
+        self._lock.acquire()
+        try:
+            if self._buffer:
+                self.runner.result_q.put(self._buffer)
+                self._buffer = []
+        finally:
+            self._lock.release()
+
+    def close(self):
+        """send buffered messages and stop background thread"""
+        self.flush()
+        self._closed = True
+        self._pending.set()
+
+    def _flush_loop(self):
+        """background thread, flush messages FLUSH_TIME after buffered"""
+        while True:
+            self._pending.wait()
+            if self._closed:
+                return
+            self._pending.clear()
+            time.sleep(self.FLUSH_TIME)
+            self.flush()
+
 
 class MRunner(Runner):
-    """MultiProcessing Runner """
+    """MultiProcessing Runner
+
+    Each sub-process (worker) has its own task queue. The master process
+    keeps up to QUEUE_DEPTH tasks on each queue, so workers do not wait
+    for the master to get its next task. A worker whose queue is empty
+    takes (steals) tasks from the queue of other workers.
+
+    Tasks might declare the amount of resources they use (L{Task.resources}).
+    A task is dispatched only if the sum of resources used by tasks being
+    executed does not exceed the capacity given by `resources`.
+    Tasks that do not fit wait (without blocking other tasks) until
+    running tasks finish and release their resources.
+    Tasks using resources are sent only to idle workers, so tasks waiting
+    on a queue never hold resources.
+
+    When execution must stop (a task failed and not `continue_`) tasks
+    waiting on queues are not executed. `stop_event` is set by the master,
+    or by the worker itself when its task fails, and workers check it
+    before executing a task. Tasks not executed are sent back as 'cancelled'.
+
+    @cvar QUEUE_DEPTH: (int) max number of tasks sent to a worker and
+                       not finished yet (including the one being executed)
+    @cvar STEAL_WAIT: (float) seconds an idle worker waits for a task on its
+                      own queue before trying to steal from other workers
+    """
+    queue_cls = staticmethod(Queue)
+    event_cls = staticmethod(Event)
+    QUEUE_DEPTH = 2
+    STEAL_WAIT = 0.05
 
     @staticmethod
     def available():
@@ -284,15 +560,30 @@ class MRunner(Runner):
             return True
 
     def __init__(self, dependency_file, reporter, continue_=False,
-                 always_execute=False, verbosity=0, num_process=1):
+                 always_execute=False, verbosity=0, num_process=1,
+                 dep_manager=None, checkpoint=0, checkpoint_time=0,
+                 prefetch=0, early_cutoff=False, resources=None):
+        """
+        @param resources: (dict) capacity of each resource (by name).
+                          resources not listed here are unlimited.
+        """
         Runner.__init__(self, dependency_file, reporter, continue_,
-                        always_execute, verbosity)
+                        always_execute, verbosity, dep_manager,
+                        checkpoint, checkpoint_time, prefetch, early_cutoff)
         self.num_process = num_process
+        self.resources = resources or {}
 
-        self.free_proc = 0   # number of free process
         self.task_dispatcher = None # TaskDispatcher retrieve tasks
         self.tasks = None    # dict of task instances by name
         self.result_q = None
+        self.stop_event = None # set when tasks on queues must not be executed
+        # number of tasks sent to each worker queue and not finished
+        self.pending = None
+        self.dispatch_done = False # TaskDispatcher has no more tasks
+        self.resources_used = None # amount of each resource in use
+        # tasks ready to be executed not sent to workers yet
+        # (waiting for resources or an idle worker)
+        self.ready_nodes = None
 
     def get_next_task(self, completed):
         """get next task to be dispatched to sub-process
@@ -310,13 +601,12 @@ class MRunner(Runner):
             try:
                 node = self.task_dispatcher.generator.send(node)
                 if not isinstance(node, ExecNode):
-                    self.free_proc += 1
                     return Hold()
             # no more tasks from controller...
             except StopIteration:
-                # ... terminate one sub process if no other task waiting
                 return None
 
+            self._prefetch_status(self.task_dispatcher)
             if self.select_task(node, self.tasks):
                 return node
 
@@ -325,114 +615,326 @@ class MRunner(Runner):
         """initialization for run_tasks"""
         self.task_dispatcher = task_dispatcher
         self.tasks = task_dispatcher.tasks
+        self.pending = [0] * self.num_process
+        self.dispatch_done = False
+        self.resources_used = dict((name, 0) for name in self.resources)
+        self.ready_nodes = []
+
+
+    def _dispatch_tasks(self, task_qs, completed):
+        """send ready tasks to workers with less pending tasks
+        (or cancel tasks on queues if execution must stop)
+
+        @param task_qs: (list - Queue) task queue of each worker
+        @param completed: (ExecNode) last task finished or None
+        """
+        capacity = len(task_qs) * self.QUEUE_DEPTH
+        pending = self.pending
+        hold = False # TaskDispatcher has no task ready
+        while sum(pending) < capacity:
+            next_node = None
+            # completed task must be sent to TaskDispatcher first
+            if completed is None or self.dispatch_done:
+                next_node = self._get_ready_node()
+            if next_node is None:
+                if self.dispatch_done or hold:
+                    break
+                node = self.get_next_task(completed)
+                completed = None
+                if node is None:
+                    self.dispatch_done = True
+                elif isinstance(node, Hold):
+                    hold = True
+                else:
+                    self.ready_nodes.append(node)
+                continue
+            index = self._select_queue(next_node.task)
+            task_qs[index].put(self._task_message(next_node.task))
+            pending[index] += 1
+        if self._stop_running:
+            self.stop_event.set()
+            self._cancel_tasks(task_qs)
+
+
+    def _select_queue(self, task):
+        """@return (int) index of worker queue that task should be sent to"""
+        pending = self.pending
+        # resources are taken only by tasks that start right away
+        if self._limited_resources(task):
+            return pending.index(0)
+        # leave idle workers for tasks with resources waiting for them
+        for node in self.ready_nodes:
+            limited = self._limited_resources(node.task)
+            if limited and self._resources_fit(limited):
+                busy = [i for i, num in enumerate(pending)
+                        if 0 < num < self.QUEUE_DEPTH]
+                if busy:
+                    return min(busy, key=pending.__getitem__)
+                break
+        return pending.index(min(pending))
+
+    def _limited_resources(self, task):
+        """@return (list - tuple) (name, amount) of resources used by task
+        that have a limited capacity
+        """
+        if not task.resources:
+            return []
+        return [(name, amount) for name, amount in task.resources.iteritems()
+                if name in self.resources_used]
+
+    def _resources_fit(self, limited):
+        """check if resources are available
+
+        A task that uses more than the capacity of a resource is executed
+        when no other task is using this resource.
+        @param limited: (list - tuple) see _limited_resources
+        """
+        used = self.resources_used
+        for name, amount in limited:
+            if used[name] and used[name] + amount > self.resources[name]:
+                return False
+        return True
+
+    def _acquire_resources(self, task):
+        """take resources used by task if it can be executed now
+
+        Resources are taken only if there is an idle worker, so the task
+        starts right away (instead of holding resources while waiting on
+        a queue for other tasks to finish).
+        @return (bool) True if task can be sent to a worker
+        """
+        limited = self._limited_resources(task)
+        if not limited:
+            return True
+        if 0 not in self.pending or not self._resources_fit(limited):
+            return False
+        for name, amount in limited:
+            self.resources_used[name] += amount
+        return True
+
+    def _release_resources(self, task):
+        """give back resources used by a finished task"""
+        for name, amount in self._limited_resources(task):
+            self.resources_used[name] -= amount
+
+    def _get_ready_node(self):
+        """@return (ExecNode) first ready task that can be sent to a worker
+        now or None
+        """
+        if self._stop_running:
+            return None
+        for index, node in enumerate(self.ready_nodes):
+            if self._acquire_resources(node.task):
+                del self.ready_nodes[index]
+                return node
+        return None
+
+
+    def _cancel_tasks(self, task_qs):
+        """remove tasks not started yet from workers' queues"""
+        for index, task_q in enumerate(task_qs):
+            while True:
+                try:
+                    task_q.get_nowait()
+                except Empty:
+                    break
+                self.pending[index] -= 1
 
 
-    def _run_start_processes(self, task_q, result_q):
+    @staticmethod
+    def _task_message(task):
+        """@return (tuple) message sent to a worker to execute a task
+
+        Workers get tasks from the task table (copied when the process is
+        created), the message contains only values that might have been
+        modified by the master since then.
+        (name, options, dep_changed, file_dep) - file_dep is None
+        if task has no calc_dep (can not be modified)
+        """
+        file_dep = task.file_dep if task.calc_dep else None
+        return (task.name, task.options, task.dep_changed, file_dep)
+
+    def _task_from_message(self, message):
+        """@return (Task) from worker's task table updated with message"""
+        name, options, dep_changed, file_dep = message
+        task = self.tasks[name]
+        task.options = options
+        task.dep_changed = dep_changed
+        if file_dep is not None:
+            task.file_dep = file_dep
+        return task
+
+
+    def _run_start_processes(self, task_qs, result_q):
         """create and start sub-processes
-        @param task_q: (multiprocessing.Queue) tasks to be executed
+
+        First tasks are dispatched before processes are created, so
+        no more processes than tasks are created.
+        @param task_qs: (list - multiprocessing.Queue) tasks to be executed
+                        by each process. unused queues are removed.
         @param result_q: (multiprocessing.Queue) collect task results
         @return list of Process
         """
-        proc_list = []
-        for _ in xrange(self.num_process):
-            next_node = self.get_next_task(None)
-            if next_node is None:
-                break # do not start more processes than tasks
-            if isinstance(next_node, ExecNode):
-                task_q.put(next_node.task)
-            else:
-                task_q.put(next_node)
-            process = Process(target=self.execute_task_subprocess,
-                              args=(task_q, result_q))
-            process.start()
-            proc_list.append(process)
-        return proc_list
+        self.result_q = result_q
+        self._dispatch_tasks(task_qs, None)
+        if self.dispatch_done and not self.ready_nodes:
+            # queues are filled in order
+            used = len([num for num in self.pending if num])
+            del task_qs[used:]
+            del self.pending[used:]
+        return [self._start_worker(index, task_qs, result_q)
+                for index in xrange(len(task_qs))]
+
+    def _start_worker(self, index, task_qs, result_q):
+        """@return (Process) started process executing tasks"""
+        process = Process(target=self.execute_task_subprocess,
+                          args=(index, task_qs, result_q))
+        process.start()
+        return process
 
 
     def run_tasks(self, task_dispatcher):
         """controls subprocesses task dispatching and result collection
         """
         # result queue - result collected from sub-processes
-        result_q = Queue()
-        # task queue - tasks ready to be dispatched to sub-processes
-        task_q = Queue()
+        result_q = self.queue_cls()
+        # task queues - tasks ready to be executed by each sub-process
+        task_qs = [self.queue_cls() for _ in xrange(self.num_process)]
+        self.stop_event = self.event_cls()
         self._run_tasks_init(task_dispatcher)
-        proc_list = self._run_start_processes(task_q, result_q)
+        proc_list = self._run_start_processes(task_qs, result_q)
 
-        # wait for all processes terminate
-        proc_count = len(proc_list)
-        while proc_count:
-            # wait until there is a result to be consumed
-            result = result_q.get()
+        # wait for all tasks to be executed
+        while sum(self.pending):
+            # wait until there is a batch of results to be consumed
+            for result in result_q.get():
+                self._process_result(result, task_qs)
 
-            node = task_dispatcher.nodes[result['name']]
-            task = node.task
-            if 'reporter' in result:
-                getattr(self.reporter, result['reporter'])(task)
-                continue
-            elif 'failure' in result:
-                catched_excp = result['failure']
-            elif 'exit' in result:
-                raise result['exit'](result['exception'])
-            else:
-                # success set values taken from subprocess result
-                catched_excp = None
-                task.result = result['result']
-                task.values = result['values']
-                for action, output in zip(task.actions, result['out']):
-                    action.out = output
-                for action, output in zip(task.actions, result['err']):
-                    action.err = output
-
-            # completed one task, dispatch next one
-            self.process_task_result(node, catched_excp)
-
-            # update num free process
-            free_proc = self.free_proc + 1
-            self.free_proc = 0
-            # tries to get as many tasks as free process
-            completed = node
-            for _ in range(free_proc):
-                next_node = self.get_next_task(completed)
-                completed = None
-                if next_node is None:
-                    proc_count -= 1
-                if isinstance(next_node, ExecNode):
-                    task_q.put(next_node.task)
-                else:
-                    task_q.put(next_node)
-
-            # check for cyclic dependencies
-            assert len(proc_list) > self.free_proc
-
-        # we are done, join all process
+        # terminate and join all process
+        for task_q in task_qs:
+            task_q.put(None)
         for proc in proc_list:
             proc.join()
 
         # get teardown results
         while not result_q.empty(): # safe because subprocess joined
-            result = result_q.get()
-            assert 'reporter' in result
-            task = task_dispatcher.tasks[result['name']]
+            for result in result_q.get():
+                assert 'reporter' in result
+                task = task_dispatcher.tasks[result['name']]
+                getattr(self.reporter, result['reporter'])(task)
+
+
+    def _process_result(self, result, task_qs):
+        """process a message sent by a worker"""
+        # worker failed (not a task failure), name might be None
+        if 'exit' in result:
+            raise result['exit'](result['exception'])
+        node = self.task_dispatcher.nodes[result['name']]
+        task = node.task
+        if 'reporter' in result:
             getattr(self.reporter, result['reporter'])(task)
+            return
+        elif 'cancelled' in result:
+            # not executed, execution is being stopped
+            self.pending[result['queue']] -= 1
+            self._release_resources(task)
+            return
+        elif 'failure' in result:
+            catched_excp = result['failure']
+        else:
+            # success set values taken from subprocess result
+            catched_excp = None
+            task.result = result['result']
+            task.values = result['values']
+            task.duration = result['duration']
+            for action, output in zip(task.actions, result['out']):
+                action.out = output
+            for action, output in zip(task.actions, result['err']):
+                action.err = output
+        self.pending[result['queue']] -= 1
+        self._release_resources(task)
+
+        # completed one task, dispatch next ones
+        self.process_task_result(node, catched_excp)
+        self._dispatch_tasks(task_qs, node)
+
+
+    def _get_task(self, index, task_qs):
+        """get next task for worker from its own queue or steal one
+
+        @param index: (int) index of worker's own queue on task_qs
+        @return (tuple) task (or None to terminate), index of queue
+        """
+        own_q = task_qs[index]
+        while True:
+            try:
+                return own_q.get(True, self.STEAL_WAIT), index
+            except Empty:
+                pass
+            # nothing on own queue for a while, steal from other queues
+            for offset in xrange(1, len(task_qs)):
+                other = (index + offset) % len(task_qs)
+                try:
+                    recv_task = task_qs[other].get_nowait()
+                except Empty:
+                    continue
+                if recv_task is None:
+                    # termination is sent to all workers, not ours
+                    task_qs[other].put(None)
+                    continue
+                return recv_task, other
 
 
-    def execute_task_subprocess(self, task_q, result_q):
+    def _cancelled(self, task, queue_index):
+        """check if task must not be executed because execution is stopping
+
+        @return (dict) message sent to master if task is cancelled or None
+        """
+        if self.stop_event.is_set():
+            return {'name': task.name, 'cancelled': True, 'queue': queue_index}
+
+    def _check_stop(self, result):
+        """stop execution of tasks on queues if task failed"""
+        if 'failure' in result and not self.continue_:
+            self.stop_event.set()
+
+    @staticmethod
+    def _execution_result(task, t_result):
+        """@return (dict) message with result of task execution
+        @param t_result: value returned by Task.execute
+        """
+        result = {'name': task.name}
+        if t_result is None:
+            result['result'] = task.result
+            result['values'] = task.values
+            result['duration'] = task.duration
+            result['out'] = [a.out for a in task.actions]
+            result['err'] = [a.err for a in task.actions]
+        else:
+            result['failure'] = t_result
+        return result
+
+
+    def execute_task_subprocess(self, index, task_qs, result_q):
         """executed on child processes
-        @param task_q: task queue,
+        @param index: (int) index of process' own queue on task_qs
+        @param task_qs: task queue of every process,
             TODO: improve this creating an common interface for stuff
                   that can be put in this queue
             * None elements indicate process can terminate
             * Hold indicate process should wait for next task
-            * Task task to be executed
+            * tuple task to be executed (see _task_message)
         """
         self.result_q = result_q
         self.reporter = MReporter(self, self.reporter)
+        self._prefetch = None # prefetch threads run on master process only
         try:
             while True:
-                recv_task = task_q.get()
+                task = None
+                recv_task, queue_index = self._get_task(index, task_qs)
                 if recv_task is None:
                     self.teardown()
+                    self.reporter.close()
                     return # no more tasks to execute finish this process
 
                 # do nothing. this used to start the subprocess even if no task
@@ -440,27 +942,119 @@ class MRunner(Runner):
                 if isinstance(recv_task, Hold):
                     continue
 
-                # recv_task is an incomplete obj. when pickled, attrbiutes
-                # that might contain unpickleble data were removed.
-                # so we need to get task from this process and update it
-                # to get dynamic task attributes.
-                task = self.tasks[recv_task.name]
-                task.update_from_pickle(recv_task)
+                task = self._task_from_message(recv_task)
+                cancelled = self._cancelled(task, queue_index)
+                if cancelled:
+                    self.reporter.send(cancelled)
+                    continue
 
-                result = {'name': task.name}
                 t_result = self.execute_task(task)
-
-                if t_result is None:
-                    result['result'] = task.result
-                    result['values'] = task.values
-                    result['out'] = [a.out for a in task.actions]
-                    result['err'] = [a.err for a in task.actions]
-                else:
-                    result['failure'] = t_result
-                result_q.put(result)
+                result = self._execution_result(task, t_result)
+                result['queue'] = queue_index
+                self._check_stop(result)
+                self.reporter.send(result)
         except (SystemExit, KeyboardInterrupt, Exception), exception:
             # error, blow-up everything. send exception info to master process
-            result_q.put({'name': task.name,
-                          'exit': exception.__class__,
-                          'exception': str(exception)})
+            self.reporter.send({'name': task.name if task else None,
+                                'exit': exception.__class__,
+                                'exception': str(exception)})
+
+
+
+class MThreadRunner(MRunner):
+    """Parallel runner using threads
+
+    Actions are executed on a pool of threads, tasks are shared with the
+    main thread (they are not pickled). Good for tasks that spend most
+    of its time waiting for I/O or sub-processes (cmd-actions).
+
+    As on MRunner the reporter and the DB are used only by the main thread.
+    Teardown actions are executed by the main thread when all tasks finish.
 
+    python-actions replace sys.stdout/sys.stderr (shared by all threads)
+    while executed, so tasks with python-actions are executed one at a time.
+    Workers get the real streams taken when the runner is created.
+    """
+    queue_cls = ThreadQueue
+    event_cls = staticmethod(threading.Event)
+    # tasks are not sent through pipes, so no need to keep tasks waiting
+    # on worker queues (and steal them)
+    QUEUE_DEPTH = 1
+
+    def __init__(self, *args, **kwargs):
+        MRunner.__init__(self, *args, **kwargs)
+        self._std_streams = (sys.stdout, sys.stderr)
+        self._python_lock = threading.Lock()
+
+    @staticmethod
+    def available():
+        """threads are always available"""
+        return True
+
+    def _get_task(self, index, task_qs):
+        """get next task from worker's own queue"""
+        return task_qs[index].get(), index
+
+    @staticmethod
+    def _task_message(task):
+        """tasks are shared by all threads, send task itself"""
+        return task
+
+    def _start_worker(self, index, task_qs, result_q):
+        """@return (Thread) started thread executing tasks"""
+        thread = threading.Thread(target=self.execute_task_thread,
+                                  args=(index, task_qs, result_q))
+        thread.daemon = True
+        thread.start()
+        return thread
+
+
+    def _execute_in_thread(self, task):
+        """execute task actions on current thread
+        @return failure: see Task.execute
+        """
+        out, err = self._std_streams
+        for action in task.actions:
+            if isinstance(action, PythonAction):
+                break
+        else:
+            return task.execute(out, err, self.verbosity)
+        self._python_lock.acquire()
+        try:
+            return task.execute(out, err, self.verbosity)
+        finally:
+            self._python_lock.release()
+
+
+    def execute_task_thread(self, index, task_qs, result_q):
+        """executed on threads, same protocol as execute_task_subprocess"""
+        reporter = MReporter(self, self.reporter)
+        task = None
+        try:
+            while True:
+                task, queue_index = self._get_task(index, task_qs)
+                if task is None:
+                    reporter.close()
+                    return # no more tasks to execute finish this thread
+                if isinstance(task, Hold):
+                    continue
+                cancelled = self._cancelled(task, queue_index)
+                if cancelled:
+                    reporter.send(cancelled)
+                    continue
+
+                if task.teardown:
+                    self.teardown_list.append(task)
+                reporter.execute_task(task)
+                t_result = self._execute_in_thread(task)
+                # other threads execute tasks at the same time
+                self._drop_cpu_time(task)
+                result = self._execution_result(task, t_result)
+                result['queue'] = queue_index
+                self._check_stop(result)
+                reporter.send(result)
+        except (SystemExit, KeyboardInterrupt, Exception), exception:
+            # error, blow-up everything. send exception info to main thread
+            reporter.send({'name': task.name if task else None,
+                           'exit': exception.__class__,
+                           'exception': str(exception)})
@@ -3,6 +3,7 @@
 
 import types
 import os
+import time
 import copy
 
 from .cmdparse import CmdOption, TaskParse
@@ -10,6 +11,14 @@ from .exceptions import CatchedException, InvalidTask
 from .action import create_action
 
 
+def cpu_time():
+    """@return (float) CPU time (seconds) used by this process and its
+    terminated child processes (cmd-actions)
+    """
+    times = os.times()
+    return times[0] + times[1] + times[2] + times[3]
+
+
 class Task(object):
     """Task
 
@@ -32,17 +41,42 @@ class Task(object):
     @ivar setup_tasks (list - string): references to task-names
     @ivar is_subtask: (bool) indicate this task is a subtask
     @ivar has_subtask: (bool) indicate this task has subtasks
+    @ivar subtask_iter: (iterator - Task) sub-tasks from a lazy task
+                        generator not created yet, None if not lazy
     @ivar result: (str) last action "result". used to check task-result-dep
     @ivar values: (dict) values saved by task that might be used by other tasks
+    @ivar duration: (tuple - float) wall and CPU time (seconds) taken by
+                    last execution of actions, None if not executed.
+                    CPU time is None if other threads were running on the
+                    same process (it can not be measured per task)
     @ivar getargs: (dict) values from other tasks
     @ivar doc: (string) task documentation
 
     @ivar options: (dict) calculated params values (from getargs and taskopt)
-    @ivar taskopt: (cmdparse.CmdParse)
+    @ivar taskcmd: (cmdparse.TaskParse) created on demand
     @ivar custom_title: function reference that takes a task object as
                         parameter and returns a string.
+    @ivar resources: (dict) amount of each resource (by name) used while
+                     executing the task, None if not specified.
+                     Used by parallel runners (see L{runner.MRunner}).
     """
 
+    # large projects might define hundreds of thousands of tasks.
+    # __dict__ is only created if other attributes are set on the instance.
+    __slots__ = ('__dict__', 'name', '_params', '_taskcmd', 'options',
+                 'setup_tasks', '_action_instances', '_actions',
+                 'dep_changed', 'file_dep', 'task_dep', 'wild_dep', 'calc_dep',
+                 'value_savers', 'uptodate', 'getargs', 'targets',
+                 'is_subtask', 'has_subtask', 'subtask_iter',
+                 'result', 'values', 'duration',
+                 'verbosity', 'custom_title', 'resources', '_remove_targets',
+                 'clean_actions', 'teardown', 'doc')
+
+    # attributes that might contain unpickleble content (see __getstate__)
+    _not_pickled = ('_actions', '_action_instances', 'clean_actions',
+                    'teardown', 'custom_title', 'value_savers', 'uptodate',
+                    'subtask_iter')
+
     DEFAULT_VERBOSITY = 1
 
     # list of valid types/values for each task attribute.
@@ -62,6 +96,7 @@ class Task(object):
                   'verbosity': ((), (None,0,1,2,)),
                   'getargs': ((dict,), ()),
                   'title': ((types.FunctionType,), (None,)),
+                  'resources': ((dict,), (None,)),
                   }
 
 
@@ -69,7 +104,8 @@ class Task(object):
                  task_dep=(), uptodate=(),
                  calc_dep=(), setup=(), clean=(), teardown=(),
                  is_subtask=False, has_subtask=False,
-                 doc=None, params=(), verbosity=None, title=None, getargs=None):
+                 doc=None, params=(), verbosity=None, title=None, getargs=None,
+                 resources=None):
         """sanity checks and initialization
 
         @param params: (list of dict for parameters) see cmdparse.CmdOption
@@ -92,16 +128,25 @@ class Task(object):
                         self.valid_attr['verbosity'])
         self.check_attr(name, 'getargs', getargs, self.valid_attr['getargs'])
         self.check_attr(name, 'title', title, self.valid_attr['title'])
+        self.check_attr(name, 'resources', resources,
+                        self.valid_attr['resources'])
+        for amount in (resources or {}).itervalues():
+            if (isinstance(amount, bool) or
+                not isinstance(amount, (int, long)) or amount < 0):
+                msg = ("Task '%s' attribute 'resources' amounts must be " +
+                       "non-negative integers. got:%r")
+                raise InvalidTask(msg % (name, resources))
 
         self.name = name
-        self.taskcmd = TaskParse([CmdOption(opt) for opt in params])
+        self._params = params
+        self._taskcmd = None # created on demand, see taskcmd
         self.options = None
         self.setup_tasks = list(setup)
 
         # actions
         self._action_instances = None
         if actions is None:
-            self._actions = []
+            self._actions = ()
         else:
             self._actions = list(actions[:])
 
@@ -116,22 +161,34 @@ class Task(object):
         self.targets = targets
         self.is_subtask = is_subtask
         self.has_subtask = has_subtask
+        self.subtask_iter = None
         self.result = None
         self.values = {}
+        self.duration = None
         self.verbosity = verbosity
         self.custom_title = title
+        self.resources = resources
 
-        # clean
+        # clean (empty tuples are shared by all tasks)
         if clean is True:
             self._remove_targets = True
             self.clean_actions = ()
         else:
             self._remove_targets = False
-            self.clean_actions = [create_action(a, self) for a in clean]
+            self.clean_actions = ([create_action(a, self) for a in clean]
+                                  if clean else ())
 
-        self.teardown = [create_action(a, self) for a in teardown]
+        self.teardown = ([create_action(a, self) for a in teardown]
+                         if teardown else ())
         self.doc = self._init_doc(doc)
 
+    @property
+    def taskcmd(self):
+        """(cmdparse.TaskParse) lazy creation of parser for task params"""
+        if self._taskcmd is None:
+            self._taskcmd = TaskParse([CmdOption(opt) for opt in self._params])
+        return self._taskcmd
+
 
     def _init_deps(self, file_dep, task_dep, calc_dep):
         """init for dependency related attributes"""
@@ -316,12 +373,17 @@ class Task(object):
         @return failure: see CmdAction.execute
         """
         task_stdout, task_stderr = self._get_out_err(out, err, verbosity)
-        for action in self.actions:
-            action_return = action.execute(task_stdout, task_stderr)
-            if isinstance(action_return, CatchedException):
-                return action_return
-            self.result = action.result
-            self.values.update(action.values)
+        start_wall, start_cpu = time.time(), cpu_time()
+        try:
+            for action in self.actions:
+                action_return = action.execute(task_stdout, task_stderr)
+                if isinstance(action_return, CatchedException):
+                    return action_return
+                self.result = action.result
+                self.values.update(action.values)
+        finally:
+            self.duration = (time.time() - start_wall,
+                             cpu_time() - start_cpu)
 
 
     def execute_teardown(self, out=None, err=None, verbosity=None):
@@ -395,22 +457,18 @@ class Task(object):
         mostly probably closures
         """
         to_pickle = self.__dict__.copy()
-        del to_pickle['_actions']
-        del to_pickle['_action_instances']
-        del to_pickle['clean_actions']
-        del to_pickle['teardown']
-        del to_pickle['custom_title']
-        del to_pickle['value_savers']
-        del to_pickle['uptodate']
+        for attr in self.__slots__[1:]:
+            if attr not in self._not_pickled and hasattr(self, attr):
+                to_pickle[attr] = getattr(self, attr)
         return to_pickle
 
+    def __setstate__(self, state):
+        for attr, value in state.iteritems():
+            setattr(self, attr, value)
+
     def __eq__(self, other):
         return self.name == other.name
 
-    def update_from_pickle(self, pickle_obj):
-        """update self with data from pickled Task"""
-        self.__dict__.update(pickle_obj.__dict__)
-
     def clone(self):
         """create a deep copy of this task"""
         inst =  self.__class__.__new__(self.__class__)
@@ -420,13 +478,17 @@ class Task(object):
         inst.value_savers = self.value_savers[:]
         inst.is_subtask = self.is_subtask
         inst.has_subtask = self.has_subtask
+        inst.subtask_iter = self.subtask_iter
         inst.result = self.result
         inst.values = self.values.copy()
+        inst.duration = self.duration
         inst.verbosity = self.verbosity
         inst.custom_title = self.custom_title
+        inst.resources = self.resources
         inst.getargs = copy.copy(self.getargs)
         inst.setup_tasks = self.setup_tasks[:]
-        inst.taskcmd = self.taskcmd
+        inst._params = self._params
+        inst._taskcmd = self._taskcmd
         inst.options = copy.copy(self.options)
         inst._actions = self._actions[:]
         inst._action_instances = [a.clone(inst) for a in self.actions]
@@ -39,6 +39,7 @@ def remove_db(filename):
                   '.dir', #dumbdb #dbm2
                   '.db', #dbm1
                   '.pag', #dbm2
+                  '.journal', #json-journal
                   ]
     for ext in extensions:
         if os.path.exists(filename + ext):
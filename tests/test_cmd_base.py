@@ -1,5 +1,9 @@
+import os
+
 import pytest
 
+from doit.exceptions import InvalidCommand
+from doit.dependency import SqliteDependency
 from doit.cmdparse import CmdParseError, CmdOption
 from doit.cmd_base import Command, DoitCmdBase
 from doit.cmd_base import ModuleTaskLoader, DodoTaskLoader
@@ -86,6 +90,15 @@ class TestModuleTaskLoader(object):
         task_list, config = loader.load_tasks(cmd, {}, [])
         assert ['xxx1'] == [t.name for t in task_list]
         assert {'verbose': 2} == config
+        assert None == loader.source_file
+
+    def test_source_file(self, cwd):
+        cmd = Command()
+        members = {'task_xxx1': lambda : {'actions':[]},
+                   '__file__': 'dodo.py'}
+        loader = ModuleTaskLoader(members)
+        loader.load_tasks(cmd, {}, [])
+        assert 'dodo.py' == loader.source_file
 
 
 class TestDodoTaskLoader(object):
@@ -99,6 +112,8 @@ class TestDodoTaskLoader(object):
         task_list, config = loader.load_tasks(cmd, params, [])
         assert ['xxx1', 'yyy2'] == [t.name for t in task_list]
         assert {'verbose': 2} == config
+        assert os.path.join(os.getcwd(), 'loader_sample.py') == \
+            os.path.splitext(loader.source_file)[0] + '.py'
 
 
 
@@ -126,3 +141,32 @@ class TestDoitCmdBase(object):
         mycmd = MyCmd(DodoTaskLoader())
         assert 'min' == mycmd.parse_execute(['--mine', 'min'])
 
+
+    def test_get_dep_manager(self, depfile):
+        class MyCmd(DoitCmdBase):
+            pass
+        mycmd = MyCmd(dep_file=depfile.name, checksum='crc32')
+        dep_manager = mycmd.get_dep_manager()
+        assert 'crc32' == dep_manager.checksum
+        dep_manager.close()
+
+    def test_get_dep_manager_backend(self, depfile):
+        class MyCmd(DoitCmdBase):
+            pass
+        mycmd = MyCmd(dep_file=depfile.name + '.x', backend='sqlite3')
+        dep_manager = mycmd.get_dep_manager()
+        assert isinstance(dep_manager, SqliteDependency)
+        dep_manager.close()
+        os.remove(depfile.name + '.x')
+
+    def test_get_dep_manager_invalid_backend(self, depfile):
+        class MyCmd(DoitCmdBase):
+            pass
+        mycmd = MyCmd(dep_file=depfile.name, backend='i_dont_exist')
+        pytest.raises(InvalidCommand, mycmd.get_dep_manager)
+
+    def test_get_dep_manager_invalid_checksum(self, depfile):
+        class MyCmd(DoitCmdBase):
+            pass
+        mycmd = MyCmd(dep_file=depfile.name, checksum='i_dont_exist')
+        pytest.raises(InvalidCommand, mycmd.get_dep_manager)
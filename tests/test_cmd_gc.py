@@ -0,0 +1,27 @@
+from StringIO import StringIO
+
+from doit.dependency import Dependency
+from doit.task import Task
+from doit.cmd_gc import GarbageCollect
+
+
+class TestCmdGarbageCollect(object):
+
+    def test_remove_not_defined(self, depfile):
+        dep = Dependency(depfile.name)
+        for name in ("t1", "t2", "old", "g1.old"):
+            dep._set(name, "dep", "1")
+        dep.close()
+
+        output = StringIO()
+        tasks = [Task("t1", [""]), Task("t2", [""])]
+        cmd_gc = GarbageCollect(outstream=output, dep_file=depfile.name,
+                                task_list=tasks)
+        cmd_gc._execute()
+        got = output.getvalue().split("\n")[:-1]
+        assert ["removing g1.old", "removing old"] == got
+        dep = Dependency(depfile.name)
+        assert "1" == dep._get("t1", "dep")
+        assert "1" == dep._get("t2", "dep")
+        assert None == dep._get("old", "dep")
+        assert None == dep._get("g1.old", "dep")
@@ -0,0 +1,43 @@
+from StringIO import StringIO
+
+from doit.dependency import Dependency
+from doit.task import Task
+from doit.cmd_plan import Plan
+
+
+class TestCmdPlan(object):
+
+    def get_tasks(self, dependency1):
+        tasks = [Task("t1", [""], file_dep=[dependency1]),
+                 Task("t2", [""], file_dep=[dependency1], task_dep=["t3"]),
+                 Task("t3", [""]),
+                 Task("g1", None, task_dep=["t1"]),
+                 ]
+        return tasks
+
+    def test_plan(self, dependency1, depfile):
+        dep = Dependency(depfile.name)
+        for task in self.get_tasks(dependency1):
+            dep.save_success(task)
+        dep.close()
+
+        output = StringIO()
+        cmd_plan = Plan(outstream=output, dep_file=depfile.name,
+                        task_list=self.get_tasks(dependency1))
+        assert 0 == cmd_plan._execute()
+        got = output.getvalue().split("\n")[:-1]
+        # t2 is up-to-date, t3 is just executed before it
+        assert ["t3"] == got[:-1]
+        assert got[-1].startswith("# 1 tasks to execute, 2 up-to-date")
+
+    def test_selected(self, dependency1, depfile):
+        output = StringIO()
+        cmd_plan = Plan(outstream=output, dep_file=depfile.name,
+                        task_list=self.get_tasks(dependency1),
+                        sel_tasks=["g1"])
+        assert 0 == cmd_plan._execute(prefetch=2)
+        got = output.getvalue().split("\n")[:-1]
+        assert ["t1"] == got[:-1]
+        # nothing saved
+        dep = Dependency(depfile.name)
+        assert not dep._in("t1")
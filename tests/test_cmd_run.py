@@ -7,10 +7,33 @@ from mock import Mock
 from doit.exceptions import InvalidCommand
 from doit.task import Task
 from doit import reporter, runner
-from doit.cmd_run import Run
+from doit.cmd_run import Run, parse_resources
+from doit.loader import generate_tasks
 from tests.conftest import tasks_sample
 
 
+class TestParseResources(object):
+    def test_str(self):
+        assert {'mem': 8, 'gpu': 1} == parse_resources('mem:8, gpu:1,')
+
+    def test_dict(self):
+        assert {'mem': 8} == parse_resources({'mem': 8})
+
+    def test_invalid(self):
+        pytest.raises(InvalidCommand, parse_resources, 'mem:x')
+        pytest.raises(InvalidCommand, parse_resources, 'mem')
+        pytest.raises(InvalidCommand, parse_resources, ':1')
+
+    def test_negative(self):
+        pytest.raises(InvalidCommand, parse_resources, 'mem:-1')
+        pytest.raises(InvalidCommand, parse_resources, {'mem': -1})
+
+    def test_dict_not_int(self):
+        pytest.raises(InvalidCommand, parse_resources, {'mem': 1.5})
+        pytest.raises(InvalidCommand, parse_resources, {'mem': '2'})
+        pytest.raises(InvalidCommand, parse_resources, ['mem'])
+
+
 class TestCmdRun(object):
 
     def testProcessRun(self, dependency1, depfile):
@@ -38,6 +61,81 @@ class TestCmdRun(object):
         got = output.getvalue().split("\n")[:-1]
         assert [".  t1", ".  t2", ".  g1.a", ".  g1.b", ".  t3"] == got
 
+    def testProcessRunThread(self, dependency1, depfile):
+        output = StringIO.StringIO()
+        cmd_run = Run(dep_file=depfile.name, task_list=tasks_sample())
+        result = cmd_run._execute(output, num_process=1, par_type='thread')
+        assert 0 == result
+        got = output.getvalue().split("\n")[:-1]
+        assert [".  t1", ".  t2", ".  g1.a", ".  g1.b", ".  t3"] == got
+
+    def testInvalidParType(self, depfile):
+        output = StringIO.StringIO()
+        cmd_run = Run(dep_file=depfile.name, task_list=tasks_sample())
+        pytest.raises(InvalidCommand, cmd_run._execute, output,
+                      num_process=1, par_type='not_exist')
+
+    def testProcessRunResources(self, dependency1, depfile):
+        output = StringIO.StringIO()
+        tasks = tasks_sample()
+        tasks[0].resources = {'mem': 3}
+        tasks[1].resources = {'mem': 3}
+        cmd_run = Run(dep_file=depfile.name, task_list=tasks)
+        result = cmd_run._execute(output, num_process=2, par_type='thread',
+                                  resources='mem:4')
+        assert 0 == result
+        got = output.getvalue().split("\n")[:-1]
+        assert set([".  t1", ".  t2", ".  g1.a", ".  g1.b", ".  t3"]) == set(got)
+
+    def testInvalidResources(self, depfile):
+        output = StringIO.StringIO()
+        cmd_run = Run(dep_file=depfile.name, task_list=tasks_sample())
+        pytest.raises(InvalidCommand, cmd_run._execute, output,
+                      num_process=1, resources='mem')
+
+    def testProcessRunPriority(self, dependency1, depfile):
+        output = StringIO.StringIO()
+        tasks = tasks_sample()
+        tasks[1].task_dep = ['t3']
+        cmd_run = Run(dep_file=depfile.name, task_list=tasks)
+        result = cmd_run._execute(output, priority=True)
+        assert 0 == result
+        got = output.getvalue().split("\n")[:-1]
+        assert [".  t3", ".  t1", ".  t2", ".  g1.a", ".  g1.b"] == got
+
+    def testProcessRunGraphCache(self, dependency1, depfile):
+        for x in range(2):
+            output = StringIO.StringIO()
+            cmd_run = Run(dep_file=depfile.name, task_list=tasks_sample())
+            cmd_run._loader.source_file = dependency1
+            result = cmd_run._execute(output, always=True, graph_cache=True)
+            assert 0 == result
+            got = output.getvalue().split("\n")[:-1]
+            assert [".  t1", ".  t2", ".  g1.a", ".  g1.b", ".  t3"] == got
+            assert os.path.exists(depfile.name + '.graph')
+        os.remove(depfile.name + '.graph')
+
+    def testProcessRunGraphCacheNoSource(self, dependency1, depfile, capsys):
+        output = StringIO.StringIO()
+        cmd_run = Run(dep_file=depfile.name, task_list=tasks_sample())
+        result = cmd_run._execute(output, always=True, graph_cache=True)
+        assert 0 == result
+        assert 'graph cache not used' in capsys.readouterr()[1]
+        assert not os.path.exists(depfile.name + '.graph')
+
+    def testProcessRunLazySubtasks(self, depfile):
+        def gen():
+            for name in ('a', 'b'):
+                yield {'name': name, 'actions': [""]}
+        for num_process in (0, 1):
+            output = StringIO.StringIO()
+            task_list = generate_tasks('g1', gen(), lazy=True)
+            cmd_run = Run(dep_file=depfile.name, task_list=task_list)
+            result = cmd_run._execute(output, num_process=num_process)
+            assert 0 == result
+            got = output.getvalue().split("\n")[:-1]
+            assert [".  g1:a", ".  g1:b"] == got
+
     def testProcessRunFilter(self, depfile):
         output = StringIO.StringIO()
         cmd_run = Run(dep_file=depfile.name, task_list=tasks_sample(),
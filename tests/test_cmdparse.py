@@ -35,6 +35,13 @@ class TestCmdOption(object):
         opt1 = CmdOption({'name':'op1', 'default':''})
         assert '' == opt1.long
 
+    def test_short_none(self):
+        opt1 = CmdOption({'name':'op1', 'default':'', 'short':None})
+        assert '' == opt1.short
+        cmd = CmdParse([opt1, CmdOption({'name':'op2', 'default':'',
+                                         'long':'op2'})])
+        assert 'x' == cmd.parse(['--op2', 'x'])[0]['op2']
+
     def test_invalid_field(self):
         opt_dict = {'name':'op1', 'default':'', 'non_existent':''}
         pytest.raises(CmdParseError, CmdOption, opt_dict)
@@ -4,6 +4,9 @@ import pytest
 from doit.exceptions import InvalidDodoFile, InvalidCommand
 from doit.task import InvalidTask, Task
 from doit.control import TaskControl, TaskDispatcher, ExecNode, no_none
+from doit.control import critical_path_weights, PriorityQueue
+from doit.control import find_cycles, find_dep_path, GraphCache
+from doit.tools import result_dep
 
 
 
@@ -60,6 +63,28 @@ class TestTaskControlInit(object):
         TaskControl(tasks)
         assert 'foo4' in tasks[0].task_dep
 
+    def test_wild_patterns(self):
+        tasks = [Task('foo:b', None), Task('bar', None), Task('foo:a', None),
+                 Task('fo', None), Task('xfoo:c', None), Task('foo', None)]
+        tc = TaskControl(tasks)
+        # definition order
+        assert ['foo:b', 'foo:a'] == tc._get_wild_tasks('foo:*')
+        assert ['foo:b', 'foo:a', 'foo'] == tc._get_wild_tasks('foo*')
+        assert ['foo:b', 'foo:a', 'xfoo:c'] == tc._get_wild_tasks('*:*')
+        assert ['foo:a'] == tc._get_wild_tasks('foo:[a]')
+        assert ['fo'] == tc._get_wild_tasks('f?')
+        assert [] == tc._get_wild_tasks('z*')
+        # result from cache is a copy
+        tc._get_wild_tasks('foo:*').append('xxx')
+        assert ['foo:b', 'foo:a'] == tc._get_wild_tasks('foo:*')
+
+    def test_implicit_dep_no_duplicates(self):
+        t1 = Task("t1", None, targets=['a', 'b'])
+        t2 = Task("t2", None, file_dep=['a', 'b'], task_dep=['t3'])
+        t3 = Task("t3", None)
+        TaskControl([t1, t2, t3])
+        assert ['t3', 't1'] == t2.task_dep
+
     def test_bug770150_task_dependency_from_target(self):
         t1 = Task("taskX", None, file_dep=[], targets=['intermediate'])
         t2 = Task("taskY", None, file_dep=['intermediate'], task_dep=['taskZ'])
@@ -68,6 +93,81 @@ class TestTaskControlInit(object):
         assert ['taskZ', 'taskX'] == t2.task_dep
 
 
+class TestGraphCache(object):
+    def tasks(self):
+        return [Task("t1", None, targets=['a']),
+                Task("t2", None, file_dep=['a'], task_dep=['t3*']),
+                Task("t3", None)]
+
+    def graph(self, tmpdir, config=None):
+        dodo = tmpdir.join('dodo.py')
+        if not dodo.check():
+            dodo.write('# tasks')
+        return GraphCache(str(tmpdir.join('graph')), str(dodo), config)
+
+    def test_save_load(self, tmpdir):
+        graph = self.graph(tmpdir)
+        tc = TaskControl(self.tasks(), graph)
+        assert ['t3', 't1'] == tc.tasks['t2'].task_dep
+        # loaded from cache. wild_dep/targets not used again
+        tasks = self.tasks()
+        assert ({'a': 't1'}, {'t1': [], 't2': ['t3', 't1'], 't3': []}) == \
+            graph.load(graph.digest(3))
+        tasks[0].targets = []
+        tc2 = TaskControl(tasks, self.graph(tmpdir))
+        assert ['t3', 't1'] == tc2.tasks['t2'].task_dep
+        assert {'a': 't1'} == tc2.targets
+
+    def test_compiled_source(self, tmpdir):
+        tmpdir.join('dodo.pyc').write('compiled')
+        graph = self.graph(tmpdir)
+        graph2 = GraphCache(str(tmpdir.join('graph')),
+                            str(tmpdir.join('dodo.pyc')))
+        assert graph.source == graph2.source
+
+    def test_changed_source(self, tmpdir):
+        TaskControl(self.tasks(), self.graph(tmpdir))
+        tmpdir.join('dodo.py').write('# modified tasks')
+        tasks = self.tasks()
+        tasks[1].wild_dep = []
+        tc = TaskControl(tasks, self.graph(tmpdir))
+        assert ['t1'] == tc.tasks['t2'].task_dep
+
+    def test_changed_config(self, tmpdir):
+        TaskControl(self.tasks(), self.graph(tmpdir))
+        tasks = self.tasks()
+        tasks[1].wild_dep = []
+        tc = TaskControl(tasks, self.graph(tmpdir, {'verbosity': 2}))
+        assert ['t1'] == tc.tasks['t2'].task_dep
+
+    def test_changed_tasks(self, tmpdir):
+        TaskControl(self.tasks(), self.graph(tmpdir))
+        tasks = self.tasks()
+        tasks.append(Task("t3b", None))
+        tc = TaskControl(tasks, self.graph(tmpdir))
+        assert ['t3', 't3b', 't1'] == tc.tasks['t2'].task_dep
+
+    def test_changed_task_names(self, tmpdir):
+        TaskControl(self.tasks(), self.graph(tmpdir))
+        tasks = self.tasks()
+        tasks[2] = Task("t3b", None)
+        tc = TaskControl(tasks, self.graph(tmpdir))
+        assert ['t3b', 't1'] == tc.tasks['t2'].task_dep
+
+    def test_invalid_not_saved(self, tmpdir):
+        graph = self.graph(tmpdir)
+        tasks = [Task('wrong', None, task_dep=["typo"])]
+        pytest.raises(InvalidTask, TaskControl, tasks, graph)
+        assert not tmpdir.join('graph').check()
+
+    def test_corrupted_file(self, tmpdir):
+        tmpdir.join('graph').write('corrupted')
+        graph = self.graph(tmpdir)
+        assert None == graph.load(graph.digest(3))
+        tc = TaskControl(self.tasks(), graph)
+        assert ['t3', 't1'] == tc.tasks['t2'].task_dep
+
+
 TASKS_SAMPLE = [Task("t1", [""], doc="t1 doc string"),
                 Task("t2", [""], doc="t2 doc string"),
                 Task("g1", None, doc="g1 doc string"),
@@ -126,39 +226,113 @@ class TestTaskControlCmdOptions(object):
         assert "hello option!" == tc.tasks['t3'].options['opt1']
 
 
+class TestTaskControlCycles(object):
+    def test_no_cycle(self):
+        tasks = [Task("t1", None, task_dep=["t2", "t3"]),
+                 Task("t2", None, task_dep=["t3"]),
+                 Task("t3", None)]
+        control = TaskControl(tasks)
+        control.process(None)
+        control.check_cycles()
+
+    def test_cycle(self):
+        tasks = [Task("t1", None, task_dep=["t2"]),
+                 Task("t2", None, task_dep=["t3"]),
+                 Task("t3", None, task_dep=["t1"])]
+        control = TaskControl(tasks)
+        control.process(['t1'])
+        excinfo = pytest.raises(InvalidDodoFile, control.task_dispatcher)
+        assert "[t1 -> t2 -> t3 -> t1]" in str(excinfo.value)
+
+    def test_cycle_not_selected(self):
+        tasks = [Task("t1", None, task_dep=["t2"]),
+                 Task("t2", None, task_dep=["t1"]),
+                 Task("t3", None)]
+        control = TaskControl(tasks)
+        control.process(['t3'])
+        control.check_cycles()
+
+    def test_all_cycles(self):
+        tasks = [Task("t1", None, task_dep=["t2", "t3"]),
+                 Task("t2", None, task_dep=["t1"]),
+                 Task("t3", None, setup=["t3"])]
+        control = TaskControl(tasks)
+        control.process(None)
+        excinfo = pytest.raises(InvalidDodoFile, control.check_cycles)
+        msg = str(excinfo.value).splitlines()
+        assert 2 == len(msg)
+        assert "[t1 -> t2 -> t1]" in msg[0]
+        assert "[t3 -> t3]" in msg[1]
+
+
+class TestFindCycles(object):
+    def test_deep_chain(self):
+        # not recursive, long chains are ok
+        num = 5000
+        tasks = {}
+        for i in range(num):
+            tasks['t%s' % i] = Task('t%s' % i, None, task_dep=['t%s' % (i+1)])
+        tasks['t%s' % num] = Task('t%s' % num, None, task_dep=['t0'])
+        cycles = find_cycles(tasks, ['t0'])
+        assert 1 == len(cycles)
+        assert num + 2 == len(cycles[0])
+
+    def test_calc_dep(self):
+        tasks = {'t1': Task('t1', None, calc_dep=['t2']),
+                 't2': Task('t2', None, task_dep=['t1'])}
+        assert [['t1', 't2', 't1']] == find_cycles(tasks, ['t1'])
+
+    def test_dep_path(self):
+        tasks = {'t1': Task('t1', None, task_dep=['t2']),
+                 't2': Task('t2', None, task_dep=['t3']),
+                 't3': Task('t3', None),
+                 }
+        assert ['t1', 't2', 't3'] == find_dep_path(tasks, 't1', 't3')
+        assert None == find_dep_path(tasks, 't3', 't1')
+
+
 class TestExecNode(object):
     def test_repr(self):
-        node = ExecNode(Task('t1', None), None)
+        node = ExecNode(Task('t1', None))
         assert 't1' in repr(node)
 
     def test_ready_select__not_waiting(self):
         task = Task("t1", None)
-        node = ExecNode(task, None)
+        node = ExecNode(task)
         assert False == node.wait_select
 
     def test_parent_status_failure(self):
-        n1 = ExecNode(Task('t1', None), None)
-        n2 = ExecNode(Task('t2', None), None)
+        n1 = ExecNode(Task('t1', None))
+        n2 = ExecNode(Task('t2', None))
         n1.run_status = 'failure'
         n2.parent_status(n1)
         assert [n1] == n2.bad_deps
-        assert [] == n2.ignored_deps
+        assert not n2.ignored_deps
 
     def test_parent_status_ignore(self):
-        n1 = ExecNode(Task('t1', None), None)
-        n2 = ExecNode(Task('t2', None), None)
+        n1 = ExecNode(Task('t1', None))
+        n2 = ExecNode(Task('t2', None))
         n1.run_status = 'ignore'
         n2.parent_status(n1)
-        assert [] == n2.bad_deps
+        assert not n2.bad_deps
         assert [n1] == n2.ignored_deps
 
+    def test_shared_empty_containers(self):
+        n1 = ExecNode(Task('t1', None))
+        n2 = ExecNode(Task('t2', None, task_dep=['t1']))
+        assert n1.wait_run is n2.wait_run
+        assert n1.calc_dep is n2.calc_dep
+        assert ['t1'] == n2.task_dep
+        n1.waiting_me = set([n2])
+        assert not n2.waiting_me
+
 
     def test_step(self):
         def my_gen():
             yield 1
             yield 2
         task = Task("t1", None)
-        node = ExecNode(task, None)
+        node = ExecNode(task)
         node.generator = my_gen()
         assert 1 == node.step()
         assert 2 == node.step()
@@ -179,7 +353,7 @@ class TestTaskDispatcher_GenNone(object):
     def test_create(self):
         tasks = {'t1': Task('t1', None)}
         td = TaskDispatcher(tasks, [], None)
-        node = td._gen_node(None, 't1')
+        node = td._gen_node('t1')
         assert isinstance(node, ExecNode)
         assert node == td.nodes['t1']
 
@@ -188,19 +362,9 @@ class TestTaskDispatcher_GenNone(object):
                  't2': Task('t2', None)
                  }
         td = TaskDispatcher(tasks, [], None)
-        n1 = td._gen_node(None, 't1')
-        td._gen_node(n1, 't2')
-        assert None == td._gen_node(None, 't1')
-
-    def test_cyclic(self):
-        tasks = {'t1': Task('t1', None),
-                 't2': Task('t2', None)
-                 }
-        td = TaskDispatcher(tasks, [], None)
-        n1 = td._gen_node(None, 't1')
-        n2 = td._gen_node(n1, 't2')
-        pytest.raises(InvalidDodoFile, td._gen_node, n2, 't1')
-
+        td._gen_node('t1')
+        td._gen_node('t2')
+        assert None == td._gen_node('t1')
 
 
 class TestTaskDispatcher_node_add_wait_run(object):
@@ -209,9 +373,9 @@ class TestTaskDispatcher_node_add_wait_run(object):
                  't2': Task('t2', None),
                  }
         td = TaskDispatcher(tasks, [], None)
-        n1 = td._gen_node(None, 't1')
-        n2 = td._gen_node(None, 't2')
-        n1.wait_run.add('xxx')
+        n1 = td._gen_node('t1')
+        n2 = td._gen_node('t2')
+        n1.wait_run = set(['xxx'])
         td._node_add_wait_run(n1, ['t2'])
         assert 2 == len(n1.wait_run)
         assert 't2' in n1.wait_run
@@ -223,8 +387,8 @@ class TestTaskDispatcher_node_add_wait_run(object):
                  't2': Task('t2', None),
                  }
         td = TaskDispatcher(tasks, [], None)
-        n1 = td._gen_node(None, 't1')
-        n2 = td._gen_node(None, 't2')
+        n1 = td._gen_node('t1')
+        n2 = td._gen_node('t2')
         n2.run_status = 'done'
         td._node_add_wait_run(n1, ['t2'])
         assert not n1.wait_run
@@ -234,8 +398,8 @@ class TestTaskDispatcher_node_add_wait_run(object):
                  't2': Task('t2', None),
                  }
         td = TaskDispatcher(tasks, [], None)
-        n1 = td._gen_node(None, 't1')
-        n2 = td._gen_node(None, 't2')
+        n1 = td._gen_node('t1')
+        n2 = td._gen_node('t2')
         n2.run_status = 'failure'
         td._node_add_wait_run(n1, ['t2'])
         assert n1.bad_deps
@@ -246,7 +410,7 @@ class TestTaskDispatcher_add_task(object):
         tasks = {'t1': Task('t1', None),
                  }
         td = TaskDispatcher(tasks, [], None)
-        n1 = td._gen_node(None, 't1')
+        n1 = td._gen_node('t1')
         assert [tasks['t1']] == list(td._add_task(n1))
 
     def test_task_deps(self):
@@ -255,7 +419,7 @@ class TestTaskDispatcher_add_task(object):
                  't3': Task('t3', None),
                  }
         td = TaskDispatcher(tasks, [], None)
-        n1 = td._gen_node(None, 't1')
+        n1 = td._gen_node('t1')
         gen = td._add_task(n1)
         n2 = next(gen)
         assert tasks['t2'] == n2.task
@@ -273,8 +437,8 @@ class TestTaskDispatcher_add_task(object):
                  't2': Task('t2', None),
                  }
         td = TaskDispatcher(tasks, [], None)
-        n1 = td._gen_node(None, 't1')
-        n2 = td._gen_node(None, 't2')
+        n1 = td._gen_node('t1')
+        n2 = td._gen_node('t2')
         assert 'wait' == n1.step()
         assert 'wait' == n1.step()
         #tasks['t2'].run_status = 'done'
@@ -286,8 +450,8 @@ class TestTaskDispatcher_add_task(object):
                  't2': Task('t2', None),
                  }
         td = TaskDispatcher(tasks, [], None)
-        n1 = td._gen_node(None, 't1')
-        n2 = td._gen_node(None, 't2')
+        n1 = td._gen_node('t1')
+        n2 = td._gen_node('t2')
         n2.run_status = 'done'
         gen = td._add_task(n1)
         assert tasks['t1'] == next(gen)
@@ -300,7 +464,7 @@ class TestTaskDispatcher_add_task(object):
                  't3': Task('t3', None, targets=['intermediate']),
                  }
         td = TaskDispatcher(tasks, {'intermediate': 't3'}, None)
-        n1 = td._gen_node(None, 't1')
+        n1 = td._gen_node('t1')
         n2 = n1.step()
         assert tasks['t2'] == n2.task
         assert 'wait' == n1.step()
@@ -325,7 +489,7 @@ class TestTaskDispatcher_add_task(object):
                  't2': Task('t2', None),
                  }
         td = TaskDispatcher(tasks, [], None)
-        n1 = td._gen_node(None, 't1')
+        n1 = td._gen_node('t1')
         gen = td._add_task(n1)
         assert tasks['t1'] == next(gen) # first time (just select)
         assert 'wait' == next(gen)      # wait for select result
@@ -348,7 +512,7 @@ class TestTaskDispatcher_get_next_node(object):
                  't2': Task('t2', None),
                  }
         td = TaskDispatcher(tasks, [], None)
-        n1 = td._gen_node(None, 't1')
+        n1 = td._gen_node('t1')
         ready = deque([n1])
         assert n1 == td._get_next_node(ready, ['t2'])
         assert 0 == len(ready)
@@ -359,7 +523,7 @@ class TestTaskDispatcher_get_next_node(object):
                  }
         td = TaskDispatcher(tasks, [], None)
         to_run = ['t2', 't1']
-        td._gen_node(None, 't1') # t1 was already created
+        td._gen_node('t1') # t1 was already created
         got = td._get_next_node([], to_run)
         assert isinstance(got, ExecNode)
         assert 't2' == got.task.name
@@ -369,7 +533,7 @@ class TestTaskDispatcher_get_next_node(object):
         tasks = {'t1': Task('t1', None),
                  }
         td = TaskDispatcher(tasks, [], None)
-        td._gen_node(None, 't1') # t1 was already created
+        td._gen_node('t1') # t1 was already created
         to_run = ['t1']
         assert None == td._get_next_node([], to_run)
         assert [] == to_run
@@ -381,7 +545,7 @@ class TestTaskDispatcher_update_waiting(object):
                  't2': Task('t2', None),
                  }
         td = TaskDispatcher(tasks, [], None)
-        n2 = td._gen_node(None, 't2')
+        n2 = td._gen_node('t2')
         n2.wait_select = True
         n2.run_status = 'run'
         td.waiting.add(n2)
@@ -394,8 +558,8 @@ class TestTaskDispatcher_update_waiting(object):
                  't2': Task('t2', None),
                  }
         td = TaskDispatcher(tasks, [], None)
-        n1 = td._gen_node(None, 't1')
-        n2 = td._gen_node(None, 't2')
+        n1 = td._gen_node('t1')
+        n2 = td._gen_node('t2')
         td._node_add_wait_run(n1, ['t2'])
         n2.run_status = 'done'
         td.waiting.add(n1)
@@ -409,8 +573,8 @@ class TestTaskDispatcher_update_waiting(object):
                  't2': Task('t2', None),
                  }
         td = TaskDispatcher(tasks, [], None)
-        n1 = td._gen_node(None, 't1')
-        n2 = td._gen_node(None, 't2')
+        n1 = td._gen_node('t1')
+        n2 = td._gen_node('t2')
         td._node_add_wait_run(n1, ['t2'])
         n2.run_status = 'failure'
         td.waiting.add(n1)
@@ -421,6 +585,19 @@ class TestTaskDispatcher_update_waiting(object):
 
     # test_wait_calc is tested on TestTaskDispatcher_add_task.test_calc_dep
 
+    def test_check_new_deps(self):
+        tasks = {'t1': Task('t1', None, task_dep=['t2']),
+                 't2': Task('t2', None, task_dep=['t3']),
+                 't3': Task('t3', None),
+                 }
+        td = TaskDispatcher(tasks, [], None)
+        td._check_new_deps('t1', ['t3'])
+        td._check_new_deps('t3', ['t4'])
+        excinfo = pytest.raises(InvalidDodoFile, td._check_new_deps,
+                                't3', ['t1'])
+        assert "[t3 -> t1 -> t2 -> t3]" in str(excinfo.value)
+        pytest.raises(InvalidDodoFile, td._check_new_deps, 't3', ['t3'])
+
 
 class TestTaskDispatcher_dispatcher_generator(object):
     def test_normal(self):
@@ -446,3 +623,208 @@ class TestTaskDispatcher_dispatcher_generator(object):
         assert tasks[0] == gen.send(None).task
         assert tasks[1] == gen.send(None).task
         pytest.raises(StopIteration, gen.send, None)
+
+    def test_priority(self):
+        # t1 -> t2 -> t3 (t1 depends on t2...)
+        tasks = [Task("t1", [""], task_dep=["t2"]),
+                 Task("t2", [""], task_dep=["t3"]),
+                 Task("t3", [""]),
+                 Task("t4", [""]),
+                 Task("t5", [""])]
+        control = TaskControl(tasks)
+        control.process(None)
+        gen = control.task_dispatcher(durations={'t5': 2, 't4': 1}).generator
+        # t3 is the start of longest chain, t5 takes longer than t4
+        assert tasks[2] == next(gen).task
+        assert tasks[4] == next(gen).task
+        assert tasks[3] == next(gen).task
+
+
+class TestTaskDispatcher_lazy_subtasks(object):
+    def create(self, num, group_dep=(), **kwargs):
+        def gen():
+            for i in range(num):
+                yield Task("g:%d" % i, [""], **kwargs)
+        group = Task("g", None, task_dep=list(group_dep), has_subtask=True)
+        group.subtask_iter = gen()
+        return group
+
+    def run_all(self, td, sizes=None):
+        """process all nodes as up-to-date, return processed task names"""
+        done = []
+        gen = td.generator
+        node = next(gen)
+        while True:
+            if sizes is not None:
+                sizes.append(len(td.tasks))
+            if node != "hold on":
+                node.run_status = 'up-to-date'
+                done.append(node.task.name)
+            try:
+                node = gen.send(node if node != "hold on" else None)
+            except StopIteration:
+                return done
+
+    def test_batches(self):
+        group = self.create(5)
+        td = TaskDispatcher({'g': group}, {}, ['g'])
+        td.LAZY_BATCH = 2
+        sizes = []
+        done = self.run_all(td, sizes)
+        assert ['g:0', 'g:1', 'g:2', 'g:3', 'g:4', 'g'] == done
+        # released tasks are not kept on memory
+        assert 3 == max(sizes)
+        assert ['g'] == list(td.tasks)
+        assert ['g'] == list(td.nodes)
+        assert ['g:0', 'g:1', 'g:2', 'g:3', 'g:4'] == group.task_dep
+        assert group.subtask_iter is None
+
+    def test_create_while_running(self):
+        group = self.create(5)
+        td = TaskDispatcher({'g': group}, {}, ['g'])
+        td.LAZY_BATCH = 2
+        n0 = next(td.generator)
+        n1 = next(td.generator)
+        assert ['g:0', 'g:1'] == [n0.task.name, n1.task.name]
+        assert "hold on" == next(td.generator)
+        # g:1 still running
+        n0.run_status = 'successful'
+        n2 = td.generator.send(n0)
+        assert 'g:2' == n2.task.name
+        assert "hold on" == next(td.generator)
+        n1.run_status = 'successful'
+        assert 'g:3' == td.generator.send(n1).task.name
+
+    def test_failed_not_released(self):
+        group = self.create(2)
+        td = TaskDispatcher({'g': group}, {}, ['g'])
+        n0 = next(td.generator)
+        n0.run_status = 'failure'
+        n1 = td.generator.send(n0)
+        assert 'g:1' == n1.task.name
+        n1.run_status = 'up-to-date'
+        td.generator.send(n1)
+        assert 'g:0' in td.tasks
+        assert 'g:1' not in td.tasks
+        assert [n0] == td.nodes['g'].bad_deps
+
+    def test_implicit_dep_on_target(self):
+        def gen():
+            yield Task("g:0", [""], targets=['f0'])
+            yield Task("g:1", [""], file_dep=['f0'])
+        group = Task("g", None, has_subtask=True)
+        group.subtask_iter = gen()
+        td = TaskDispatcher({'g': group}, {}, ['g'])
+        assert ['g:0', 'g:1', 'g'] == self.run_all(td)
+        assert ['g:0'] == group.task_dep[:1]
+        assert {'f0': 'g:0'} == td.targets
+
+    def test_dep_on_released(self):
+        def gen():
+            yield Task("g:0", [""])
+            yield Task("g:1", [""], task_dep=['g:0'])
+        group = Task("g", None, has_subtask=True)
+        group.subtask_iter = gen()
+        td = TaskDispatcher({'g': group}, {}, ['g'])
+        td.LAZY_BATCH = 1
+        assert ['g:0', 'g:1', 'g'] == self.run_all(td)
+
+    def test_getargs_from_lazy(self):
+        def gen():
+            yield Task("g:0", [""])
+            yield Task("g:1", [""], getargs={'x': ('g:0', 'x')})
+        group = Task("g", None, has_subtask=True)
+        group.subtask_iter = gen()
+        td = TaskDispatcher({'g': group}, {}, ['g'])
+        pytest.raises(InvalidTask, next, td.generator)
+
+    def test_result_dep_on_lazy(self):
+        def gen():
+            yield Task("g:0", [""])
+            yield Task("g:1", [""], uptodate=[result_dep('g:0')])
+        group = Task("g", None, has_subtask=True)
+        group.subtask_iter = gen()
+        td = TaskDispatcher({'g': group}, {}, ['g'])
+        td.LAZY_BATCH = 1
+        pytest.raises(InvalidTask, self.run_all, td)
+
+    def test_invalid_dep(self):
+        group = self.create(1, task_dep=['xxx'])
+        td = TaskDispatcher({'g': group}, {}, ['g'])
+        pytest.raises(InvalidTask, next, td.generator)
+
+    def test_duplicated_target(self):
+        group = self.create(2, targets=['f0'])
+        td = TaskDispatcher({'g': group}, {}, ['g'])
+        pytest.raises(InvalidTask, next, td.generator)
+
+    def test_cycle(self):
+        group = self.create(1, task_dep=['t1'])
+        tasks = {'g': group, 't1': Task("t1", None, task_dep=['g'])}
+        td = TaskDispatcher(tasks, {}, ['g'])
+        pytest.raises(InvalidDodoFile, next, td.generator)
+
+
+class TestCriticalPathWeights(object):
+    def test_weights(self):
+        tasks = {'t1': Task('t1', [""], task_dep=['t2', 't3']),
+                 't2': Task('t2', [""], task_dep=['t3']),
+                 't3': Task('t3', [""]),
+                 'g1': Task('g1', None, task_dep=['t1']),
+                 't4': Task('t4', [""], setup=['t3']),
+                 }
+        weights = critical_path_weights(tasks, {'t1': 5, 't3': 1})
+        assert 0 == weights['g1']
+        assert 5 == weights['t1']
+        assert 8 == weights['t2']
+        assert 9 == weights['t3']
+        assert 3 == weights['t4']
+
+    def test_cyclic(self):
+        tasks = {'t1': Task('t1', [""], task_dep=['t2']),
+                 't2': Task('t2', [""], task_dep=['t1']),
+                 }
+        weights = critical_path_weights(tasks, {})
+        assert set(['t1', 't2']) == set(weights)
+
+
+class TestTaskDispatcher_settled_tasks(object):
+    def test_settled(self):
+        tasks = {'t1': Task('t1', None, task_dep=['t2']),
+                 't2': Task('t2', None),
+                 't3': Task('t3', None),
+                 't4': Task('t4', None, task_dep=['t2']),
+                 }
+        td = TaskDispatcher(tasks, [], ['t1', 't3', 't4'])
+        assert [] == td.settled_tasks(5)
+        n2 = next(td.generator)
+        assert tasks['t2'] == n2.task
+        # t1 is waiting, t4 has task_dep
+        assert [tasks['t3']] == td.settled_tasks(5)
+        assert [] == td.settled_tasks(0)
+        # nodes on ready queue
+        td.ready.append(td._gen_node('t3'))
+        assert [tasks['t3']] == td.settled_tasks(5)
+
+
+class TestPriorityQueue(object):
+    def test_order(self):
+        nodes = [ExecNode(Task(name, None))
+                 for name in ('t1', 't2', 't3', 't4')]
+        queue = PriorityQueue({'t2': 3, 't3': 5, 't4': 3})
+        for node in nodes:
+            queue.append(node)
+        assert 4 == len(queue)
+        assert ['t3', 't2', 't4', 't1'] == [n.task.name for n in queue]
+        got = []
+        while queue:
+            got.append(queue.popleft().task.name)
+        assert ['t3', 't2', 't4', 't1'] == got
+
+    def test_head(self):
+        queue = PriorityQueue({'t2': 3, 't3': 5})
+        for name in ('t1', 't2', 't3'):
+            queue.append(ExecNode(Task(name, None)))
+        assert 't3' == queue.head(2)[0].task.name
+        assert 2 == len(queue.head(2))
+        assert 3 == len(queue.head(5))
@@ -3,12 +3,21 @@
 import os
 import time
 import anydbm
+import sqlite3
 
 import pytest
 
+from doit.compat import json
 from doit.task import Task
 from doit.dependency import get_md5, md5sum, check_modified, UptodateCalculator
-from doit.dependency import JsonDependency, DbmDependency, DbmDB
+from doit.dependency import file_checksum, CHECKSUMS, thread_map
+from doit.dependency import FileSignatureCache, update_duration_stats
+from doit.dependency import StatusPrefetch
+from doit import dependency
+from doit.dependency import JsonDependency, DbmDependency, DbmDB, JsonDB
+from doit.dependency import DbmMarshalDependency
+from doit.dependency import SqliteDependency, SqliteDB
+from doit.dependency import JsonJournalDependency, JsonJournalDB
 from .conftest import get_abspath, depfile
 
 
@@ -24,6 +33,128 @@ def test_md5():
     expected = "45d1503cb985898ab5bd8e58973007dd"
     assert expected == md5sum(filePath)
 
+def test_md5_chunks():
+    filePath = os.path.join(os.path.dirname(__file__),"sample_md5.txt")
+    expected = "45d1503cb985898ab5bd8e58973007dd"
+    # result must not depend on the size of chunks read from file
+    assert expected == md5sum(filePath, chunk_size=1)
+    assert expected == md5sum(filePath, chunk_size=7)
+
+def test_file_checksum():
+    filePath = os.path.join(os.path.dirname(__file__),"sample_md5.txt")
+    # result got using zlib.crc32 on file content
+    assert "1ceedda2" == file_checksum(filePath, 'crc32')
+    assert "1ceedda2" == file_checksum(filePath, 'crc32', chunk_size=3)
+    assert md5sum(filePath) == file_checksum(filePath)
+    for algorithm in CHECKSUMS:
+        assert file_checksum(filePath, algorithm)
+
+
+class TestUpdateDurationStats(object):
+    def test_first(self):
+        stats = update_duration_stats(None, (2.0, 1.0))
+        assert {'runs': 1, 'wall': 2.0, 'cpu': 1.0,
+                'last_wall': 2.0, 'last_cpu': 1.0} == stats
+
+    def test_average(self):
+        stats = update_duration_stats(None, (2.0, 1.0))
+        stats = update_duration_stats(stats, (4.0, 2.0))
+        assert 2 == stats['runs']
+        assert 3.0 == stats['wall']
+        assert 1.5 == stats['cpu']
+        assert 4.0 == stats['last_wall']
+
+    def test_cpu_none(self):
+        stats = update_duration_stats(None, (2.0, None))
+        assert None == stats['cpu']
+        stats = update_duration_stats(stats, (4.0, 1.0))
+        assert 1.0 == stats['cpu']
+        stats = update_duration_stats(stats, (4.0, None))
+        assert 1.0 == stats['cpu']
+        assert None == stats['last_cpu']
+
+    def test_rolling(self, monkeypatch):
+        monkeypatch.setattr(dependency, 'DURATION_WINDOW', 2)
+        stats = {'runs': 5, 'wall': 2.0, 'cpu': 2.0}
+        stats = update_duration_stats(stats, (4.0, 4.0))
+        assert 6 == stats['runs']
+        assert 3.0 == stats['wall']
+
+
+class TestThreadMap(object):
+    def test_serial(self):
+        assert [2, 4, 6] == thread_map(lambda x: x*2, [1, 2, 3], 0)
+
+    def test_threads(self):
+        items = range(50)
+        assert [x*2 for x in items] == thread_map(lambda x: x*2, items, 4)
+
+    def test_exception(self):
+        def div(x):
+            return 1 / x
+        pytest.raises(ZeroDivisionError, thread_map, div, [1, 2, 0, 4], 3)
+
+
+class TestStatusPrefetch(object):
+    def test_checksum(self, depfile, dependency1, monkeypatch):
+        t1 = Task("t1", None, file_dep=[dependency1])
+        t2 = Task("t2", None, file_dep=[dependency1])
+        depfile.save_success(t1)
+        depfile.file_cache = FileSignatureCache()
+        # same size different timestamp, checksum must be checked
+        os.utime(dependency1, (1, 1))
+        prefetch = StatusPrefetch(depfile, 2)
+        prefetch.add(t1)
+        prefetch.add(t1)
+        prefetch.add(t2) # no saved state, never checked
+        prefetch._queue.join()
+        prefetch.close()
+        assert 1 == len(depfile.file_cache._checksum)
+
+        def not_called(path, algorithm): # pragma: no cover
+            raise Exception("checksum already calculated")
+        monkeypatch.setattr(dependency, 'file_checksum', not_called)
+        assert 'up-to-date' == depfile.get_status(t1, {})
+
+
+class TestFileSignatureCache(object):
+    def test_stat_not_cached(self, dependency1):
+        cache = FileSignatureCache()
+        stat1 = cache.stat(dependency1)
+        assert stat1 is not cache.stat(dependency1)
+
+    def test_stat_cached(self, dependency1):
+        cache = FileSignatureCache(cache_stat=True)
+        stat1 = cache.stat(dependency1)
+        assert stat1 is cache.stat(dependency1)
+        cache.clear_stat()
+        assert stat1 is not cache.stat(dependency1)
+
+    def test_stat_not_exist(self):
+        cache = FileSignatureCache(cache_stat=True)
+        pytest.raises(OSError, cache.stat, get_abspath("data/i_dont_exist"))
+
+    def test_checksum(self, dependency1, monkeypatch):
+        calls = []
+        def fake_checksum(path, algorithm):
+            calls.append((path, algorithm))
+            return 'xxx'
+        monkeypatch.setattr(dependency, 'file_checksum', fake_checksum)
+        cache = FileSignatureCache()
+        stat1 = os.stat(dependency1)
+        assert 'xxx' == cache.checksum(dependency1, stat1, 'md5')
+        assert 'xxx' == cache.checksum(dependency1, stat1, 'md5')
+        assert [(dependency1, 'md5')] == calls
+        # different algorithm
+        assert 'xxx' == cache.checksum(dependency1, stat1, 'crc32')
+        assert 2 == len(calls)
+        # file modified
+        ff = open(dependency1, "a")
+        ff.write("modified content")
+        ff.close()
+        assert 'xxx' == cache.checksum(dependency1, os.stat(dependency1), 'md5')
+        assert 3 == len(calls)
+
 
 ####
 # dependencies are files only (not other tasks), or bool.
@@ -43,12 +174,12 @@ def test_md5():
 
 
 # test parametrization, execute tests for all DB backends
-BACKENDS = [JsonDependency]
+BACKENDS = [JsonDependency, JsonJournalDependency, SqliteDependency]
 # gdbm is broken on python2.5
 import platform
 python_version = platform.python_version().split('.')
 if python_version[0] != '2' or python_version[1] != '5':
-    BACKENDS.append(DbmDependency)
+    BACKENDS.extend([DbmDependency, DbmMarshalDependency])
 pytest.fixture(params=BACKENDS)(depfile)
 
 
@@ -74,6 +205,40 @@ class TestDependencyDb(object):
         value = d2._get("taskId_X","dependency_A")
         assert "da_md5" == value, value
 
+    def test_close_no_save(self, depfile):
+        depfile._set("taskId_X","dependency_A","da_md5")
+        depfile.close(save=False)
+        d2 = depfile.__class__(depfile.name)
+        assert None == d2._get("taskId_X","dependency_A")
+
+    def test_checkpoint(self, depfile):
+        depfile._set("taskId_X","dependency_A","da_md5")
+        depfile.checkpoint()
+        depfile._set("taskId_X","dependency_A","modified")
+        # simulate a crash, DB is not closed
+        if hasattr(depfile.backend, '_dbm'):
+            depfile.backend._dbm.close()
+        elif hasattr(depfile.backend, '_conn'):
+            depfile.backend._conn.close()
+        depfile._closed = True
+        d2 = depfile.__class__(depfile.name)
+        assert "da_md5" == d2._get("taskId_X","dependency_A")
+        d2.close()
+
+    def test_gc(self, depfile):
+        depfile._set("taskId_X","dependency_A","x")
+        depfile._set("taskId_Y","dependency_A","y")
+        depfile.close()
+        d2 = depfile.__class__(depfile.name)
+        d2._set("taskId_Z","dependency_A","z")
+        assert ["taskId_X", "taskId_Z"] == d2.gc(["taskId_Y", "taskId_W"])
+        d2.close()
+        d3 = depfile.__class__(depfile.name)
+        assert not d3._in("taskId_X")
+        assert "y" == d3._get("taskId_Y","dependency_A")
+        assert not d3._in("taskId_Z")
+        d3.close()
+
     def test_corrupted_file(self, depfile):
         if depfile.__class__==DbmDependency and depfile.whichdb is None: # pragma: no cover
             pytest.skip('dumbdbm too dumb to detect db corruption')
@@ -85,14 +250,14 @@ class TestDependencyDb(object):
             fd.write("""{"x": y}""")
             fd.close()
         if isinstance(anydbm.error, Exception): # pragma: no cover
-            exceptions = (ValueError, anydbm.error)
+            exceptions = (ValueError, sqlite3.DatabaseError, anydbm.error)
         else:
-            exceptions = (ValueError,) + anydbm.error
+            exceptions = (ValueError, sqlite3.DatabaseError) + anydbm.error
         pytest.raises(exceptions, depfile.__class__, depfile.name)
 
     def test_corrupted_file_unrecognized_excep(self, monkeypatch, depfile):
-        if isinstance(depfile, JsonDependency):
-            pytest.skip('test doesnt apply to JsonDependency')
+        if not isinstance(depfile, DbmDependency):
+            pytest.skip('test only apply to DbmDependency')
         if depfile.whichdb is None: # pragma: no cover
             pytest.skip('dumbdbm too dumb to detect db corruption')
 
@@ -153,6 +318,273 @@ class TestDependencyDb(object):
 
 
 
+class TestJsonDB(object):
+    def test_one_task_per_line(self, db_name):
+        db = JsonDB(db_name)
+        db.set("taskId_X", "dep_1", "x")
+        db.set("taskId_Y", "dep_1", ["y", 2])
+        db.dump()
+        lines = open(db_name).read().splitlines()
+        assert '{' == lines[0]
+        assert '}' == lines[-1]
+        assert ['"taskId_X": {"dep_1": "x"}', '"taskId_Y": {"dep_1": ["y", 2]}'
+                ] == sorted(line.rstrip(',') for line in lines[1:-1])
+        # still a valid JSON file
+        assert {"taskId_X": {"dep_1": "x"}, "taskId_Y": {"dep_1": ["y", 2]}
+                } == json.load(open(db_name))
+
+    def test_decode_only_accessed_tasks(self, db_name):
+        db = JsonDB(db_name)
+        db.set("taskId_X", "dep_1", "x")
+        db.set("taskId_Y", "dep_1", "y")
+        db.dump()
+        db2 = JsonDB(db_name)
+        assert {} == db2._db
+        assert db2.in_("taskId_Y")
+        assert "x" == db2.get("taskId_X", "dep_1")
+        assert ["taskId_X"] == db2._db.keys()
+        # not decoded values are saved back
+        db2.set("taskId_X", "dep_1", "x2")
+        db2.dump()
+        db3 = JsonDB(db_name)
+        assert "x2" == db3.get("taskId_X", "dep_1")
+        assert "y" == db3.get("taskId_Y", "dep_1")
+
+    def test_empty(self, db_name):
+        JsonDB(db_name).dump()
+        db = JsonDB(db_name)
+        assert {} == db._db
+        assert {} == db._raw
+
+    def test_load_single_line(self, db_name):
+        # file not written by doit, decode all at once
+        json.dump({"taskId_X": {"dep_1": "x"}}, open(db_name, 'w'))
+        db = JsonDB(db_name)
+        assert {"taskId_X": {"dep_1": "x"}} == db._db
+        assert "x" == db.get("taskId_X", "dep_1")
+
+    def test_corrupted_task_values(self, db_name):
+        db_file = open(db_name, 'w')
+        db_file.write('{\n"taskId_X": {"dep_1": x}\n}\n')
+        db_file.close()
+        db = JsonDB(db_name)
+        pytest.raises(ValueError, db.get, "taskId_X", "dep_1")
+
+
+class TestDbmDB(object):
+    def test_marshal_encoding(self, db_name):
+        db = DbmDB(db_name, binary=True)
+        values = {"/path/to/dep_1.py": [1354000000.25, 20, "abc", "md5"],
+                  "result:": None}
+        data = db._encode(values)
+        assert data.startswith(DbmDB.MARSHAL_PREFIX)
+        assert len(data) < len(json.dumps(values))
+        assert values == db._decode(data)
+        db.dump()
+
+    def test_marshal_keys(self, db_name):
+        db = DbmDB(db_name, binary=True)
+        db.set("taskId_X", "dep_1", "x")
+        db.set("taskId_Y", "dep_1", "y")
+        db.set("taskId_Y", "dep_2", "z")
+        db.dump()
+        db2 = DbmDB(db_name, binary=True)
+        assert "y" == db2.get("taskId_Y", "dep_1")
+        assert "z" == db2.get("taskId_Y", "dep_2")
+        assert 2 == len(db2._keys)
+        db2.set("taskId_Y", "dep_3", "y3")
+        db2.dump()
+        db3 = DbmDB(db_name)
+        assert "x" == db3.get("taskId_X", "dep_1")
+        assert "y3" == db3.get("taskId_Y", "dep_3")
+        assert ["dep_1", "dep_2", "dep_3"] == sorted(db3._keys)
+        db3.dump()
+
+    def test_read_both_encodings(self, db_name):
+        db = DbmDB(db_name)
+        db.set("taskId_X", "dep_1", "x")
+        db.dump()
+        db2 = DbmDB(db_name, binary=True)
+        assert "x" == db2.get("taskId_X", "dep_1")
+        db2.set("taskId_Y", "dep_1", "y")
+        db2.dump()
+        db3 = DbmDB(db_name)
+        assert "x" == db3.get("taskId_X", "dep_1")
+        assert "y" == db3.get("taskId_Y", "dep_1")
+        db3.dump()
+
+
+    def test_compact(self, db_name):
+        db = DbmDB(db_name)
+        db.set("taskId_X", "dep_1", "x")
+        db.set("taskId_Y", "dep_1", "y")
+        db.dump()
+        db2 = DbmDB(db_name)
+        db2.remove("taskId_Y")
+        db2.compact()
+        assert "x" == db2.get("taskId_X", "dep_1")
+        db2.set("taskId_Z", "dep_1", "z")
+        db2.dump()
+        assert not [name for name in os.listdir(os.path.dirname(db_name))
+                    if '.tmp' in name]
+        db3 = DbmDB(db_name)
+        assert ["taskId_X", "taskId_Z"] == sorted(db3.task_ids())
+        db3.dump()
+
+    def test_compact_interrupted(self, db_name, monkeypatch):
+        db = DbmDB(db_name)
+        db.set("taskId_X", "dep_1", "x")
+        db.set("taskId_Y", "dep_1", "y")
+        db.dump()
+
+        class Interrupted(Exception):
+            pass
+        class InterruptedDBM(object):
+            """fails after writing first item"""
+            def __init__(self, dbm):
+                self.dbm = dbm
+            def __setitem__(self, key, value):
+                self.dbm[key] = value
+                raise Interrupted()
+            def close(self):
+                self.dbm.close()
+        db2 = DbmDB(db_name)
+        real_open = dependency.ddbm.open
+        monkeypatch.setattr(dependency.ddbm, 'open',
+                            lambda name, flag: InterruptedDBM(
+                                real_open(name, flag)))
+        pytest.raises(Interrupted, db2.compact)
+        monkeypatch.undo()
+        db2.close()
+        db3 = DbmDB(db_name)
+        assert "x" == db3.get("taskId_X", "dep_1")
+        assert "y" == db3.get("taskId_Y", "dep_1")
+        db3.dump()
+
+
+class TestSqliteDB(object):
+    def test_corrupted_file(self, depfile):
+        fd = open(depfile.name + '.x', 'w')
+        fd.write("""{"x": y}""")
+        fd.close()
+        try:
+            SqliteDB(depfile.name + '.x')
+        except sqlite3.DatabaseError, exception:
+            assert 'seems to use an old format or is corrupted' in \
+                str(exception)
+        else: # pragma: no cover
+            assert False, 'DatabaseError not raised'
+        os.remove(depfile.name + '.x')
+
+    def test_corrupted_file_unrecognized_excep(self, monkeypatch, depfile):
+        fd = open(depfile.name + '.x', 'w')
+        fd.write("""{"x": y}""")
+        fd.close()
+        monkeypatch.setattr(SqliteDB, 'DB_CONTENT_ERROR_MSG', 'xxx')
+        pytest.raises(sqlite3.DatabaseError, SqliteDB, depfile.name + '.x')
+        os.remove(depfile.name + '.x')
+
+    def test_one_row_per_dependency(self, depfile):
+        db = SqliteDB(depfile.name + '.x')
+        db.set("taskId_X", "dep_1", "x")
+        db.set("taskId_X", "dep_2", ["y", 2])
+        db.set("taskId_Y", "dep_1", "z")
+        db.dump()
+
+        conn = sqlite3.connect(depfile.name + '.x')
+        rows = conn.execute('SELECT task_id, dependency, value FROM doit '
+                            'ORDER BY task_id, dependency').fetchall()
+        conn.close()
+        assert [("taskId_X", "dep_1", '"x"'),
+                ("taskId_X", "dep_2", '["y", 2]'),
+                ("taskId_Y", "dep_1", '"z"')] == rows
+        os.remove(depfile.name + '.x')
+
+    def test_not_commited_until_dump(self, depfile):
+        db = SqliteDB(depfile.name + '.x')
+        db.set("taskId_X", "dep_1", "x")
+        db.dump()
+        db2 = SqliteDB(depfile.name + '.x')
+        db2.set("taskId_X", "dep_1", "modified")
+        db2.remove("taskId_X")
+        # simulate a crash, not dumped
+        db2._conn.close()
+        db3 = SqliteDB(depfile.name + '.x')
+        assert "x" == db3.get("taskId_X", "dep_1")
+        db3.dump()
+        os.remove(depfile.name + '.x')
+
+
+@pytest.fixture
+def db_name(request, tmpdir):
+    return os.path.join(tmpdir.strpath, 'testdb')
+
+class TestJsonJournalDB(object):
+    def test_dump_appends_to_journal(self, db_name):
+        db = JsonJournalDB(db_name)
+        db.set("taskId_X", "dep_1", "x")
+        db.set("taskId_Y", "dep_1", "y")
+        db.compact()
+        db.set("taskId_X", "dep_1", "x2")
+        db.dump()
+        # only modified task is written
+        journal = open(db_name + '.journal').readlines()
+        assert 1 == len(journal)
+        assert ["taskId_X", {"dep_1": "x2"}] == json.loads(journal[0])
+        assert {"taskId_X": {"dep_1": "x"}, "taskId_Y": {"dep_1": "y"}} == \
+            json.load(open(db_name))
+
+    def test_replay(self, db_name):
+        db = JsonJournalDB(db_name)
+        db.set("taskId_X", "dep_1", "x")
+        db.set("taskId_Y", "dep_1", "y")
+        db.compact()
+        db.set("taskId_X", "dep_1", "x2")
+        db.remove("taskId_Y")
+        db.set("taskId_Z", "dep_1", "z")
+        db.dump()
+        db2 = JsonJournalDB(db_name)
+        assert "x2" == db2.get("taskId_X", "dep_1")
+        assert not db2.in_("taskId_Y")
+        assert "z" == db2.get("taskId_Z", "dep_1")
+
+    def test_compact(self, db_name, monkeypatch):
+        monkeypatch.setattr(JsonJournalDB, 'MIN_COMPACT', 2)
+        db = JsonJournalDB(db_name)
+        db.set("taskId_X", "dep_1", "x")
+        db.set("taskId_Y", "dep_1", "y")
+        db.dump()
+        assert os.path.exists(db_name + '.journal')
+        db.set("taskId_X", "dep_1", "x2")
+        db.dump()
+        assert not os.path.exists(db_name + '.journal')
+        assert {"taskId_X": {"dep_1": "x2"}, "taskId_Y": {"dep_1": "y"}} == \
+            json.load(open(db_name))
+
+    def test_remove_all_compacts(self, db_name):
+        db = JsonJournalDB(db_name)
+        db.set("taskId_X", "dep_1", "x")
+        db.dump()
+        db.remove_all()
+        db.dump()
+        assert not os.path.exists(db_name + '.journal')
+        assert {} == JsonJournalDB(db_name)._db
+
+    def test_incomplete_journal_entry(self, db_name):
+        db = JsonJournalDB(db_name)
+        db.set("taskId_X", "dep_1", "x")
+        db.dump()
+        journal = open(db_name + '.journal', 'a')
+        journal.write('["taskId_Y", {"dep_1"')
+        journal.close()
+        db2 = JsonJournalDB(db_name)
+        assert "x" == db2.get("taskId_X", "dep_1")
+        assert not db2.in_("taskId_Y")
+        db2.dump()
+        assert not os.path.exists(db_name + '.journal')
+        assert "x" == JsonJournalDB(db_name).get("taskId_X", "dep_1")
+
+
 class TestSaveSuccess(object):
 
     def test_save_result(self, depfile):
@@ -187,6 +619,20 @@ class TestSaveSuccess(object):
         assert os.path.getmtime(filePath) == value[0] # timestamp
         assert 39 == value[1] # size
         assert expected == value[2] # MD5
+        assert 'md5' == value[3] # algorithm
+
+    def test_save_file_checksum_algorithm(self, depfile):
+        filePath = get_abspath("data/dependency1")
+        ff = open(filePath,"w")
+        ff.write("i am the first dependency ever for doit")
+        ff.close()
+
+        depfile.checksum = 'crc32'
+        t1 = Task("taskId_X", None, [filePath])
+        depfile.save_success(t1)
+        value = depfile._get("taskId_X",filePath)
+        assert file_checksum(filePath, 'crc32') == value[2]
+        assert 'crc32' == value[3]
 
     def test_save_skip(self, depfile, monkeypatch):
         #self.test_save_file_md5(depfile)
@@ -215,12 +661,61 @@ class TestSaveSuccess(object):
         assert depfile._get("taskId_X",filePath) is not None
         assert depfile._get("taskId_X",filePath2) is not None
 
+    def test_save_files_threads(self, depfile):
+        paths = []
+        for index in range(4):
+            path = get_abspath("data/dependency%s" % (index + 1))
+            ff = open(path,"w")
+            ff.write("part%s" % index)
+            ff.close()
+            paths.append(path)
+
+        depfile.checksum_threads = 3
+        t1 = Task("taskId_X", None, paths)
+        depfile.save_success(t1)
+        for path in paths:
+            assert md5sum(path) == depfile._get("taskId_X", path)[2]
+        for path in paths[2:]:
+            os.remove(path)
+
     def test_save_values(self, depfile):
         t1 = Task('t1', None)
         t1.values = {'x':5, 'y':10}
         depfile.save_success(t1)
         assert {'x':5, 'y':10} == depfile._get("t1", "_values_:")
 
+    def test_save_duration(self, depfile):
+        t1 = Task('t1', None)
+        depfile.save_success(t1)
+        assert None == depfile.get_duration('t1')
+        t1.duration = (2.0, 1.0)
+        depfile.save_success(t1)
+        t1.duration = (4.0, 1.0)
+        depfile.save_success(t1)
+        stats = depfile.get_duration('t1')
+        assert 2 == stats['runs']
+        assert 3.0 == stats['wall']
+        assert {'t1': 3.0} == depfile.get_durations(['t1', 't2'])
+
+
+class TestSaveTargets(object):
+    def test_save(self, depfile, dependency1):
+        folder = get_abspath("data")
+        missing = get_abspath("data/target_not_there")
+        t1 = Task("t1", None, targets=[dependency1, folder, missing])
+        depfile.target_sigs[missing] = 'old'
+        depfile.save_targets(t1)
+        assert [dependency1] == list(depfile.target_sigs)
+        signature = depfile.target_sigs[dependency1]
+        assert signature == depfile._file_signature(dependency1)
+        assert 'md5' == signature[3]
+
+    def test_remove_success(self, depfile, dependency1):
+        t1 = Task("t1", None, targets=[dependency1])
+        depfile.save_targets(t1)
+        depfile.remove_success(t1)
+        assert {} == depfile.target_sigs
+
 
 class TestGetValue(object):
     def test_all_values(self, depfile):
@@ -293,6 +788,23 @@ class TestCheckModified(object):
         assert not check_modified(dependency1, dep_stat, (timestamp+1, size, md5))
         assert check_modified(dependency1, dep_stat, (timestamp+1, size, ''))
 
+    def test_algorithm(self, dependency1):
+        timestamp = os.path.getmtime(dependency1)
+        size = os.path.getsize(dependency1)
+        crc = file_checksum(dependency1, 'crc32')
+        md5 = md5sum(dependency1)
+        dep_stat = os.stat(dependency1)
+        # checksum is compared using the algorithm saved on state
+        state = (timestamp+1, size, crc, 'crc32')
+        assert not check_modified(dependency1, dep_stat, state)
+        state = (timestamp+1, size, md5, 'crc32')
+        assert check_modified(dependency1, dep_stat, state)
+        state = (timestamp+1, size, md5, 'md5')
+        assert not check_modified(dependency1, dep_stat, state)
+        # unknown algorithm can not be checked
+        state = (timestamp+1, size, md5, 'not-available')
+        assert check_modified(dependency1, dep_stat, state)
+
 
 
 class TestGetStatus(object):
@@ -335,6 +847,98 @@ class TestGetStatus(object):
         assert 'run' == depfile.get_status(t1, {})
         assert dependencies == t1.dep_changed
 
+    def test_change_checksum_algorithm(self, depfile, dependency1):
+        t1 = Task("t1", None, [dependency1])
+        depfile.save_success(t1)
+        # values saved with md5 are still valid after changing the algorithm
+        depfile.checksum = 'crc32'
+        state = depfile._get(t1.name, dependency1)
+        depfile._set(t1.name, dependency1, [state[0] - 1] + list(state[1:]))
+        assert 'up-to-date' == depfile.get_status(t1, {})
+
+
+    def test_checksum_threads(self, depfile):
+        paths = []
+        for index in range(4):
+            path = get_abspath("data/dependency%s" % (index + 1))
+            ff = open(path,"w")
+            ff.write("part%s" % index)
+            ff.close()
+            paths.append(path)
+
+        depfile.checksum_threads = 3
+        t1 = Task("t1", None, paths)
+        depfile.save_success(t1)
+        # force checksum comparison: same size different timestamp
+        for path in paths:
+            state = depfile._get(t1.name, path)
+            depfile._set(t1.name, path, [state[0] - 1] + list(state[1:]))
+        assert 'up-to-date' == depfile.get_status(t1, {})
+        assert [] == t1.dep_changed
+
+        # modify content but keep size
+        ff = open(paths[1],"w")
+        ff.write("PART1")
+        ff.close()
+        ff = open(paths[3],"w")
+        ff.write("PART3")
+        ff.close()
+        assert 'run' == depfile.get_status(t1, {})
+        assert set([paths[1], paths[3]]) == set(t1.dep_changed)
+        for path in paths[2:]:
+            os.remove(path)
+
+    def test_checksum_shared_by_tasks(self, depfile, dependency1,
+                                      monkeypatch):
+        t1 = Task("t1", None, [dependency1])
+        t2 = Task("t2", None, [dependency1])
+        depfile.save_success(t1)
+        depfile.save_success(t2)
+        # force checksum comparison: same size different timestamp
+        for task in (t1, t2):
+            state = depfile._get(task.name, dependency1)
+            depfile._set(task.name, dependency1,
+                         [state[0] - 1] + list(state[1:]))
+
+        calls = []
+        def count_checksum(path, algorithm):
+            calls.append(path)
+            return file_checksum(path, algorithm)
+        monkeypatch.setattr(dependency, 'file_checksum', count_checksum)
+        depfile.file_cache = FileSignatureCache()
+        assert 'up-to-date' == depfile.get_status(t1, {})
+        assert 'up-to-date' == depfile.get_status(t2, {})
+        assert [dependency1] == calls
+
+    def test_early_cutoff(self, depfile, dependency1, monkeypatch):
+        t1 = Task("t1", None, [dependency1])
+        depfile.save_success(t1)
+        state = depfile._get(t1.name, dependency1)
+        # target re-created with same content
+        depfile.target_sigs[dependency1] = (state[0] + 1,) + tuple(state[1:])
+        # file is not checked again
+        def no_stat(path):
+            raise AssertionError('stat %s' % path)
+        monkeypatch.setattr(depfile.file_cache, 'stat', no_stat)
+        assert 'up-to-date' == depfile.get_status(t1, {})
+        # timestamp of saved state is updated
+        assert state[0] + 1 == depfile._get(t1.name, dependency1)[0]
+
+        # re-created with a different content
+        depfile.target_sigs[dependency1] = (state[0] + 2, state[1], 'xxx',
+                                            state[3])
+        assert 'run' == depfile.get_status(t1, {})
+        assert [dependency1] == t1.dep_changed
+        assert state[0] + 1 == depfile._get(t1.name, dependency1)[0]
+
+    def test_early_cutoff_other_algorithm(self, depfile, dependency1):
+        t1 = Task("t1", None, [dependency1])
+        depfile.save_success(t1)
+        state = depfile._get(t1.name, dependency1)
+        depfile.target_sigs[dependency1] = (state[0] + 1, state[1], 'xxx',
+                                            'crc32')
+        # signature not used, check file
+        assert 'up-to-date' == depfile.get_status(t1, {})
 
     def test_file_dependency_not_exist(self, depfile):
         filePath = get_abspath("data/dependency_not_exist")
@@ -3,6 +3,7 @@ from mock import Mock
 
 from doit import get_var
 from doit.exceptions import InvalidCommand
+from doit.cmd_base import ModuleTaskLoader
 from doit.doit_cmd import DoitMain
 from doit.cmd_run import Run
 from doit.cmd_list import List
@@ -56,6 +57,36 @@ class TestRun(object):
         cmd_main(["list"])
         assert 1 == mock_list.call_count
 
+    def test_run_options(self, monkeypatch):
+        mock_run = Mock()
+        monkeypatch.setattr(Run, "execute", mock_run)
+        cmd_main(['--checkpoint', '2', '--checkpoint-time', '60',
+                  '--priority', '--graph-cache', '--prefetch', '4',
+                  '--early-cutoff'])
+        params = mock_run.call_args[0][0]
+        assert 2 == params['checkpoint']
+        assert 60 == params['checkpoint_time']
+        assert True == params['priority']
+        assert True == params['graph_cache']
+        assert 4 == params['prefetch']
+        assert True == params['early_cutoff']
+
+    def test_run_resources(self, tmpdir):
+        # command line from docs, value is not taken as a variable
+        def task_link():
+            for name in ('a', 'b'):
+                yield {'name': name, 'actions': [(lambda: True,)],
+                       'resources': {'mem': 4}}
+        loader = ModuleTaskLoader({'task_link': task_link})
+        db_file = str(tmpdir.join('resources.db'))
+        out_file = tmpdir.join('out.txt')
+        args = ['-n', '8', '--resources', 'mem:16,gpu:1',
+                '--db-file', db_file, '-o', str(out_file)]
+        assert 0 == DoitMain(loader).run(args)
+        out = out_file.read()
+        assert ".  link:a" in out
+        assert ".  link:b" in out
+
     def test_cmdline_vars(self, monkeypatch):
         mock_run = Mock()
         monkeypatch.setattr(Run, "execute", mock_run)
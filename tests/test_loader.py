@@ -7,6 +7,7 @@ from doit.exceptions import InvalidDodoFile, InvalidCommand
 from doit.task import InvalidTask, Task
 from doit.loader import isgenerator, flat_generator, get_module
 from doit.loader import load_tasks, load_doit_config, generate_tasks
+from doit.loader import lazy_subtasks, expand_lazy_tasks
 
 
 class TestIsGenerator(object):
@@ -262,3 +263,43 @@ class TestGenerateTasksGenerator(object):
         assert 1 == len(tasks)
         assert "xpto" == tasks[0].name
         assert not tasks[0].is_subtask
+
+
+class TestLazySubtasks(object):
+    def gen_tasks(self):
+        for i in range(3):
+            yield {'name':str(i), 'actions' :["xpto -%d"%i]}
+
+    def testGroupOnly(self):
+        tasks = generate_tasks("xpto", self.gen_tasks(), "the doc", lazy=True)
+        assert 1 == len(tasks)
+        assert "xpto" == tasks[0].name
+        assert tasks[0].has_subtask
+        assert "the doc" == tasks[0].doc
+        assert [] == tasks[0].task_dep
+        subtasks = list(tasks[0].subtask_iter)
+        assert ['xpto:0', 'xpto:1', 'xpto:2'] == [t.name for t in subtasks]
+        assert subtasks[0].is_subtask
+
+    def testBasenameNotAllowed(self):
+        def f_xpto():
+            yield {'basename':'xpto', 'actions':["xpto"]}
+        tasks = generate_tasks("xpto", f_xpto(), lazy=True)
+        pytest.raises(InvalidTask, list, tasks[0].subtask_iter)
+
+    def testDecorator(self):
+        @lazy_subtasks
+        def task_xpto():
+            return self.gen_tasks()
+        task_list = load_tasks({'task_xpto': task_xpto})
+        assert 1 == len(task_list)
+        assert task_list[0].subtask_iter is not None
+
+    def testExpand(self):
+        group = generate_tasks("xpto", self.gen_tasks(), lazy=True)[0]
+        other = Task("other", None)
+        task_list = expand_lazy_tasks([group, other])
+        assert (['xpto', 'xpto:0', 'xpto:1', 'xpto:2', 'other'] ==
+                [t.name for t in task_list])
+        assert ['xpto:0', 'xpto:1', 'xpto:2'] == group.task_dep
+        assert group.subtask_iter is None
@@ -1,5 +1,8 @@
 import os
+import sys
+import time
 from multiprocessing import Queue
+from Queue import Queue as ThreadQueue
 
 import pytest
 from mock import Mock
@@ -8,6 +11,7 @@ from doit.dependency import Dependency
 from doit.task import Task
 from doit.control import TaskDispatcher, ExecNode
 from doit import runner
+from doit.tools import result_dep
 
 
 # sample actions
@@ -73,7 +77,7 @@ class TestRunner_SelectTask(object):
     def test_ready(self, reporter, depfile):
         t1 = Task("taskX", [(my_print, ["out a"] )])
         my_runner = runner.Runner(depfile.name, reporter)
-        assert True == my_runner.select_task(ExecNode(t1, None), {})
+        assert True == my_runner.select_task(ExecNode(t1), {})
         assert ('start', t1) == reporter.log.pop(0)
         assert not reporter.log
 
@@ -81,7 +85,7 @@ class TestRunner_SelectTask(object):
         t1 = Task("taskX", [(my_print, ["out a"] )],
                   file_dep=["i_dont_exist"])
         my_runner = runner.Runner(depfile.name, reporter)
-        assert False == my_runner.select_task(ExecNode(t1, None), {})
+        assert False == my_runner.select_task(ExecNode(t1), {})
         assert ('start', t1) == reporter.log.pop(0)
         assert ('fail', t1) == reporter.log.pop(0)
         assert not reporter.log
@@ -90,7 +94,7 @@ class TestRunner_SelectTask(object):
         t1 = Task("taskX", [(my_print, ["out a"] )], file_dep=[__file__])
         my_runner = runner.Runner(depfile.name, reporter)
         my_runner.dep_manager.save_success(t1)
-        assert False == my_runner.select_task(ExecNode(t1, None), {})
+        assert False == my_runner.select_task(ExecNode(t1), {})
         assert ('start', t1) == reporter.log.pop(0)
         assert ('up-to-date', t1) == reporter.log.pop(0)
         assert not reporter.log
@@ -99,7 +103,7 @@ class TestRunner_SelectTask(object):
         t1 = Task("taskX", [(my_print, ["out a"] )])
         my_runner = runner.Runner(depfile.name, reporter)
         my_runner.dep_manager.ignore(t1)
-        assert False == my_runner.select_task(ExecNode(t1, None), {})
+        assert False == my_runner.select_task(ExecNode(t1), {})
         assert ('start', t1) == reporter.log.pop(0)
         assert ('ignore', t1) == reporter.log.pop(0)
         assert not reporter.log
@@ -108,14 +112,14 @@ class TestRunner_SelectTask(object):
         t1 = Task("taskX", [(my_print, ["out a"] )])
         my_runner = runner.Runner(depfile.name, reporter, always_execute=True)
         my_runner.dep_manager.save_success(t1)
-        assert True == my_runner.select_task(ExecNode(t1, None), {})
+        assert True == my_runner.select_task(ExecNode(t1), {})
         assert ('start', t1) == reporter.log.pop(0)
         assert not reporter.log
 
     def test_noSetup_ok(self, reporter, depfile):
         t1 = Task("taskX", [(my_print, ["out a"] )])
         my_runner = runner.Runner(depfile.name, reporter)
-        assert True == my_runner.select_task(ExecNode(t1, None), {})
+        assert True == my_runner.select_task(ExecNode(t1), {})
         assert ('start', t1) == reporter.log.pop(0)
         assert not reporter.log
 
@@ -123,7 +127,7 @@ class TestRunner_SelectTask(object):
         t1 = Task("taskX", [(my_print, ["out a"] )], setup=["taskY"])
         my_runner = runner.Runner(depfile.name, reporter)
         # defer execution
-        n1 = ExecNode(t1, None)
+        n1 = ExecNode(t1)
         assert False == my_runner.select_task(n1, {})
         assert ('start', t1) == reporter.log.pop(0)
         assert not reporter.log
@@ -136,9 +140,9 @@ class TestRunner_SelectTask(object):
         def ok(): return {'x':1}
         def check_x(my_x): return my_x == 1
         t1 = Task('t1', [(ok,)])
-        n1 = ExecNode(t1, None)
+        n1 = ExecNode(t1)
         t2 = Task('t2', [(check_x,)], getargs={'my_x':('t1','x')})
-        n2 = ExecNode(t2, None)
+        n2 = ExecNode(t2)
         my_runner = runner.Runner(depfile.name, reporter)
 
         # t2 gives chance for setup tasks to be executed
@@ -163,9 +167,9 @@ class TestRunner_SelectTask(object):
         # invalid getargs. Exception wil be raised and task will fail
         def check_x(my_x): return True
         t1 = Task('t1', [lambda :True])
-        n1 = ExecNode(t1, None)
+        n1 = ExecNode(t1)
         t2 = Task('t2', [(check_x,)], getargs={'my_x':('t1','x')})
-        n2 = ExecNode(t2, None)
+        n2 = ExecNode(t2)
         my_runner = runner.Runner(depfile.name, reporter)
 
         # t2 gives chance for setup tasks to be executed
@@ -189,7 +193,7 @@ class TestRunner_SelectTask(object):
     def test_getargs_dict(self, reporter, depfile):
         def ok(): return {'x':1}
         t1 = Task('t1', [(ok,)])
-        n1 = ExecNode(t1, None)
+        n1 = ExecNode(t1)
         t2 = Task('t2', None, getargs={'my_x':('t1', None)})
         tasks_dict = {'t1': t1, 't2':t2}
         my_runner = runner.Runner(depfile.name, reporter)
@@ -210,7 +214,7 @@ class TestRunner_SelectTask(object):
         tasks_dict = {'t1': t1, 't1a':t1a, 't2':t2}
         my_runner = runner.Runner(depfile.name, reporter)
         t1a_result = my_runner.execute_task(t1a)
-        my_runner.process_task_result(ExecNode(t1a, None), t1a_result)
+        my_runner.process_task_result(ExecNode(t1a), t1a_result)
 
         # t2.options are set on _get_task_args
         assert {} == t2.options
@@ -272,8 +276,8 @@ class TestTask_RunAll(object):
         assert not reporter.log
 
 
-# run tests in both single process runner and multi-process runner
-RUNNERS = [runner.Runner]
+# run tests in single process, multi-process and multi-thread runners
+RUNNERS = [runner.Runner, runner.MThreadRunner]
 # TODO: test should be added and skipped!
 if runner.MRunner.available():
     RUNNERS.append(runner.MRunner)
@@ -309,6 +313,14 @@ def cov_dec(func): # pragma: no cover
 def ok(): return "ok"
 def ok2(): return "different"
 
+def task_log(log, task):
+    """@return (list - str) reporter events of a task
+
+    MRunner sends tasks to workers before previous tasks finish,
+    so events of different tasks might be interleaved.
+    """
+    return [event for event, log_task in log if log_task is task]
+
 class TestRunner_run_tasks(object):
 
     def test_teardown(self, reporter, RunnerClass, depfile):
@@ -327,12 +339,9 @@ class TestRunner_run_tasks(object):
         my_runner = RunnerClass(depfile.name, reporter)
         my_runner.run_tasks(TaskDispatcher({'t1':t1, 't2':t2}, [], ['t1', 't2']))
         assert runner.SUCCESS == my_runner.finish()
-        assert ('start', t1) == reporter.log.pop(0), reporter.log
-        assert ('execute', t1) == reporter.log.pop(0)
-        assert ('success', t1) == reporter.log.pop(0)
-        assert ('start', t2) == reporter.log.pop(0)
-        assert ('execute', t2) == reporter.log.pop(0)
-        assert ('success', t2) == reporter.log.pop(0)
+        assert ['start', 'execute', 'success'] == task_log(reporter.log, t1)
+        assert ['start', 'execute', 'success'] == task_log(reporter.log, t2)
+        assert 6 == len(reporter.log)
 
     # test result, value, out, err are saved into task
     def test_result(self, reporter, RunnerClass, depfile):
@@ -353,6 +362,13 @@ class TestRunner_run_tasks(object):
         assert {'bb': 5} == task.values
         assert ['out here'] == [a.out for a in task.actions]
         assert ['err here'] == [a.err for a in task.actions]
+        wall, cpu = task.duration
+        assert wall >= 0
+        # CPU time is measured only if task is alone on its process
+        if RunnerClass is runner.MThreadRunner:
+            assert None == cpu
+        else:
+            assert cpu >= 0
 
     # whenever a task fails remaining task are not executed
     def test_failureOutput(self, reporter, RunnerClass, depfile):
@@ -361,11 +377,9 @@ class TestRunner_run_tasks(object):
         my_runner = RunnerClass(depfile.name, reporter)
         my_runner.run_tasks(TaskDispatcher({'t1':t1, 't2':t2}, [], ['t1', 't2']))
         assert runner.FAILURE == my_runner.finish()
-        assert ('start', t1) == reporter.log.pop(0)
-        assert ('execute', t1) == reporter.log.pop(0)
-        assert ('fail', t1) == reporter.log.pop(0)
-        # second task is not executed
-        assert 0 == len(reporter.log)
+        assert ['start', 'execute', 'fail'] == task_log(reporter.log, t1)
+        # second task is not executed (might be already selected)
+        assert task_log(reporter.log, t2) in ([], ['start'])
 
 
     def test_error(self, reporter, RunnerClass, depfile):
@@ -374,11 +388,9 @@ class TestRunner_run_tasks(object):
         my_runner = RunnerClass(depfile.name, reporter)
         my_runner.run_tasks(TaskDispatcher({'t1':t1, 't2':t2}, [], ['t1', 't2']))
         assert runner.ERROR == my_runner.finish()
-        assert ('start', t1) == reporter.log.pop(0)
-        assert ('execute', t1) == reporter.log.pop(0)
-        assert ('fail', t1) == reporter.log.pop(0)
-        # second task is not executed
-        assert 0 == len(reporter.log)
+        assert ['start', 'execute', 'fail'] == task_log(reporter.log, t1)
+        # second task is not executed (might be already selected)
+        assert task_log(reporter.log, t2) in ([], ['start'])
 
 
     # when successful dependencies are updated
@@ -403,6 +415,68 @@ class TestRunner_run_tasks(object):
         assert d._get("t1", os.path.abspath(depPath))
 
 
+    def test_checkpoint(self, reporter, RunnerClass, depfile, monkeypatch):
+        checkpoints = []
+        monkeypatch.setattr(depfile, 'checkpoint',
+                            lambda: checkpoints.append(len(reporter.log)))
+        tasks = dict((name, Task(name, [(ok,)])) for name in ('t1','t2','t3'))
+        my_runner = RunnerClass(depfile.name, reporter, dep_manager=depfile,
+                                checkpoint=2)
+        my_runner.run_tasks(TaskDispatcher(tasks, [], ['t1', 't2', 't3']))
+        assert runner.SUCCESS == my_runner.finish()
+        # saved once, after success of t2
+        assert 1 == len(checkpoints)
+        assert ('success', tasks['t2']) == reporter.log[checkpoints[0] - 1]
+
+    def test_prefetch(self, reporter, RunnerClass, depfile, dependency1):
+        tasks = {'t1': Task('t1', [(ok,)], file_dep=[dependency1]),
+                 't2': Task('t2', [(ok,)], file_dep=[dependency1]),
+                 }
+        my_runner = RunnerClass(depfile.name, reporter, dep_manager=depfile,
+                                prefetch=2)
+        result = my_runner.run_all(TaskDispatcher(tasks, [], ['t1', 't2']))
+        assert runner.SUCCESS == result
+        assert None == my_runner._prefetch
+        assert ('success', tasks['t2']) == reporter.log[-1]
+        # prefetch threads run on the same process as Runner and MThreadRunner
+        cpu = tasks['t1'].duration[1]
+        assert (RunnerClass is runner.MRunner) == (cpu is not None)
+
+    def test_early_cutoff(self, reporter, RunnerClass, depfile, dependency1):
+        def write_same():
+            fh = open(dependency1, 'w')
+            fh.write("whatever")
+            fh.close()
+        tasks = {'t1': Task('t1', [(write_same,)], targets=[dependency1]),
+                 't2': Task('t2', [(ok,)], file_dep=[dependency1],
+                            task_dep=['t1']),
+                 }
+        depfile.save_success(tasks['t2'])
+        state = depfile._get('t2', dependency1)
+        time.sleep(0.01)
+        my_runner = RunnerClass(depfile.name, reporter, dep_manager=depfile,
+                                early_cutoff=True)
+        result = my_runner.run_all(TaskDispatcher(tasks, [], ['t2']))
+        assert runner.SUCCESS == result
+        assert ('success', tasks['t1']) == reporter.log[2]
+        assert ('up-to-date', tasks['t2']) == reporter.log[4]
+        assert dependency1 in depfile.target_sigs
+        assert state[0] != depfile._get('t2', dependency1)[0]
+
+    def test_checkpoint_time(self, reporter, RunnerClass, depfile,
+                             monkeypatch):
+        checkpoints = []
+        monkeypatch.setattr(depfile, 'checkpoint',
+                            lambda: checkpoints.append(True))
+        tasks = dict((name, Task(name, [(ok,)])) for name in ('t1','t2'))
+        my_runner = RunnerClass(depfile.name, reporter, dep_manager=depfile,
+                                checkpoint_time=60)
+        my_runner._checkpoint_last -= 61
+        my_runner.run_tasks(TaskDispatcher(tasks, [], ['t1', 't2']))
+        assert runner.SUCCESS == my_runner.finish()
+        # time elapsed only before first task
+        assert 1 == len(checkpoints)
+
     def test_continue(self, reporter, RunnerClass, depfile):
         t1 = Task("t1", [(_fail,)] )
         t2 = Task("t2", [(_error,)] )
@@ -411,16 +485,10 @@ class TestRunner_run_tasks(object):
         disp = TaskDispatcher({'t1':t1, 't2':t2, 't3':t3}, [], ['t1', 't2', 't3'])
         my_runner.run_tasks(disp)
         assert runner.ERROR == my_runner.finish()
-        assert ('start', t1) == reporter.log.pop(0)
-        assert ('execute', t1) == reporter.log.pop(0)
-        assert ('fail', t1) == reporter.log.pop(0)
-        assert ('start', t2) == reporter.log.pop(0)
-        assert ('execute', t2) == reporter.log.pop(0)
-        assert ('fail', t2) == reporter.log.pop(0)
-        assert ('start', t3) == reporter.log.pop(0)
-        assert ('execute', t3) == reporter.log.pop(0)
-        assert ('success', t3) == reporter.log.pop(0)
-        assert 0 == len(reporter.log)
+        assert ['start', 'execute', 'fail'] == task_log(reporter.log, t1)
+        assert ['start', 'execute', 'fail'] == task_log(reporter.log, t2)
+        assert ['start', 'execute', 'success'] == task_log(reporter.log, t3)
+        assert 9 == len(reporter.log)
 
 
     def test_continue_dont_execute_parent_of_failed_task(self, reporter,
@@ -432,15 +500,10 @@ class TestRunner_run_tasks(object):
         disp = TaskDispatcher({'t1':t1, 't2':t2, 't3':t3}, [], ['t1', 't2', 't3'])
         my_runner.run_tasks(disp)
         assert runner.ERROR == my_runner.finish()
-        assert ('start', t1) == reporter.log.pop(0)
-        assert ('execute', t1) == reporter.log.pop(0)
-        assert ('fail', t1) == reporter.log.pop(0)
-        assert ('start', t2) == reporter.log.pop(0)
-        assert ('fail', t2) == reporter.log.pop(0)
-        assert ('start', t3) == reporter.log.pop(0)
-        assert ('execute', t3) == reporter.log.pop(0)
-        assert ('success', t3) == reporter.log.pop(0)
-        assert 0 == len(reporter.log)
+        assert ['start', 'execute', 'fail'] == task_log(reporter.log, t1)
+        assert ['start', 'fail'] == task_log(reporter.log, t2)
+        assert ['start', 'execute', 'success'] == task_log(reporter.log, t3)
+        assert 8 == len(reporter.log)
 
 
     def test_continue_dep_error(self, reporter, RunnerClass, depfile):
@@ -499,6 +562,87 @@ class TestRunner_run_tasks(object):
         my_runner.finish()
 
 
+class TestDryRunner(object):
+    def test_calc_dep(self, reporter, depfile, dependency1):
+        tasks = {'c1': Task('c1', [(ok,)]),
+                 't1': Task('t1', [(ok,)], calc_dep=['c1']),
+                 't2': Task('t2', [(ok,)], file_dep=[dependency1]),
+                 }
+        depfile.save_success(tasks['t2'])
+        my_runner = runner.DryRunner(depfile.name, reporter,
+                                     dep_manager=depfile)
+        td = TaskDispatcher(tasks, [], ['t1', 't2'])
+        assert runner.SUCCESS == my_runner.run_all(td)
+        assert [tasks['c1'], tasks['t1']] == my_runner.plan
+        assert [tasks['t2']] == my_runner.uptodate
+        assert ('up-to-date', tasks['t2']) == reporter.log[-1]
+        # DB is closed, check content saved on file
+        assert not depfile.__class__(depfile.name)._in('c1')
+
+    def test_task_dep(self, reporter, depfile, dependency1):
+        tasks = {'t1': Task('t1', [(ok,)]),
+                 't2': Task('t2', [(ok,)], file_dep=[dependency1],
+                            task_dep=['t1']),
+                 }
+        depfile.save_success(tasks['t2'])
+        my_runner = runner.DryRunner(depfile.name, reporter,
+                                     dep_manager=depfile)
+        td = TaskDispatcher(tasks, [], ['t2'])
+        assert runner.SUCCESS == my_runner.run_all(td)
+        # task_dep only defines execution order
+        assert [tasks['t1']] == my_runner.plan
+        assert [tasks['t2']] == my_runner.uptodate
+
+    def test_target_file_dep(self, reporter, depfile, dependency1):
+        tasks = {'t1': Task('t1', [(ok,)], targets=[dependency1]),
+                 't2': Task('t2', [(ok,)], file_dep=[dependency1],
+                            task_dep=['t1']),
+                 }
+        depfile.save_success(tasks['t2'])
+        my_runner = runner.DryRunner(depfile.name, reporter,
+                                     dep_manager=depfile)
+        td = TaskDispatcher(tasks, {dependency1: 't1'}, ['t2'])
+        assert runner.SUCCESS == my_runner.run_all(td)
+        assert [tasks['t1'], tasks['t2']] == my_runner.plan
+
+    def test_result_dep(self, reporter, depfile):
+        tasks = {'t1': Task('t1', [(ok,)]),
+                 't2': Task('t2', [(ok,)], uptodate=[result_dep('t1')]),
+                 't3': Task('t3', [(ok,)], uptodate=[True], task_dep=['t1']),
+                 }
+        my_runner = runner.DryRunner(depfile.name, reporter,
+                                     dep_manager=depfile)
+        td = TaskDispatcher(tasks, [], ['t2', 't3'])
+        assert runner.SUCCESS == my_runner.run_all(td)
+        assert [tasks['t1'], tasks['t2']] == my_runner.plan
+        assert [tasks['t3']] == my_runner.uptodate
+
+    def test_error(self, reporter, depfile, dependency1):
+        tasks = {'t1': Task('t1', [(ok,)], file_dep=['i_dont_exist']),
+                 't2': Task('t2', [(ok,)], task_dep=['t1']),
+                 }
+        depfile._set('t1', 'xxx', 'yyy')
+        my_runner = runner.DryRunner(depfile.name, reporter,
+                                     dep_manager=depfile)
+        td = TaskDispatcher(tasks, [], ['t2'])
+        assert runner.ERROR == my_runner.run_all(td)
+        assert [] == my_runner.plan
+        assert 'fail' == reporter.log[1][0]
+        assert 'fail' == reporter.log[3][0]
+        # saved values not removed
+        assert 'yyy' == depfile._get('t1', 'xxx')
+
+    def test_close_without_saving(self, reporter, depfile):
+        tasks = {'t1': Task('t1', [(ok,)])}
+        depfile._set('t1', 'xxx', 'yyy')
+        my_runner = runner.DryRunner(depfile.name, reporter,
+                                     dep_manager=depfile)
+        assert runner.SUCCESS == my_runner.run_all(
+            TaskDispatcher(tasks, [], ['t1']))
+        assert depfile._closed
+        assert None == depfile.__class__(depfile.name)._get('t1', 'xxx')
+
+
 class TestMReporter(object):
     class MyRunner(object):
         def __init__(self):
@@ -509,8 +653,25 @@ class TestMReporter(object):
         mp_reporter = runner.MReporter(fake_runner, reporter)
         my_task = Task("task x", [])
         mp_reporter.add_success(my_task)
+        # sent by background thread
+        got = fake_runner.result_q.get(True, 1)
+        assert [{'name': "task x", "reporter": 'add_success'}] == got
+        mp_reporter.close()
+
+    def testSendBatch(self, reporter, monkeypatch):
+        monkeypatch.setattr(runner.MReporter, 'FLUSH_TIME', 10)
+        fake_runner = self.MyRunner()
+        mp_reporter = runner.MReporter(fake_runner, reporter)
+        my_task = Task("task x", [])
+        mp_reporter.execute_task(my_task)
+        mp_reporter.send({'name': "task x"})
+        mp_reporter.teardown_task(my_task)
+        mp_reporter.close()
+        got = fake_runner.result_q.get(True, 1)
+        assert [{'name': "task x", "reporter": 'execute_task'},
+                {'name': "task x"}] == got
         got = fake_runner.result_q.get(True, 1)
-        assert {'name': "task x", "reporter": 'add_success'} == got
+        assert [{'name': "task x", "reporter": 'teardown_task'}] == got
 
     def testNonReporterMethod(self, reporter):
         fake_runner = self.MyRunner()
@@ -571,13 +732,141 @@ class TestMRunner_get_next_task(object):
         assert t1 == run.get_next_task(None).task
 
         # hold until t1 finishes
-        assert 0 == run.free_proc
         assert isinstance(run.get_next_task(None), runner.Hold)
-        assert 1 == run.free_proc
 # python2.5 dont have class decorators
 pytest.mark.skipif('not runner.MRunner.available()')(TestMRunner_get_next_task)
 
 
+class TestMRunner_dispatch_tasks(object):
+    def test_balance(self, reporter, depfile):
+        tasks = dict((name, Task(name, [])) for name in ('t1', 't2', 't3'))
+        td = TaskDispatcher(tasks, [], ['t1', 't2', 't3'])
+        run = runner.MRunner(depfile.name, reporter, num_process=2)
+        run._run_tasks_init(td)
+        task_qs = [Queue(), Queue()]
+        run._dispatch_tasks(task_qs, None)
+        assert [2, 1] == run.pending
+        assert run.dispatch_done
+        assert 't1' == task_qs[0].get()[0]
+        assert 't3' == task_qs[0].get()[0]
+        assert 't2' == task_qs[1].get()[0]
+        run.finish()
+
+    def test_queue_depth(self, reporter, depfile):
+        tasks = dict((name, Task(name, [])) for name in ('t1', 't2', 't3'))
+        td = TaskDispatcher(tasks, [], ['t1', 't2', 't3'])
+        run = runner.MRunner(depfile.name, reporter, num_process=1)
+        run._run_tasks_init(td)
+        task_qs = [Queue()]
+        run._dispatch_tasks(task_qs, None)
+        assert [2] == run.pending
+        assert not run.dispatch_done
+        n1 = td.nodes['t1']
+        n1.run_status = 'successful'
+        run.pending[0] -= 1
+        run._dispatch_tasks(task_qs, n1)
+        assert [2] == run.pending
+        assert ['t1', 't2', 't3'] == [task_qs[0].get()[0] for _ in range(3)]
+        run.finish()
+
+    def test_hold(self, reporter, depfile):
+        t1 = Task('t1', [])
+        t2 = Task('t2', [], task_dep=['t1'])
+        td = TaskDispatcher({'t1':t1, 't2':t2}, [], ['t1', 't2'])
+        run = runner.MRunner(depfile.name, reporter, num_process=2)
+        run._run_tasks_init(td)
+        task_qs = [Queue(), Queue()]
+        run._dispatch_tasks(task_qs, None)
+        # t2 waits for t1, no Hold is sent to workers
+        assert [1, 0] == run.pending
+        assert not run.dispatch_done
+        run.finish()
+
+    def test_cancel(self, reporter, depfile):
+        run = runner.MRunner(depfile.name, reporter, num_process=2)
+        run.pending = [2, 1]
+        task_qs = [ThreadQueue(), ThreadQueue()]
+        task_qs[0].put(Task('t2', []))
+        run._cancel_tasks(task_qs)
+        # t1 and t3 being executed
+        assert [1, 1] == run.pending
+        assert task_qs[0].empty()
+        run.finish()
+
+    def test_resources(self, reporter, depfile):
+        t1 = Task('t1', [], resources={'mem': 3})
+        t2 = Task('t2', [], resources={'mem': 2, 'other': 5})
+        t3 = Task('t3', [])
+        tasks = {'t1':t1, 't2':t2, 't3':t3}
+        td = TaskDispatcher(tasks, [], ['t1', 't2', 't3'])
+        run = runner.MRunner(depfile.name, reporter, num_process=2,
+                             resources={'mem': 4})
+        run._run_tasks_init(td)
+        task_qs = [Queue(), Queue()]
+        run._dispatch_tasks(task_qs, None)
+        # t2 waits for t1 to release 'mem', t3 is not blocked
+        assert ['t2'] == [n.task.name for n in run.ready_nodes]
+        assert {'mem': 3} == run.resources_used
+        assert 't1' == task_qs[0].get()[0]
+        assert 't3' == task_qs[1].get()[0]
+        # t1 finished
+        n1 = td.nodes['t1']
+        n1.run_status = 'successful'
+        run.pending[0] -= 1
+        run._release_resources(t1)
+        run._dispatch_tasks(task_qs, n1)
+        assert [] == run.ready_nodes
+        assert {'mem': 2} == run.resources_used
+        assert 't2' == task_qs[0].get()[0]
+        assert run.dispatch_done
+        run.finish()
+
+    def test_resources_idle_worker(self, reporter, depfile):
+        # t2 is not put on a queue after another task,
+        # it would hold 'mem' while waiting
+        t1 = Task('t1', [])
+        t2 = Task('t2', [], resources={'mem': 1})
+        t3 = Task('t3', [])
+        tasks = {'t1':t1, 't2':t2, 't3':t3}
+        td = TaskDispatcher(tasks, [], ['t1', 't2', 't3'])
+        run = runner.MRunner(depfile.name, reporter, num_process=2,
+                             resources={'mem': 4})
+        run._run_tasks_init(td)
+        run.pending = [1, 0] # t0 being executed by worker 0
+        task_qs = [Queue(), Queue()]
+        run._dispatch_tasks(task_qs, None)
+        # t2 waits for an idle worker, t3 is not put on idle worker's queue
+        assert 't1' == task_qs[1].get()[0]
+        assert 't3' == task_qs[0].get()[0]
+        assert [2, 1] == run.pending
+        assert ['t2'] == [n.task.name for n in run.ready_nodes]
+        assert {'mem': 0} == run.resources_used
+        # worker 1 finished t1
+        n1 = td.nodes['t1']
+        n1.run_status = 'successful'
+        run.pending[1] -= 1
+        run._dispatch_tasks(task_qs, n1)
+        assert 't2' == task_qs[1].get()[0]
+        assert {'mem': 1} == run.resources_used
+        run.finish()
+
+    def test_resources_over_capacity(self, reporter, depfile):
+        # executed alone
+        t1 = Task('t1', [], resources={'mem': 8})
+        t2 = Task('t2', [], resources={'mem': 1})
+        td = TaskDispatcher({'t1':t1, 't2':t2}, [], ['t1', 't2'])
+        run = runner.MRunner(depfile.name, reporter, num_process=2,
+                             resources={'mem': 4})
+        run._run_tasks_init(td)
+        task_qs = [Queue(), Queue()]
+        run._dispatch_tasks(task_qs, None)
+        assert [1, 0] == run.pending
+        assert ['t2'] == [n.task.name for n in run.ready_nodes]
+        run.finish()
+# python2.5 dont have class decorators
+pytest.mark.skipif('not runner.MRunner.available()')(TestMRunner_dispatch_tasks)
+
+
 class TestMRunner_start_process(object):
     # 2 process, 3 tasks
     def test_all_processes(self, reporter, monkeypatch, depfile):
@@ -589,13 +878,13 @@ class TestMRunner_start_process(object):
         run = runner.MRunner(depfile.name, reporter, num_process=2)
         run._run_tasks_init(td)
         result_q = Queue()
-        task_q = Queue()
+        task_qs = [Queue(), Queue()]
 
-        proc_list = run._run_start_processes(task_q, result_q)
+        proc_list = run._run_start_processes(task_qs, result_q)
         run.finish()
         assert 2 == len(proc_list)
-        assert t1.name == task_q.get().name
-        assert t2.name == task_q.get().name
+        assert t1.name == task_qs[0].get()[0]
+        assert t2.name == task_qs[1].get()[0]
 
 
     # 2 process, 1 task
@@ -607,12 +896,13 @@ class TestMRunner_start_process(object):
         run = runner.MRunner(depfile.name, reporter, num_process=2)
         run._run_tasks_init(td)
         result_q = Queue()
-        task_q = Queue()
+        task_qs = [Queue(), Queue()]
 
-        proc_list = run._run_start_processes(task_q, result_q)
+        proc_list = run._run_start_processes(task_qs, result_q)
         run.finish()
         assert 1 == len(proc_list)
-        assert t1.name == task_q.get().name
+        assert 1 == len(task_qs)
+        assert t1.name == task_qs[0].get()[0]
 
 
     # 2 process, 2 tasks (but only one task can be started)
@@ -625,13 +915,12 @@ class TestMRunner_start_process(object):
         run = runner.MRunner(depfile.name, reporter, num_process=2)
         run._run_tasks_init(td)
         result_q = Queue()
-        task_q = Queue()
+        task_qs = [Queue(), Queue()]
 
-        proc_list = run._run_start_processes(task_q, result_q)
+        proc_list = run._run_start_processes(task_qs, result_q)
         run.finish()
         assert 2 == len(proc_list)
-        assert t1.name == task_q.get().name
-        assert isinstance(task_q.get(), runner.Hold)
+        assert t1.name == task_qs[0].get()[0]
 # python2.5 dont have class decorators
 pytest.mark.skipif('not runner.MRunner.available()')(TestMRunner_start_process)
 
@@ -643,10 +932,159 @@ class TestMRunner_execute_task(object):
         task_q.put(runner.Hold()) # to test
         task_q.put(None) # to terminate function
         result_q = Queue()
-        run.execute_task_subprocess(task_q, result_q)
+        run.execute_task_subprocess(0, [task_q], result_q)
         run.finish()
         # nothing was done
         assert result_q.empty() # pragma: no cover (coverage bug?)
+
+    def test_error_before_task(self, reporter, depfile):
+        run = runner.MRunner(depfile.name, reporter)
+        run.tasks = {}
+        task_q = ThreadQueue()
+        task_q.put(('not_exist', None, None, None))
+        result_q = ThreadQueue()
+        run.execute_task_subprocess(0, [task_q], result_q)
+        got = result_q.get(True, 1)
+        assert [{'name': None, 'exit': KeyError,
+                 'exception': "'not_exist'"}] == got
+        # master raises worker exception
+        pytest.raises(KeyError, run._process_result, got[0], [])
+        run.finish()
+
+    def test_steal(self, reporter, depfile):
+        t1 = Task('t1', [])
+        run = runner.MRunner(depfile.name, reporter)
+        run.tasks = {'t1': t1}
+        task_qs = [ThreadQueue(), ThreadQueue()]
+        task_qs[1].put(t1)
+        task_qs[1].put(None)
+        # task from other queue, termination is left on other queue
+        assert (t1, 1) == run._get_task(0, task_qs)
+        task_qs[0].put(None)
+        assert (None, 0) == run._get_task(0, task_qs)
+        assert None == task_qs[1].get_nowait()
+        run.finish()
+
+    def test_task_message(self, reporter, depfile):
+        t1 = Task('t1', [], file_dep=['a'], targets=['b'])
+        t2 = Task('t2', [], calc_dep=['t1'])
+        run = runner.MRunner(depfile.name, reporter)
+        run.tasks = {'t1': t1, 't2': t2}
+        t1.options = {'x': 1}
+        t1.dep_changed = ['a']
+        msg = run._task_message(t1)
+        assert ('t1', {'x': 1}, ['a'], None) == msg
+        # task from worker's table is updated
+        run.tasks['t1'] = t1_worker = t1.clone()
+        assert t1_worker is run._task_from_message(msg)
+        assert {'x': 1} == t1_worker.options
+        assert ['a'] == t1_worker.dep_changed
+        # file_dep might be modified by calc_dep
+        run.tasks['t2'] = t2_worker = t2.clone()
+        t2.file_dep.add('c')
+        run._task_from_message(run._task_message(t2))
+        assert set(['c']) == t2_worker.file_dep
+        run.finish()
+
+    def test_calc_dep_file_dep(self, reporter, depfile, dependency1):
+        # worker process is created before calc_dep is executed,
+        # file_dep computed by master must be sent with task message
+        def get_deps(dependencies):
+            return {'deps': list(dependencies)}
+        tasks = {'c1': Task('c1', [(lambda: {'file_dep': [dependency1]},)]),
+                 't1': Task('t1', [(get_deps,)], calc_dep=['c1']),
+                 }
+        run = runner.MRunner(depfile.name, reporter, num_process=1)
+        assert runner.SUCCESS == run.run_all(
+            TaskDispatcher(tasks, {}, ['t1']))
+        assert {'deps': [dependency1]} == tasks['t1'].values
 # python2.5 dont have class decorators
 pytest.mark.skipif('not runner.MRunner.available()')(TestMRunner_execute_task)
 
+
+def _touch_after(path, seconds, result=None):
+    time.sleep(seconds)
+    open(path, 'w').close()
+    return result
+
+class TestMRunner_stop(object):
+    def test_failure_stops_queued_task(self, reporter, depfile, tmpdir):
+        # t2 is sent to worker's queue while t1 is executed
+        assert runner.MRunner.QUEUE_DEPTH > 1
+        t1 = Task('t1', [(_touch_after, [str(tmpdir.join('t1')), 0.2, False])])
+        t2 = Task('t2', [(_touch_after, [str(tmpdir.join('t2')), 0])])
+        run = runner.MRunner(depfile.name, reporter, num_process=1)
+        td = TaskDispatcher({'t1': t1, 't2': t2}, [], ['t1', 't2'])
+        assert runner.FAILURE == run.run_all(td)
+        assert tmpdir.join('t1').check()
+        assert not tmpdir.join('t2').check()
+        assert 'execute' not in task_log(reporter.log, t2)
+        assert [0] == run.pending
+
+    def test_failure_stops_other_workers(self, reporter, depfile, tmpdir):
+        def task(name, seconds, result=None):
+            path = str(tmpdir.join(name))
+            return Task(name, [(_touch_after, [path, seconds, result])])
+        tasks = {'t1': task('t1', 0.2, False), 't2': task('t2', 0.5),
+                 't3': task('t3', 0), 't4': task('t4', 0)}
+        run = runner.MRunner(depfile.name, reporter, num_process=2)
+        td = TaskDispatcher(tasks, [], ['t1', 't2', 't3', 't4'])
+        assert runner.FAILURE == run.run_all(td)
+        # t2 was being executed when t1 failed
+        assert tmpdir.join('t2').check()
+        assert not tmpdir.join('t3').check()
+        assert not tmpdir.join('t4').check()
+        assert [0, 0] == run.pending
+
+    def test_continue(self, reporter, depfile, tmpdir):
+        t1 = Task('t1', [(_touch_after, [str(tmpdir.join('t1')), 0.2, False])])
+        t2 = Task('t2', [(_touch_after, [str(tmpdir.join('t2')), 0])])
+        run = runner.MRunner(depfile.name, reporter, num_process=1,
+                             continue_=True)
+        td = TaskDispatcher({'t1': t1, 't2': t2}, [], ['t1', 't2'])
+        assert runner.FAILURE == run.run_all(td)
+        assert tmpdir.join('t2').check()
+# python2.5 dont have class decorators
+pytest.mark.skipif('not runner.MRunner.available()')(TestMRunner_stop)
+
+
+class TestMThreadRunner(object):
+    def test_shared_tasks(self, reporter, depfile):
+        # closures work, task is not pickled
+        executed = []
+        t1 = Task('t1', [(lambda: executed.append('t1'),)],
+                  teardown=[(lambda: executed.append('teardown'),)])
+        t2 = Task('t2', [(lambda: executed.append('t2'),)], task_dep=['t1'])
+        td = TaskDispatcher({'t1':t1, 't2':t2}, [], ['t2'])
+        run = runner.MThreadRunner(depfile.name, reporter, num_process=2)
+        assert runner.SUCCESS == run.run_all(td)
+        # teardown executed by main thread
+        assert ['t1', 't2', 'teardown'] == executed
+        assert ('teardown', t1) == reporter.log[-1]
+
+    def test_python_action_output(self, reporter, depfile):
+        def say(name):
+            for _ in range(5):
+                sys.stdout.write(name)
+                time.sleep(0.002)
+        names = ['t%d' % num for num in range(4)]
+        tasks = dict((name, Task(name, [(say, [name])])) for name in names)
+        stdout, stderr = sys.stdout, sys.stderr
+        run = runner.MThreadRunner(depfile.name, reporter, num_process=4)
+        assert runner.SUCCESS == run.run_all(TaskDispatcher(tasks, [], names))
+        # std streams restored, each task got only its own output
+        assert stdout is sys.stdout
+        assert stderr is sys.stderr
+        for name in names:
+            assert name * 5 == tasks[name].actions[0].out
+
+    def test_hold(self, reporter, depfile):
+        run = runner.MThreadRunner(depfile.name, reporter)
+        task_q = ThreadQueue()
+        task_q.put(runner.Hold()) # to test
+        task_q.put(None) # to terminate function
+        result_q = ThreadQueue()
+        run.execute_task_thread(0, [task_q], result_q)
+        run.finish()
+        # nothing was done
+        assert result_q.empty()
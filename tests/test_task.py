@@ -66,6 +66,37 @@ class TestTaskInit(object):
         t = task.Task("task5", ['action'], setup=["task2"])
         assert ["task2"] == t.setup_tasks
 
+    def test_resources(self):
+        t = task.Task("MyName", None, resources={'mem': 4})
+        assert {'mem': 4} == t.resources
+        assert {'mem': 4} == t.clone().resources
+        pytest.raises(task.InvalidTask, task.Task, "MyName", None,
+                      resources=['mem'])
+        pytest.raises(task.InvalidTask, task.Task, "MyName", None,
+                      resources={'mem': -1})
+        pytest.raises(task.InvalidTask, task.Task, "MyName", None,
+                      resources={'mem': 0.5})
+
+    def test_taskcmd_lazy(self):
+        t = task.Task("MyName", None, params=[{'name':'p1', 'default':'x'}])
+        assert None == t._taskcmd
+        assert 'p1' == t.taskcmd.options[0].name
+        assert t.taskcmd is t._taskcmd
+
+
+class TestTaskPickle(object):
+
+    def test_pickle(self):
+        import pickle
+        t = task.Task("taskX", [(lambda: True)], file_dep=['f1'],
+                      teardown=["echo x"])
+        t.custom_attr = 'custom'
+        got = pickle.loads(pickle.dumps(t, 2))
+        assert 'taskX' == got.name
+        assert set(['f1']) == got.file_dep
+        assert 'custom' == got.custom_attr
+        assert not hasattr(got, '_actions')
+
 
 class TestTaskValueSavers(object):
     def test_execute_value_savers(self):
@@ -203,6 +234,14 @@ class TestTaskActions(object):
         t = task.Task("taskX", [PROGRAM])
         t.execute()
 
+    def test_duration(self):
+        t = task.Task("taskX", [PROGRAM])
+        assert None == t.duration
+        t.execute()
+        wall, cpu = t.duration
+        assert wall >= 0
+        assert cpu >= 0
+
 
     def test_result(self):
         # task.result is the value of last action